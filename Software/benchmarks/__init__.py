@@ -0,0 +1 @@
+"""Benchmarks for DHMViewer. Run them from the Software directory, e.g. `python -m benchmarks.startup`."""
@@ -0,0 +1,89 @@
+"""Codec benchmark of the saved TIFF products: write and read throughput and compression ratio of every codec.
+
+Uses the given TIFF images (e.g. saved height maps and wrapped phases) or, without any, a synthetic float32 height
+map. Throughputs are of the uncompressed data, in MB/s; the files are written to a temporary directory, use --dir
+to measure the storage the outputs are saved to.
+
+    python -m benchmarks.codecs 0_height_map.tiff 0_wrapped_phase.tiff --workers 4 --json codecs.json
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from typing import Dict, List, Optional
+import numpy as np
+import tifffile as tf
+from dhm import compression
+
+CODECS = ["none", "deflate,6", "deflate,6,predictor", "lzw,predictor", "zstd,1", "zstd,1,predictor",
+          "zstd,3,predictor", "zstd,9,predictor"]
+
+
+def synthetic_height_map(shape=(3000, 4000), seed: int = 0) -> np.ndarray:
+    """Smooth height map of a few cells with sensor noise, in micrometer"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:shape[0], 0:shape[1]].astype("float32")
+    height = np.zeros(shape, dtype="float32")
+    for cy, cx, r in rng.uniform((0, 0, 100), (shape[0], shape[1], 400), (12, 3)):
+        height += np.clip(1 - ((y - cy) ** 2 + (x - cx) ** 2) / r ** 2, 0, None) ** 0.5 * 4
+    return height + rng.normal(0, 0.02, shape).astype("float32")
+
+
+def bench_codec(image: np.ndarray, spec: str, workers: int, repeat: int, directory: str) -> Dict[str, float]:
+    """Median write and read throughput in MB/s and the compression ratio of one codec"""
+    codec = compression.parse_codec(spec)
+    kwargs = compression.tiff_kwargs(codec, workers)
+    path = os.path.join(directory, "codec_bench.tiff")
+    write_times, read_times = [], []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        tf.imwrite(path, image, **kwargs)
+        write_times.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        read = tf.imread(path, maxworkers=workers)
+        read_times.append(time.perf_counter() - t)
+    assert np.array_equal(read, image)
+    size = os.path.getsize(path)
+    os.remove(path)
+    megabytes = image.nbytes / 1e6
+    return {"write_mb_s": megabytes / statistics.median(write_times),
+            "read_mb_s": megabytes / statistics.median(read_times), "ratio": image.nbytes / size}
+
+
+def run(images: Dict[str, np.ndarray], codecs: List[str], workers: int = 4, repeat: int = 3,
+        directory: Optional[str] = None) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Benchmark every codec on every image, results by image name and codec"""
+    results = {}
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        for name, image in images.items():
+            results[name] = {spec: bench_codec(image, spec, workers, repeat, temp_dir) for spec in codecs}
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", nargs="*", help="TIFF images to compress, a synthetic height map if none")
+    parser.add_argument("--codec", action="append", help="codec[,level][,predictor] to run, all if not given")
+    parser.add_argument("--workers", type=int, default=4, help="compression threads (maxworkers)")
+    parser.add_argument("--repeat", type=int, default=3, help="writes per codec")
+    parser.add_argument("--dir", help="write the files into this directory")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    images = {os.path.basename(path): tf.imread(path) for path in args.images} or \
+        {"synthetic_height_map": synthetic_height_map()}
+    results = run(images, args.codec or CODECS, args.workers, args.repeat, args.dir)
+    for name, codec_results in results.items():
+        print(f"{name}")
+        for spec, result in codec_results.items():
+            print(f"  {spec:<22} write {result['write_mb_s']:8.1f} MB/s  read {result['read_mb_s']:8.1f} MB/s"
+                  f"  ratio {result['ratio']:5.2f}")
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
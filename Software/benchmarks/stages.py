@@ -0,0 +1,180 @@
+"""Stage benchmark of the reconstruction on synthetic holograms (benchmarks.synthetic) of several sensor sizes.
+
+Times every stage of the off-axis pipeline as dhm.utils implements it (filter_fixed_point, fourier_process,
+apodization_process, angular_mask), the propagation and phase unwrapping as the engine runs them with its caches warm,
+the saving of the three off-axis products as HoloGram._save_results does it (output format, dtype, compression,
+pyramid, stack index and build log as configured), and full HoloGram.hologram_process / hologram_inline_process runs
+on frames written to a temporary directory (reading the frame included). Times are medians over the repeats, in seconds; the
+off-axis run also records the RMS error of its phase map against the known phase, so a faster but wrong change shows.
+Write the results with --json and compare the files of two commits with --compare. The output settings of a
+configuration receipt given with --config ([Output], [Compression]) apply to the saving and the full runs.
+
+    python -m benchmarks.stages --size 512 512 --size 3000 4000 --repeat 3 --json stages.json
+    python -m benchmarks.stages --size 2048 2048 --only save --config receipt.ini
+    python -m benchmarks.stages --compare before.json after.json
+"""
+import os
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from dhm import core, engine, utils
+from benchmarks import synthetic
+
+SIZES = [(512, 512), (1024, 1024), (2048, 2048), (3000, 4000)]
+STAGES = ["filter_fixed_point", "fourier_process", "apodization_process", "angular_mask", "propagation",
+          "unwrap_phase", "save", "hologram_process", "hologram_inline_process"]
+PARAMS = engine.ReconParams(pixel_x=1.85, pixel_y=1.85, refractive_index=1.52, magnification=20, wavelength=0.635,
+                            diffraction_distance=5.0, rec_start=40.0, rec_end=60.0, rec_zstack_qty=5,
+                            filter_type="Hann", filter_quadrant="1", filter_rate=1.2, apo_pad_size=100)
+SOFTWARE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _median_time(run: Callable[[], object], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def _hologram(shape: Tuple[int, int], mode: str, directory: str, config: Optional[str] = None) -> core.HoloGram:
+    """HoloGram reading the synthetic series of the mode written to directory, saving every product into
+    directory/out with the output settings of the configuration receipt, if given"""
+    synthetic.write_series(directory, mode, shape, frames=1)
+    hologram = core.HoloGram()
+    if config is not None:
+        hologram.read_config_receipt(config)
+    hologram.set_dhm_mode(mode)
+    hologram.set_sys_param(PARAMS.pixel_x, PARAMS.pixel_y, PARAMS.refractive_index, PARAMS.magnification,
+                           PARAMS.wavelength * 1000)
+    hologram.set_filter_param(PARAMS.apo_pad_size, PARAMS.filter_type, PARAMS.filter_rate * 100,
+                              PARAMS.filter_quadrant)
+    hologram.set_diffraction_dist(PARAMS.diffraction_distance)
+    hologram.set_recon_param(PARAMS.rec_start, PARAMS.rec_end, PARAMS.rec_zstack_qty)
+    hologram.set_read_path(os.path.join(directory, "holograms"))
+    hologram.set_back_path(os.path.join(directory, "background.tiff"))
+    hologram.set_background_img()
+    hologram.load_series()
+    os.makedirs(os.path.join(directory, "out"), exist_ok=True)
+    hologram.set_save_path(os.path.join(directory, "out"))
+    hologram.set_save_flags(True, True, True, True)
+    return hologram
+
+
+def bench_size(shape: Tuple[int, int], repeat: int = 3, stages: Optional[List[str]] = None,
+               directory: Optional[str] = None, config: Optional[str] = None) -> Dict[str, float]:
+    """Median time in seconds of every stage on holograms of the shape, saving with the output settings of the
+    configuration receipt config, if given"""
+    stages = stages or STAGES
+    sample = synthetic.offaxis_sample(shape)
+    params, cache = PARAMS, engine.EngineCache()
+    results = {}
+    # Inputs of every stage, computed once; a stage only times itself
+    fourier_filter = utils.filter_fixed_point(sample.hologram, params.filter_quadrant, params.filter_rate,
+                                              params.filter_type)
+    field = engine.offaxis_fields(sample.hologram[np.newaxis], sample.background, params, cache)[0]
+    apodized = engine.apodize_offaxis_stack(field, params, cache)
+    wrapped_phases, _ = engine.propagate_apodized_stack(apodized, params, cache=cache)
+    stage_runs = {
+        "filter_fixed_point": lambda: utils.filter_fixed_point(sample.hologram, params.filter_quadrant,
+                                                               params.filter_rate, params.filter_type),
+        "fourier_process": lambda: utils.fourier_process(sample.hologram, fourier_filter),
+        "apodization_process": lambda: utils.apodization_process(field[0], params.apo_k_factor, params.apo_pad_size),
+        "angular_mask": lambda: utils.angular_mask(apodized[0], params.vector, params.delta),
+        "propagation": lambda: engine.propagate_apodized_stack(apodized, params, cache=cache),
+        "unwrap_phase": lambda: utils.unwrap_phase(wrapped_phases[0]),
+    }
+    for stage, run in stage_runs.items():
+        if stage in stages:
+            results[stage] = _median_time(run, repeat)
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        if "save" in stages or "hologram_process" in stages:
+            hologram = _hologram(shape, "Offaxis", os.path.join(temp_dir, "offaxis"), config)
+            hologram.hologram_process(0, False)
+            if "save" in stages:
+                name = os.path.splitext(hologram.HOLO_LIST[0])[0]
+                results["save"] = _median_time(lambda: hologram._save_results(0, name), repeat)
+            if "hologram_process" in stages:
+                results["hologram_process"] = _median_time(lambda: hologram.hologram_process(0, False), repeat)
+                error = hologram.PHASE_MAP - sample.truth
+                error -= np.median(error)
+                results["hologram_process_phase_rms"] = float(np.sqrt(np.mean(error ** 2)))
+            hologram.close_outputs()
+        if "hologram_inline_process" in stages:
+            hologram = _hologram(shape, "Inline", os.path.join(temp_dir, "inline"), config)
+            results["hologram_inline_process"] = _median_time(lambda: hologram.hologram_inline_process(0, False),
+                                                              repeat)
+            hologram.close_outputs()
+    return results
+
+
+def environment() -> Dict[str, object]:
+    """Commit and machine the results were measured on"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SOFTWARE_DIR, check=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+            "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def run(sizes: List[Tuple[int, int]], repeat: int = 3, stages: Optional[List[str]] = None,
+        directory: Optional[str] = None, config: Optional[str] = None) -> Dict[str, object]:
+    """Run the stage benchmark on every size, results by size name ("HEIGHTxWIDTH") and stage"""
+    return {"environment": environment(), "repeat": repeat, "config": config,
+            "results": {f"{height}x{width}": bench_size((height, width), repeat, stages, directory, config)
+                        for height, width in sizes}}
+
+
+def compare(before: Dict[str, object], after: Dict[str, object]) -> None:
+    """Print the times of two result files side by side, with the speedup of the second"""
+    print(f"{'':<36}{before['environment']['commit'] or 'before':>12}{after['environment']['commit'] or 'after':>12}")
+    for size, stages in after["results"].items():
+        print(size)
+        for stage, value in stages.items():
+            previous = before["results"].get(size, {}).get(stage)
+            if stage.endswith("_rms"):
+                print(f"  {stage:<34}{'' if previous is None else f'{previous:12.4f}'}{value:12.4f}")
+            elif previous is None:
+                print(f"  {stage:<34}{'':>12}{value*1000:10.1f}ms")
+            else:
+                print(f"  {stage:<34}{previous*1000:10.1f}ms{value*1000:10.1f}ms  x{previous/value:.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, nargs=2, action="append", metavar=("HEIGHT", "WIDTH"),
+                        help="sensor size to run, all of 512x512 to 3000x4000 if not given")
+    parser.add_argument("--only", choices=STAGES, action="append", help="run only this stage")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage")
+    parser.add_argument("--dir", help="write the frames and outputs into this directory")
+    parser.add_argument("--config", help="configuration receipt whose output settings the saving uses")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as before, open(args.compare[1]) as after:
+            compare(json.load(before), json.load(after))
+        return
+    results = run([tuple(size) for size in args.size or SIZES], args.repeat, args.only, args.dir, args.config)
+    for size, stages in results["results"].items():
+        print(size)
+        for stage, value in stages.items():
+            print(f"  {stage:<34}" + (f"{value:10.4f} rad" if stage.endswith("_rms") else f"{value*1000:10.1f} ms"))
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Cold start benchmark: time of `import dhm.core` and time until the launcher window is shown.
+
+Every measurement runs in a fresh interpreter, as a GUI launch or a worker spawn would. Use
+`QT_QPA_PLATFORM=offscreen` to run the launcher benchmark on a headless machine.
+
+    python -m benchmarks.startup --repeat 5 --json startup.json
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+SOFTWARE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_CORE = """
+import time
+t = time.perf_counter()
+import dhm.core
+print(time.perf_counter() - t)
+"""
+
+_LAUNCHER_WINDOW = """
+import time
+t = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+from gui.main_window import start_ui
+launcher, main_window = start_ui()
+QApplication.processEvents()
+print(time.perf_counter() - t)
+"""
+
+BENCHMARKS = {
+    "import_dhm_core": _IMPORT_CORE,
+    "time_to_launcher_window": _LAUNCHER_WINDOW,
+}
+
+
+def _run_once(code: str) -> float:
+    """Run the snippet in a fresh interpreter and return the time it printed, in seconds"""
+    out = subprocess.run([sys.executable, "-c", code], cwd=SOFTWARE_DIR, check=True,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def run(repeat: int = 5, names: List[str] = None) -> Dict[str, Dict[str, float]]:
+    """Run the startup benchmarks, return the median, min and max time of each in seconds"""
+    results = {}
+    for name in names or BENCHMARKS:
+        times = [_run_once(BENCHMARKS[name]) for _ in range(repeat)]
+        results[name] = {"median_s": statistics.median(times), "min_s": min(times), "max_s": max(times)}
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per benchmark")
+    parser.add_argument("--only", choices=list(BENCHMARKS), action="append", help="run only this benchmark")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.only)
+    for name, result in results.items():
+        print(f"{name:<26} median {result['median_s']*1000:8.1f} ms"
+              f"  (min {result['min_s']*1000:.1f}, max {result['max_s']*1000:.1f})")
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
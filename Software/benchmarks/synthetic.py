@@ -0,0 +1,119 @@
+"""Deterministic synthetic holograms with known phase objects, for benchmarks and checks of the reconstruction.
+
+Off-axis holograms are the interference of a tilted plane reference wave with a sample wave carrying the phase of a
+few cells (spherical caps) and a tilted phase ramp; the carrier puts the sideband in the first quadrant, so the
+default filter settings reconstruct the object phase. In-line holograms are the intensity of the transmission of a
+few absorbing particles propagated back over a known distance. Both are lit by the same Gaussian beam as their
+background frame and carry sensor noise, quantized to 12 bits in uint16. The same seed always gives the same frames.
+
+    python -m benchmarks.synthetic sample_images/offaxis --mode Offaxis --shape 1024 1024 --frames 10
+"""
+import os
+import argparse
+from typing import NamedTuple, Tuple
+import numpy as np
+import tifffile as tf
+from dhm import engine, utils
+
+CARRIER = (-0.2, 0.2) # unit in cycles per pixel, along rows and columns: the sideband of the first quadrant
+FULL_WELL = 4095 # 12-bit sensor
+
+
+class Sample(NamedTuple):
+    """Synthetic hologram, background frame and the known object: phase in radian for off-axis holograms,
+    amplitude transmission for in-line holograms"""
+    hologram: np.ndarray
+    background: np.ndarray
+    truth: np.ndarray
+
+
+def _beam(shape: Tuple[int, int]) -> np.ndarray:
+    """Gaussian illumination, 1 at the center and about 0.6 at the corners"""
+    y, x = np.ogrid[-1:1:complex(0, shape[0]), -1:1:complex(0, shape[1])]
+    return np.exp(-(x ** 2 + y ** 2) / 4)
+
+
+def _sensor(hologram: np.ndarray, background: np.ndarray, rng: np.random.Generator,
+            noise: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Hologram and background intensities exposed alike, their maximum at 90 % of the full well, with gaussian
+    noise relative to it, quantized to uint16"""
+    exposure = 0.9 * FULL_WELL / max(hologram.max(), background.max())
+    frames = []
+    for intensity in (hologram, background):
+        counts = intensity * exposure + rng.normal(0, noise * FULL_WELL, intensity.shape)
+        frames.append(np.clip(np.rint(counts), 0, FULL_WELL).astype(np.uint16))
+    return frames[0], frames[1]
+
+
+def phase_object(shape: Tuple[int, int], seed: int = 0, cells: int = 12, max_phase: float = 3.0) -> np.ndarray:
+    """Phase of a few cells, spherical caps of up to max_phase radian, on a small tilted ramp"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:shape[0], 0:shape[1]].astype(np.float32)
+    phase = (0.3 * y / shape[0] + 0.2 * x / shape[1]).astype(np.float32)
+    scale = min(shape) / 20
+    for center_y, center_x, radius, height in rng.uniform((0, 0, scale, 0.3 * max_phase),
+                                                          (shape[0], shape[1], 3 * scale, max_phase), (cells, 4)):
+        phase += height * np.sqrt(np.clip(1 - ((y - center_y) ** 2 + (x - center_x) ** 2) / radius ** 2, 0, None))
+    return phase
+
+
+def offaxis_sample(shape: Tuple[int, int] = (1024, 1024), seed: int = 0, noise: float = 0.005) -> Sample:
+    """Off-axis hologram and background frame of phase_object(shape, seed)"""
+    rng = np.random.default_rng(seed + 1)
+    phase = phase_object(shape, seed)
+    y, x = np.ogrid[0:shape[0], 0:shape[1]]
+    reference = np.exp(-2j * np.pi * (CARRIER[0] * y + CARRIER[1] * x))
+    beam = _beam(shape)
+    hologram = beam * np.abs(np.exp(1j * phase) + reference) ** 2
+    background = beam * np.abs(1 + reference) ** 2
+    return Sample(*_sensor(hologram, background, rng, noise), phase)
+
+
+def particle_object(shape: Tuple[int, int], seed: int = 0, particles: int = 20) -> np.ndarray:
+    """Amplitude transmission of a few absorbing particles, disks of a few pixels"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:shape[0], 0:shape[1]].astype(np.float32)
+    transmission = np.ones(shape, dtype=np.float32)
+    for center_y, center_x, radius in rng.uniform((0, 0, 2), (shape[0], shape[1], 8), (particles, 3)):
+        transmission[(y - center_y) ** 2 + (x - center_x) ** 2 <= radius ** 2] *= 0.2
+    return transmission
+
+
+def inline_sample(shape: Tuple[int, int] = (1024, 1024), distance: float = 50.0,
+                  params: engine.ReconParams = engine.ReconParams(), seed: int = 0, noise: float = 0.005) -> Sample:
+    """In-line hologram and background frame of particle_object(shape, seed), in focus at distance (micrometer)
+    with the system parameters of params"""
+    rng = np.random.default_rng(seed + 1)
+    transmission = particle_object(shape, seed)
+    kz, mask = utils.angular_spectrum_grid(shape, params.vector, params.delta)
+    spectrum = np.fft.fftshift(np.fft.fft2(transmission))
+    field = np.fft.ifft2(np.fft.ifftshift(np.where(mask, spectrum * np.exp(-1j * kz * distance), 0)))
+    beam = _beam(shape)
+    return Sample(*_sensor(beam * np.abs(field) ** 2, beam, rng, noise), transmission)
+
+
+def write_series(directory: str, mode: str = "Offaxis", shape: Tuple[int, int] = (1024, 1024), frames: int = 10,
+                 seed: int = 0) -> None:
+    """Write frames holograms of consecutive seeds as {i}.tiff to directory/holograms and the background frame of
+    the first as directory/background.tiff"""
+    os.makedirs(os.path.join(directory, "holograms"), exist_ok=True)
+    for index in range(frames):
+        sample = offaxis_sample(shape, seed + index) if mode == "Offaxis" else inline_sample(shape, seed=seed + index)
+        tf.imwrite(os.path.join(directory, "holograms", f"{index}.tiff"), sample.hologram)
+        if index == 0:
+            tf.imwrite(os.path.join(directory, "background.tiff"), sample.background)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="write holograms/ and background.tiff into this directory")
+    parser.add_argument("--mode", choices=["Offaxis", "Inline"], default="Offaxis")
+    parser.add_argument("--shape", type=int, nargs=2, default=[1024, 1024], metavar=("HEIGHT", "WIDTH"))
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_series(args.directory, args.mode, tuple(args.shape), args.frames, args.seed)
+
+
+if __name__ == "__main__":
+    main()
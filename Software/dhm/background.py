@@ -0,0 +1,213 @@
+"""Background averaged from many frames, with bounded memory.
+
+A single background frame carries its sensor noise into every reconstruction. When the background path is a
+directory of TIFF files or a multi-page TIFF stack, its frames are combined into one float32 background:
+
+    mean        streamed frame by frame into float64 sums, one partial sum per worker (as many as fit)
+    median      tile by tile: the tile of every frame is read and its per-pixel median selected (introselect)
+    sigma_clip  tile by tile: the mean of the values within sigma standard deviations of the per-pixel median,
+                clipped iteratively
+
+Tiles are sized so that the tiles of all workers together stay within the memory limit, whatever the number of
+frames. The tiles (or, for the mean, the frame subsets) run on a thread pool. The result is cached next to the inputs,
+in `.dhm_background.<method>.npz` inside the directory or `<stack>.dhm_background.<method>.npz` beside the stack,
+together with a key of the frames (names, sizes, modification times) and the settings, so it is computed again only
+when any of them changes.
+"""
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from dhm import sources
+from dhm.live import is_tiff_name
+from dhm.series_index import SeriesIndex
+from dhm.tiff_io import Roi
+
+BACKGROUND_METHODS = ("mean", "median", "sigma_clip")
+CACHE_PREFIX = ".dhm_background"
+
+Progress = Callable[[int, int], None]  # finished tiles (or frames), total
+
+
+def is_multi_frame(path: str) -> bool:
+    """Whether the background path holds several frames to average: a directory or a multi-page TIFF stack"""
+    if os.path.isdir(path):
+        return True
+    if not is_tiff_name(path) or not os.path.isfile(path):
+        return False
+    stack = sources.TiffStackSource(path, prefetch_depth=0)
+    try:
+        return len(stack) > 1
+    finally:
+        stack.close()
+
+
+def open_frames(path: str) -> sources.HologramSource:
+    """Source of the background frames of a directory (natural sorted) or a multi-page TIFF stack"""
+    if os.path.isdir(path):
+        index = SeriesIndex(path)
+        index.refresh()
+        return sources.DirectorySource(path, index.names(), index, prefetch_depth=0)
+    return sources.TiffStackSource(path, prefetch_depth=0)
+
+
+def frames_key(path: str, source: sources.HologramSource, method: str, sigma: float, iterations: int) -> str:
+    """Key of the averaged background: the identity of every frame and the settings"""
+    if os.path.isdir(path):
+        parts = []
+        for name in source.names():
+            stat = os.stat(os.path.join(path, name))
+            parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    else:
+        stat = os.stat(path)
+        parts = [f"{len(source)}:{stat.st_size}:{stat.st_mtime_ns}"]
+    parts.append(method if method != "sigma_clip" else f"{method}:{sigma!r}:{iterations}")
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def background_key(path: str, method: str = "mean", sigma: float = 3.0, iterations: int = 3) -> str:
+    """Key of the averaged background of a directory or multi-page stack, without averaging its frames"""
+    source = open_frames(path)
+    try:
+        return frames_key(path, source, method, sigma, iterations)
+    finally:
+        source.close()
+
+
+def cache_path(path: str, method: str) -> str:
+    if os.path.isdir(path):
+        return os.path.join(path, f"{CACHE_PREFIX}.{method}.npz")
+    return f"{path}{CACHE_PREFIX}.{method}.npz"
+
+
+def tiles(shape: Tuple[int, int], frame_count: int, memory_limit: int, workers: int,
+          bytes_per_value: int = 4) -> List[Roi]:
+    """Regions (left, right, top, bot as in tiff_io.Roi) whose values of all frames, bytes_per_value each with
+    the working copies, fit in memory_limit bytes for all workers together: full-width row bands, or parts of a
+    row when a single row of all frames is already too large"""
+    height, width = shape
+    budget = max(1, memory_limit // max(1, workers) // (bytes_per_value * frame_count))  # pixels per tile
+    if budget >= width:
+        rows = min(height, budget // width)
+        return [(row, min(row + rows, height), 0, width) for row in range(0, height, rows)]
+    return [(row, row + 1, column, min(column + budget, width))
+            for row in range(height) for column in range(0, width, budget)]
+
+
+def _read_tile(source: sources.HologramSource, roi: Roi) -> np.ndarray:
+    tile = np.empty((len(source), roi[1] - roi[0], roi[3] - roi[2]), dtype=np.float32)
+    for idx in range(len(source)):
+        tile[idx] = source.read(idx, roi)
+    return tile
+
+
+def sigma_clipped_mean(values: np.ndarray, sigma: float = 3.0, iterations: int = 3) -> np.ndarray:
+    """Per-pixel mean over axis 0 of the values within sigma standard deviations of the per-pixel median; the
+    deviation is estimated again from the kept values on every iteration"""
+    deviation = np.abs(values - np.median(values, axis=0))
+    kept = np.ones(values.shape, dtype=bool)
+    for _ in range(iterations):
+        count = np.maximum(kept.sum(axis=0), 1)
+        std = np.sqrt(np.sum(np.where(kept, deviation, 0) ** 2, axis=0) / count)
+        clipped = deviation <= sigma * std
+        if np.array_equal(clipped, kept):
+            break
+        kept = clipped
+    count = kept.sum(axis=0)
+    mean = np.sum(np.where(kept, values, 0), axis=0) / np.maximum(count, 1)
+    return np.where(count > 0, mean, np.median(values, axis=0)).astype(np.float32)
+
+
+def _mean(source: sources.HologramSource, memory_limit: int, workers: int,
+          progress: Optional[Progress]) -> np.ndarray:
+    frame_count = len(source)
+    # One float64 sum per worker
+    workers = max(1, min(workers, frame_count, memory_limit // (8 * source.read(0).size)))
+    done = [0]
+    lock = threading.Lock()
+
+    def partial_sum(indices: range) -> np.ndarray:
+        total = None
+        for idx in indices:
+            frame = source.read(idx)
+            total = frame.astype(np.float64) if total is None else np.add(total, frame, out=total)
+            with lock:
+                done[0] += 1
+                if progress is not None:
+                    progress(done[0], frame_count)
+        return total
+
+    step = -(-frame_count // workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        sums = list(executor.map(partial_sum, [range(start, min(start + step, frame_count))
+                                               for start in range(0, frame_count, step)]))
+    total = sums[0]
+    for partial in sums[1:]:
+        total += partial
+    return (total / frame_count).astype(np.float32)
+
+
+def _tile_wise(source: sources.HologramSource, method: str, sigma: float, iterations: int, memory_limit: int,
+               workers: int, progress: Optional[Progress]) -> np.ndarray:
+    shape = source.read(0).shape
+    # float32 tile plus the copy partitioned by the median, or the deviations and temporaries of the clipping
+    regions = tiles(shape, len(source), memory_limit, workers, 8 if method == "median" else 16)
+    background = np.empty(shape, dtype=np.float32)
+
+    def combine(roi: Roi) -> None:
+        tile = _read_tile(source, roi)
+        if method == "median":
+            background[roi[0]:roi[1], roi[2]:roi[3]] = np.median(tile, axis=0)
+        else:
+            background[roi[0]:roi[1], roi[2]:roi[3]] = sigma_clipped_mean(tile, sigma, iterations)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for done, _ in enumerate(executor.map(combine, regions), start=1):
+            if progress is not None:
+                progress(done, len(regions))
+    return background
+
+
+def average_frames(source: sources.HologramSource, method: str = "mean", sigma: float = 3.0, iterations: int = 3,
+                   memory_limit: int = 512 * 2 ** 20, workers: int = 4,
+                   progress: Optional[Progress] = None) -> np.ndarray:
+    """Combine the frames of the source into one float32 background"""
+    if method not in BACKGROUND_METHODS:
+        raise ValueError(f"Unknown background method {method!r}, use one of {', '.join(BACKGROUND_METHODS)}")
+    if len(source) == 0:
+        raise ValueError(f"No background frames in {source.get_path()}")
+    workers = max(1, workers)
+    if method == "mean":
+        return _mean(source, memory_limit, workers, progress)
+    return _tile_wise(source, method, sigma, iterations, memory_limit, workers, progress)
+
+
+def load_background(path: str, method: str = "mean", sigma: float = 3.0, iterations: int = 3,
+                    memory_limit: int = 512 * 2 ** 20, workers: int = 4,
+                    progress: Optional[Progress] = None) -> Tuple[np.ndarray, str]:
+    """Averaged background of the frames of a directory or multi-page stack, from its cache when it is current;
+    return the background and its key"""
+    source = open_frames(path)
+    try:
+        key = frames_key(path, source, method, sigma, iterations)
+        cached = cache_path(path, method)
+        try:
+            with np.load(cached) as cache:
+                if str(cache["key"]) == key:
+                    return cache["background"], key
+        except (OSError, KeyError, ValueError):
+            pass  # Not cached yet, or damaged
+        background = average_frames(source, method, sigma, iterations, memory_limit, workers, progress)
+    finally:
+        source.close()
+    temp_path = f"{cached}.{os.getpid()}.tmp.npz"
+    try:
+        np.savez(temp_path, background=background, key=np.array(key))
+        os.replace(temp_path, cached)
+    except OSError:
+        # Read-only acquisition folder: averaged again next time
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return background, key
@@ -0,0 +1,58 @@
+"""Compression of the saved TIFF products (one file per frame and stack outputs).
+
+Every product has its own codec, set in the [Compression] section of the configuration receipt as
+`codec[,level][,predictor]`, e.g. `height_map = zstd,3,predictor`. The predictor (floating point for float images,
+horizontal differencing for integer images) makes smooth maps compress much better at little cost. Segments of an
+image are compressed in maxworkers threads.
+
+TIFF has no LZ4 codec; zstd at level 1 or 2 is about as fast and compresses better. zstd, lzw and the predictors need
+the optional imagecodecs package (`pip install imagecodecs`), deflate works without it. The zarr and hdf5 output
+formats use their own Blosc codecs, see dhm.volume_store.
+"""
+from typing import Any, Dict, NamedTuple
+
+TIFF_CODECS = ("none", "zstd", "deflate", "lzw")
+DEFAULT_LEVELS = {"zstd": 3, "deflate": 6, "lzw": 0}
+
+
+class Codec(NamedTuple):
+    codec: str = "none"
+    level: int = 0
+    predictor: bool = False
+
+    def __str__(self) -> str:
+        if self.codec == "none":
+            return "none"
+        return f"{self.codec},{self.level}" + (",predictor" if self.predictor else "")
+
+
+def parse_codec(text: str) -> Codec:
+    """Parse a `codec[,level][,predictor]` setting of the configuration receipt"""
+    parts = [part for part in text.replace(" ", "").lower().split(",") if part != ""]
+    codec = parts.pop(0) if len(parts) > 0 else "none"
+    if codec not in TIFF_CODECS:
+        raise ValueError(f"Unknown compression {codec!r}, use one of {', '.join(TIFF_CODECS)}")
+    predictor = "predictor" in parts
+    levels = [part for part in parts if part != "predictor"]
+    level = int(levels[0]) if len(levels) > 0 else DEFAULT_LEVELS.get(codec, 0)
+    return Codec(codec, level, predictor and codec != "none")
+
+
+def check_codec(codec: Codec) -> None:
+    """Raise ImportError when the codec needs imagecodecs and it is not installed"""
+    if codec.codec in ("zstd", "lzw") or codec.predictor:
+        try:
+            import imagecodecs  # noqa: F401
+        except ImportError as e:
+            raise ImportError(f"The {codec.codec} compression needs the imagecodecs package, "
+                              f"pip install imagecodecs") from e
+
+
+def tiff_kwargs(codec: Codec, maxworkers: int = 1) -> Dict[str, Any]:
+    """Keyword arguments of tifffile imwrite / TiffWriter.write for the codec"""
+    if codec.codec == "none":
+        return {}
+    kwargs = {"compression": codec.codec, "predictor": codec.predictor, "maxworkers": maxworkers}
+    if codec.codec != "lzw":
+        kwargs["compressionargs"] = {"level": codec.level}
+    return kwargs
@@ -1,23 +1,43 @@
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Callable, List, Optional, Tuple
 import os
+import hashlib
+import warnings
+import functools
 import configparser
 import numpy as np
-import PIL
-import matplotlib.pyplot as plt
-import tifffile as tf
-from skimage.restoration import unwrap_phase
 from dhm import utils
-
-# On Windows, install 'Microsoft's vcredist_x64.exe' to fix potential unwrap_phase dependency error
-# ( https://docs.microsoft.com/en-us/cpp/windows/latest-supported-vc-redist?view=msvc-170)
+tf = utils.lazy_import("tifffile")  # tifffile imports imagecodecs, both are loaded once a TIFF is read or written
+from dhm import engine, stacks, volume_store, sources, series_index, compression, quantize, incremental, fields, \
+    background, pyramid, timing
 
 source_path = Path(__file__).resolve()
 source_dir = source_path.parent
 
+class _LazyBuffer:
+    """Per-instance image buffer, allocated on first access only"""
+
+    def __init__(self, shape: Tuple[int, int]) -> None:
+        self._shape = shape
+
+    def __set_name__(self, owner, name) -> None:
+        self._name = name
+
+    def __get__(self, instance, owner) -> np.ndarray:
+        if instance is None:
+            return self
+        buffer = instance.__dict__.get(self._name)
+        if buffer is None:
+            buffer = instance.__dict__[self._name] = np.zeros(self._shape, dtype=np.uint8)
+        return buffer
+
+    def __set__(self, instance, value: np.ndarray) -> None:
+        instance.__dict__[self._name] = value
+
 class HoloGram:
 
-    HOLO_LIST = []
+    HOLO_LIST : list
 
     # States and Mutexs
     __back_loaded : bool = False
@@ -25,16 +45,18 @@ class HoloGram:
     __dhm_mode : str = ""
     __config = None
 
-    HOLOGRAM = np.ndarray(shape=(3000, 4000), dtype=np.uint8)
-    BACKGROUND = np.ndarray(shape=(3000, 4000), dtype=np.uint8)
-    BACKGROUND_PROCESSED = np.ndarray(shape=(400, 400), dtype=np.uint8)
-    FOURIER_FILTER = np.ndarray(shape=(400, 400), dtype=np.uint8)
+    HOLOGRAM = _LazyBuffer(shape=(3000, 4000))
+    BACKGROUND = _LazyBuffer(shape=(3000, 4000))
+    FOURIER_FILTER = _LazyBuffer(shape=(400, 400))
 
-    HEIGHT_MAP = np.ndarray(shape=(400, 400), dtype=np.uint8)
-    PHASE_MAP = np.ndarray(shape=(400, 400), dtype=np.uint8)
-    WRAPPED_PHASE = np.ndarray(shape=(400, 400), dtype=np.uint8)
-    REFOCUSED_VOLUME = np.ndarray(shape=(400, 400), dtype=np.uint8)
-    INTENSITY_MAP = np.ndarray(shape=(400, 400), dtype=np.uint8)
+    HEIGHT_MAP = _LazyBuffer(shape=(400, 400))
+    PHASE_MAP = _LazyBuffer(shape=(400, 400))
+    WRAPPED_PHASE = _LazyBuffer(shape=(400, 400))
+    REFOCUSED_VOLUME = _LazyBuffer(shape=(400, 400))
+    INTENSITY_MAP = _LazyBuffer(shape=(400, 400))
+    XZ_SECTION = _LazyBuffer(shape=(400, 400))
+    YZ_SECTION = _LazyBuffer(shape=(400, 400))
+    SPECTRUM = _LazyBuffer(shape=(400, 400))
 
     # File Paths
     _read_path_main : str = ''
@@ -68,27 +90,95 @@ class HoloGram:
     _phase_map_save: bool  = True
     _wrapped_phase_save: bool  = True
     _inline_save: bool  = True
+    _output_format: str = 'files' # 'files' (one tiff per frame), 'stack' (one BigTIFF per product), 'zarr' or 'hdf5'
+    _output_stack_tag: str = ''
+    _volume_chunks: tuple = volume_store.DEFAULT_CHUNKS # t, z, y, x
+    _volume_compression: str = 'zstd'
+    _volume_level: int = 3
+    _compression_workers: int = 4 # threads compressing the segments of a saved tiff
+    _incremental: bool = False # skip the products recorded as up to date in the build log of the save path
+    _OFFAXIS_PRODUCTS = ('phase_map', 'height_map', 'wrapped_phase') # in the order products are derived from
+    _SECTION_CACHE_SIZE = 32 # orthogonal sections kept per inline frame
+    _field_save: bool = False # store the complex off-axis fields for repropagation (see dhm.fields)
+    _field_apodized: bool = False # store them padded and apodized, ready for propagation
+    _pyramid: bool = False # reduced-resolution levels in SubIFDs of the single tiff outputs
+    _pyramid_min_size: int = pyramid.MIN_LEVEL_SIZE # unit in pixel, smallest side of the coarsest level
 
     # Processing Range Settings
     _process_range_start : int = 0
     _process_range_end : int = 0
 
+    # Live Mode Settings
+    _live_latency_target : float = 1.0 # unit in second
+    _live_skip_frames : bool = True
+    _live_poll_interval : float = 0.05 # unit in second
+
+    # Display Settings
+    _preview_fps : float = 5.0 # previews of the frames being processed per second at most, 0 for the last only
+
+    # Timing Settings
+    _stage_timing : bool = True # time every stage of the processing, see dhm.timing
+
+    # Background Settings, for backgrounds averaged from a directory or multi-page stack of frames
+    _background_method : str = 'mean' # 'mean', 'median' or 'sigma_clip'
+    _background_sigma : float = 3.0
+    _background_iterations : int = 3
+    _background_memory : int = 512 # unit in MB, for the tiles of all workers
+    _background_workers : int = 4
+
+    # Raw Source Settings, for holograms read from a raw camera dump instead of TIFF files
+    _raw_width : int = 0
+    _raw_height : int = 0
+    _raw_dtype : str = 'uint16'
+    _raw_header_bytes : int = 0
+    _raw_frame_header_bytes : int = 0
+
     # ROI Setting
     _roi_enabled : bool = False
     _shape_x_main : int = 0
     _shape_y_main : int = 0
 
     def __init__(self) -> None:
-        """Initialize ROI"""
+        """Initialize the series list and ROI; all state is per instance"""
+        self.HOLO_LIST = []
+        self._cache = engine.EngineCache()
+        self._timer = timing.StageTimer(self._stage_timing)
+        self._stack_writers = {}
+        self._stack_readers = {}
+        self._compression = {product: compression.Codec() for product in stacks.STACK_PRODUCTS}
+        self._output_dtypes = {product: 'float32' for product in stacks.STACK_PRODUCTS}
+        self._volume_store = None
+        self._volume_store_writable = False
+        self._build_log = None
+        self._field_store = None
+        self._source = None
+        self._series_index = None
+        self._background_identity = ''
+        self._series_identity = ''
+        self._refocus = None # key and spectrum of the frame prepared for refocusing
+        self._sections = None # key, spectrum and cached orthogonal sections of the inline frame last sectioned
+        self._spectrum = None # key, spectrum and sideband centers per quadrant of the frame prepared for filtering
+        self._output_shape = None
+        self._hologram_roi = None
+        self._pending_hologram = None # Frame processed from its ROI only, loaded into HOLOGRAM on demand
         self.left = None; self.right = None; self.top = None; self.bot = None
 
-    def set_background_img(self) -> Optional[int]:
-        """Try loading background image, return false at Plt error due to unidentified format"""
+    def set_background_img(self, progress: Optional[background.Progress] = None) -> Optional[int]:
+        """Try loading background image, return false at Plt error due to unidentified format. A directory or
+        multi-page stack of frames is averaged (see dhm.background), progress(done, total) is called meanwhile."""
         try:
-            self.BACKGROUND = tf.imread(self._read_path_back)
+            if background.is_multi_frame(self._read_path_back):
+                self.BACKGROUND, key = background.load_background(
+                    self._read_path_back, self._background_method, self._background_sigma,
+                    self._background_iterations, self._background_memory * 2 ** 20, self._background_workers,
+                    progress)
+                self._background_identity = f"{self._background_method}:{key}"
+            else:
+                self.BACKGROUND = tf.imread(self._read_path_back)
+                self._background_identity = incremental.file_identity(self._read_path_back)
             self.__back_loaded = True
             return 1
-        except PIL.UnidentifiedImageError:
+        except (tf.TiffFileError, ValueError):
             return -1
         except FileNotFoundError:
             return -2
@@ -96,21 +186,56 @@ class HoloGram:
     def load_hologram_img(self, holo_num) -> Optional[int]:
         """Try loading hologram image, return false at Plt error due to unidentified format"""
         try:
-            self.HOLOGRAM = tf.imread(f"{self._read_path_main}/{self.HOLO_LIST[holo_num]}")
+            self.HOLOGRAM = self.get_source().read(holo_num)
             self._shape_x_main = self.HOLOGRAM.shape[0]
             self._shape_y_main = self.HOLOGRAM.shape[1]
+            self._pending_hologram = None
             return 1
-        except PIL.UnidentifiedImageError:
+        except (tf.TiffFileError, ValueError):
             return -1
-        except FileNotFoundError:
+        except (FileNotFoundError, IndexError):
             return -2
 
-    def load_reconstruction_img(self, holo_num, recon_num) -> Optional[int]:
-        """Try loading reconstruction image, return false at Plt error due to unidentified format"""
+    def load_hologram_roi(self, holo_num, roi) -> Optional[int]:
+        """Try loading the ROI of a hologram image for processing, reading only the ROI data from the file"""
         try:
-            self.REFOCUSED_VOLUME = tf.imread(f"{self._save_path_main}/{str(holo_num)}_inline_frame_{recon_num}.tiff")
+            self._hologram_roi = self.get_source().read(holo_num, roi)
+            self._pending_hologram = holo_num
             return 1
-        except PIL.UnidentifiedImageError:
+        except (tf.TiffFileError, ValueError):
+            return -1
+        except (FileNotFoundError, IndexError):
+            return -2
+
+    def defer_hologram_img(self, holo_num) -> None:
+        """Make holo_num the current hologram without reading it; it is read when the full frame is needed"""
+        self._pending_hologram = holo_num
+
+    def get_hologram_img(self) -> np.ndarray:
+        """Full frame of the last loaded or processed hologram"""
+        if self._pending_hologram is not None:
+            self.load_hologram_img(self._pending_hologram)
+        return self.HOLOGRAM
+
+    def _load_processing_frame(self, holo_num, params: engine.ReconParams) -> np.ndarray:
+        """ROI-cropped hologram to process; with an ROI set, only the ROI is read. The next frame is prefetched."""
+        if params.roi is None:
+            self.load_hologram_img(holo_num)
+            hologram = self.HOLOGRAM
+        else:
+            self.load_hologram_roi(holo_num, params.roi)
+            hologram = self._hologram_roi
+        if self._source is not None:
+            self._source.prefetch(holo_num + 1, params.roi)
+        return hologram
+
+    def load_reconstruction_img(self, holo_num, recon_num, max_shape=None) -> Optional[int]:
+        """Try loading reconstruction image, return false at Plt error due to unidentified format. With max_shape
+        (height, width), e.g. of the canvas, the smallest saved pyramid level covering it is loaded instead."""
+        try:
+            self.REFOCUSED_VOLUME = self._read_output(holo_num, 'inline_frame', recon_num, max_shape)
+            return 1
+        except tf.TiffFileError:
             return -1
         except FileNotFoundError:
             return -2
@@ -119,19 +244,89 @@ class HoloGram:
         """Asesss HoloGram backloaded status"""
         return self.__back_loaded
 
+    def load_series(self, progress: Optional[series_index.Progress] = None,
+                    grown: Optional[Callable[[int], None]] = None) -> int:
+        """Index the read path into HOLO_LIST: the .tif/.tiff holograms of a directory, natural sorted, or the
+        frames of a multi-page TIFF stack or raw dump; return the series length. Directories are indexed through
+        their persistent series index, progress(indexed, total) is called while it is refreshed. HOLO_LIST grows
+        by every batch of sorted names that is indexed, grown(length) is called after each."""
+        self.close_source()
+        self.HOLO_LIST.clear()
+        self._series_identity = ''
+        if os.path.isdir(self._read_path_main):
+            if self._series_index is None or self._series_index.get_directory() != self._read_path_main:
+                self._series_index = series_index.SeriesIndex(self._read_path_main)
+
+            def ready(names: List[str]) -> None:
+                self.HOLO_LIST.extend(names)
+                if grown is not None:
+                    grown(len(self.HOLO_LIST))
+
+            self._series_index.refresh(progress, ready=ready)
+            if self.HOLO_LIST != self._series_index.names():
+                self.HOLO_LIST[:] = self._series_index.names()
+        else:
+            self.HOLO_LIST.extend(self.get_source().names())
+        return len(self.HOLO_LIST)
+
+    def get_source(self) -> sources.HologramSource:
+        """Input source of the read path, opened on first use"""
+        if self._source is None or self._source.get_path() != self._read_path_main:
+            self.close_source()
+            index = self._series_index
+            if index is not None and index.get_directory() != self._read_path_main:
+                index = None
+            self._source = sources.open_source(self._read_path_main, self.HOLO_LIST, self.get_raw_source_param(),
+                                               index)
+        return self._source
+
+    def close_source(self) -> None:
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+
+    def get_series_identity(self) -> str:
+        """Identity of the loaded series: a hash of the names, sizes and modification times of its holograms (of
+        the file, for stacks and raw dumps), computed once per load_series, so frames appended in live mode keep it"""
+        if self._series_identity == '':
+            if self.is_directory_source():
+                digest = hashlib.sha1()
+                for name in self.HOLO_LIST:
+                    record = None if self._series_index is None else self._series_index.record(name)
+                    if record is None:
+                        stat = os.stat(os.path.join(self._read_path_main, name))
+                        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+                    else:
+                        digest.update(f"{name}:{record.size}:{record.mtime_ns}\n".encode("utf-8"))
+                self._series_identity = digest.hexdigest()
+            else:
+                self._series_identity = incremental.file_identity(self._read_path_main)
+        return self._series_identity
+
+    def is_directory_source(self) -> bool:
+        """Whether the holograms are single files in a directory, the only source live mode can watch"""
+        return os.path.isdir(self._read_path_main)
+
     def set_read_path(self, read_path: str) -> None:
+        if read_path != self._read_path_main:
+            self._series_identity = ''
         self._read_path_main = read_path
 
     def get_read_path(self) -> Optional[str]:
         return self._read_path_main
 
     def set_back_path(self, back_path: str) -> None:
+        if back_path != self._read_path_back:
+            self._background_identity = ''
         self._read_path_back = back_path
 
     def get_back_path(self) -> Optional[str]:
         return self._read_path_back
 
     def set_save_path(self, save_path: str) -> None:
+        if save_path != self._save_path_main:
+            self.close_outputs()
+            self._stack_readers = {}
         self._save_path_main = save_path
     
     def get_save_path(self) -> Optional[str]:
@@ -202,6 +397,228 @@ class HoloGram:
     def get_save_flags(self) -> Tuple[Optional[bool], Optional[bool], Optional[bool], Optional[bool]]:
         return self._height_map_save, self._phase_map_save, self._wrapped_phase_save, self._inline_save
 
+    def set_output_format(self, output_format: str) -> None:
+        """Save one tiff per frame ('files'), append all frames of a product to one BigTIFF ('stack'),
+        or write them into the arrays of a chunked 'zarr' or 'hdf5' store"""
+        if output_format != self._output_format:
+            self.close_outputs()
+            self._stack_readers = {}
+        self._output_format = output_format
+
+    def get_output_format(self) -> Optional[str]:
+        return self._output_format
+
+    def set_output_stack_tag(self, tag: str) -> None:
+        """Tag of the stack file names, so that concurrent writers into one save path get their own stacks"""
+        self.close_outputs()
+        self._output_stack_tag = tag
+
+    def set_volume_store_param(self, chunks: Tuple[int, int, int, int], compression: str, level: int) -> None:
+        """Chunk shape (t, z, y, x) and Blosc codec ('none' to disable) of the zarr and hdf5 output formats"""
+        self.close_outputs()
+        self._volume_chunks = tuple(chunks)
+        self._volume_compression = compression
+        self._volume_level = level
+
+    def get_volume_store_param(self) -> Tuple[Optional[tuple], Optional[str], Optional[int]]:
+        return self._volume_chunks, self._volume_compression, self._volume_level
+
+    def set_compression_param(self, product: str, codec: str, level: int, predictor: bool) -> None:
+        """TIFF compression of a saved product ('height_map', 'phase_map', 'wrapped_phase' or 'inline_frame'),
+        codec 'none' to save uncompressed; ImportError if the codec needs the missing imagecodecs package"""
+        product_codec = compression.Codec(codec, level, predictor)
+        compression.check_codec(product_codec)
+        self.close_outputs()
+        self._compression[product] = product_codec
+
+    def get_compression_param(self, product: str) -> Tuple[Optional[str], Optional[int], Optional[bool]]:
+        return tuple(self._compression[product])
+
+    def set_output_dtype(self, product: str, dtype: str) -> None:
+        """Storage dtype of a saved tiff product: 'float32', 'float16', 'uint16' (scale and offset in the page
+        description, see dhm.quantize) or, for the wrapped phase only, 'int16_complex'"""
+        if dtype not in quantize.OUTPUT_DTYPES or (dtype == 'int16_complex' and product != 'wrapped_phase'):
+            raise ValueError(f"{dtype!r} is not an output dtype of {product}")
+        self.close_outputs()
+        self._output_dtypes[product] = dtype
+
+    def get_output_dtype(self, product: str) -> Optional[str]:
+        return self._output_dtypes[product]
+
+    def set_compression_workers(self, maxworkers: int) -> None:
+        self.close_outputs()
+        self._compression_workers = max(1, maxworkers)
+
+    def get_compression_workers(self) -> Optional[int]:
+        return self._compression_workers
+
+    def set_incremental(self, enabled: bool) -> None:
+        """Incremental mode: products whose hologram, background, parameters and format did not change since they
+        were saved are not computed again (see dhm.incremental)"""
+        self.close_outputs()
+        self._incremental = enabled
+
+    def get_incremental(self) -> Optional[bool]:
+        return self._incremental
+
+    def set_field_store_param(self, save: bool, apodized: bool) -> None:
+        """Store the complex field of every processed off-axis frame (padded and apodized, if apodized), so that it
+        can be repropagated to other distances without the holograms"""
+        self.close_outputs()
+        self._field_save = save
+        self._field_apodized = apodized
+
+    def set_pyramid_param(self, enabled: bool, min_size: int = pyramid.MIN_LEVEL_SIZE) -> None:
+        """Save reduced-resolution levels with the single tiff outputs, down to min_size pixels"""
+        self._pyramid = enabled
+        self._pyramid_min_size = min_size
+
+    def get_pyramid_param(self) -> Tuple[Optional[bool], Optional[int]]:
+        return self._pyramid, self._pyramid_min_size
+
+    def get_output_shape(self) -> Optional[Tuple[int, int]]:
+        """Full-resolution shape of the last output loaded at a reduced pyramid level"""
+        return self._output_shape
+
+    def get_field_store_param(self) -> Tuple[Optional[bool], Optional[bool]]:
+        return self._field_save, self._field_apodized
+
+    def get_field_store_path(self) -> Optional[str]:
+        """Field store directory of the current series and settings in the save path"""
+        key = fields.store_key(self._read_path_main, self.get_series_identity(), self.get_background_identity(),
+                               self.get_params(), self._field_apodized)
+        return f"{self._save_path_main}/{fields.FIELDS_DIR}/{key}"
+
+    def get_field_store(self, frame_count: int = 0, shape: Optional[Tuple[int, int]] = None) -> fields.FieldStore:
+        """Field store of the current series and settings; created with frame_count fields of the shape if given,
+        FileNotFoundError if it does not exist otherwise"""
+        params = self.get_params()
+        store_path = self.get_field_store_path()
+        if self._field_store is None or self._field_store.get_path() != store_path:
+            if self._field_store is not None:
+                self._field_store.close()
+            if shape is None:
+                self._field_store = fields.FieldStore(store_path)
+            else:
+                attrs = {'apodized': self._field_apodized, 'read_path': self._read_path_main,
+                         'background': self._read_path_back, 'holograms': list(self.HOLO_LIST),
+                         'params': {name: getattr(params, name) for name in params.__dataclass_fields__}}
+                self._field_store = fields.FieldStore.create(store_path, frame_count, shape, attrs)
+        return self._field_store
+
+    def close_outputs(self) -> None:
+        """Close the stack writers, the volume store and the build log, e.g. at the end of a processing run"""
+        for writer in self._stack_writers.values():
+            writer.close()
+        self._stack_writers = {}
+        if self._volume_store is not None:
+            self._volume_store.close()
+            self._volume_store = None
+        if self._build_log is not None:
+            self._build_log.close()
+            self._build_log = None
+        if self._field_store is not None:
+            self._field_store.close()
+            self._field_store = None
+
+    def _get_build_log(self) -> incremental.BuildLog:
+        """Build log of the save path, read once per run"""
+        if self._build_log is None:
+            self._build_log = incremental.BuildLog(self._save_path_main)
+        return self._build_log
+
+    def _product_keys(self, holo_num, products, params: engine.ReconParams, z_count: int = 0) -> dict:
+        """Content keys of the products of a frame by (product, slice index), empty unless incremental"""
+        if not self._incremental or self._save_path_main == "":
+            return {}
+        if self.is_directory_source():
+            frame_identity = incremental.file_identity(os.path.join(self._read_path_main, self.HOLO_LIST[holo_num]))
+        else:
+            frame_identity = f"{incremental.file_identity(self._read_path_main)}[{holo_num}]"
+        background_identity = self.get_background_identity()
+        keys = {}
+        for product in products:
+            if self._output_format in volume_store.VOLUME_BACKENDS:  # float32 arrays, without the TIFF settings
+                encoding = (f"{self._output_format}:{self._volume_chunks}:{self._volume_compression}:"
+                            f"{self._volume_level}")
+            else:
+                encoding = f"{self._output_format}:{self._output_dtypes[product]}:{self._compression[product]}"
+            if self._output_format == 'files' and self._pyramid:
+                encoding += f":pyramid:{self._pyramid_min_size}"
+            for z_idx in (range(z_count) if product == 'inline_frame' else (None,)):
+                keys[(product, z_idx)] = incremental.product_key(frame_identity, background_identity, params,
+                                                                 product, encoding, z_idx)
+        return keys
+
+    def _is_current(self, num, product, keys: dict, z_idx=None) -> bool:
+        """Whether the saved product is recorded with its current key and the output still holds it: its file,
+        a page of its stacks or a written slot of the volume store"""
+        if (product, z_idx) not in keys or not self._get_build_log().is_current(num, product, keys[(product, z_idx)],
+                                                                                 z_idx):
+            return False
+        if self._output_format == 'stack':
+            return (num, 0 if z_idx is None else z_idx) in self._get_stack_set(product)
+        if self._output_format in volume_store.VOLUME_BACKENDS:
+            try:
+                return self._get_volume_store(create=False).has(product, num, z_idx)
+            except FileNotFoundError:
+                return False
+        suffix = "" if z_idx is None else f"_{z_idx}"
+        return os.path.exists(f"{self._save_path_main}/{num}_{product}{suffix}.tiff")
+
+    def _get_stack_set(self, product) -> stacks.StackSet:
+        """Stacks of a product in the save path, for reading"""
+        if product not in self._stack_readers:
+            self._stack_readers[product] = stacks.StackSet(self._save_path_main, product)
+        return self._stack_readers[product]
+
+    def _read_output(self, num, product, z_idx=None, max_shape=None) -> np.ndarray:
+        """Read a saved product in its physical unit, FileNotFoundError if it was not saved. Single tiff outputs
+        are read at the smallest pyramid level covering max_shape, if given."""
+        self._output_shape = None
+        if self._output_format == 'stack':
+            return self._get_stack_set(product).read(num, 0 if z_idx is None else z_idx)
+        if self._output_format in volume_store.VOLUME_BACKENDS:
+            return self._get_volume_store(create=False).read(product, num, z_idx)
+        suffix = "" if z_idx is None else f"_{z_idx}"
+        if max_shape is not None:
+            image, self._output_shape = pyramid.read_level(f"{self._save_path_main}/{num}_{product}{suffix}.tiff",
+                                                           max_shape)
+            return image
+        return quantize.read_physical(f"{self._save_path_main}/{num}_{product}{suffix}.tiff")
+
+    def _get_volume_store(self, create: bool = True) -> volume_store.VolumeStore:
+        """Volume store of the save path, opened once per run: read-only to read from it (create False), else for
+        writing, with the series attributes written. A store opened read-only is reopened to be written."""
+        if self._volume_store is not None and create and not self._volume_store_writable:
+            self._volume_store.close()
+            self._volume_store = None
+        if self._volume_store is None:
+            store_path = f"{self._save_path_main}/{volume_store.store_name(self._output_format)}"
+            if not create and not os.path.exists(store_path):
+                raise FileNotFoundError(store_path)
+            self._volume_store = volume_store.VolumeStore(store_path, "a" if create else "r", self._volume_chunks,
+                                                          self._volume_compression, self._volume_level)
+            self._volume_store_writable = create
+            if create:
+                self._warn_ignored_tiff_settings()
+                params = self.get_params()
+                self._volume_store.set_attrs(mode=self.__dhm_mode, holograms=list(self.HOLO_LIST),
+                                             pixel_size=params.delta,
+                                             z_distances=[params.slice_distance(z_step)
+                                                          for z_step in range(1, params.rec_zstack_qty + 1)])
+        return self._volume_store
+
+    def _warn_ignored_tiff_settings(self) -> None:
+        """Warn about output dtypes and TIFF compressions set for a volume store, whose float32 arrays are
+        compressed with the volume compression instead"""
+        ignored = [f"{product}_dtype = {dtype}" for product, dtype in self._output_dtypes.items() if dtype != 'float32']
+        ignored += [f"{product} compression {codec}" for product, codec in self._compression.items()
+                    if codec.codec != 'none']
+        if ignored:
+            warnings.warn(f"The {self._output_format} output format stores float32 arrays compressed by "
+                          f"volume_compression, ignoring {', '.join(ignored)}", stacklevel=3)
+
     def set_range_start(self, start : int  = 0) -> None:
         self._process_range_start = start
 
@@ -214,6 +631,87 @@ class HoloGram:
     def get_range_end(self) -> Optional[int]:
         return self._process_range_end
 
+    def set_live_param(self, latency_target: float, skip_frames: bool, poll_interval: float) -> None:
+        """Set watch-folder live mode param, latency target and poll interval in seconds"""
+        self._live_latency_target = latency_target
+        self._live_skip_frames = skip_frames
+        self._live_poll_interval = poll_interval
+
+    def get_live_param(self) -> Tuple[Optional[float], Optional[bool], Optional[float]]:
+        return self._live_latency_target, self._live_skip_frames, self._live_poll_interval
+
+    def set_preview_param(self, max_fps: float) -> None:
+        """Set the highest rate of the previews shown while processing, in frames per second"""
+        self._preview_fps = max(0.0, max_fps)
+
+    def get_preview_param(self) -> Optional[float]:
+        return self._preview_fps
+
+    def set_timing_param(self, enabled: bool) -> None:
+        """Enable or disable the timing of the processing stages"""
+        self._stage_timing = enabled
+        self._timer.set_enabled(enabled)
+
+    def get_timing_param(self) -> Optional[bool]:
+        return self._stage_timing
+
+    def get_stage_timings(self) -> dict:
+        """Moving average time per frame of every processing stage, in seconds; empty if not timed"""
+        return self._timer.ewma()
+
+    def start_timing_run(self) -> None:
+        """Forget the stage timings of the previous run"""
+        self._timer.reset()
+
+    def log_timing_run(self) -> Optional[str]:
+        """Append the mean stage times of the run to the timing log in the save path (see dhm.timing) and return
+        the logged line, None if no frame was timed"""
+        try:
+            return self._timer.log_run(self._save_path_main, self.__dhm_mode or "-")
+        except OSError:
+            return None
+
+    def set_background_param(self, method: str, sigma: float = 3.0, iterations: int = 3, memory: int = 512,
+                             workers: int = 4) -> None:
+        """Set how a directory or stack of background frames is averaged; memory limit in MB"""
+        if method not in background.BACKGROUND_METHODS:
+            raise ValueError(f"Unknown background method {method!r}, "
+                             f"use one of {', '.join(background.BACKGROUND_METHODS)}")
+        self._background_method = method
+        self._background_sigma = sigma
+        self._background_iterations = iterations
+        self._background_memory = memory
+        self._background_workers = workers
+
+    def get_background_param(self) -> Tuple[Optional[str], Optional[float], Optional[int], Optional[int],
+                                            Optional[int]]:
+        return (self._background_method, self._background_sigma, self._background_iterations,
+                self._background_memory, self._background_workers)
+
+    def get_background_identity(self) -> str:
+        """Identity of the loaded background, the key of its frames and method when averaged. Before the
+        background is loaded, the identity it will have is derived from the background path"""
+        if self._background_identity == '':
+            if background.is_multi_frame(self._read_path_back):
+                key = background.background_key(self._read_path_back, self._background_method,
+                                                self._background_sigma, self._background_iterations)
+                return f"{self._background_method}:{key}"
+            return incremental.file_identity(self._read_path_back)
+        return self._background_identity
+
+    def set_raw_source_param(self, width: int, height: int, dtype: str, header_bytes: int = 0,
+                             frame_header_bytes: int = 0) -> None:
+        """Set frame layout of raw camera dumps; header sizes in bytes"""
+        self.close_source()
+        self._raw_width = width
+        self._raw_height = height
+        self._raw_dtype = dtype
+        self._raw_header_bytes = header_bytes
+        self._raw_frame_header_bytes = frame_header_bytes
+
+    def get_raw_source_param(self) -> Tuple[Optional[int], Optional[int], Optional[str], Optional[int], Optional[int]]:
+        return self._raw_width, self._raw_height, self._raw_dtype, self._raw_header_bytes, self._raw_frame_header_bytes
+
     def set_block(self) -> None:
         """Set Blocking Call"""
         self.__block = True
@@ -238,133 +736,357 @@ class HoloGram:
         """Return config loaded state"""
         return True if self.__config != None else False
 
-    def _filter_background_process(self) -> None:
-        """Filtering Background, run fourier transform and shift, return background intensity"""
-        holo_to_filter = self.HOLOGRAM[self.left:self.right, self.top:self.bot] if self._roi_enabled else self.HOLOGRAM
-        back_to_filter = self.BACKGROUND[self.left:self.right, self.top:self.bot] if self._roi_enabled else self.BACKGROUND
-
-        self.FOURIER_FILTER = utils.filter_fixed_point(hologram_raw=holo_to_filter, quad=self._filter_quadrant_main,
-                                                    filter_rate=self._filter_rate_main, filter_type=self._filter_type_main)
-
-        background_filtered = utils.fourier_process(back_to_filter, self.FOURIER_FILTER)
-        self.BACKGROUND_PROCESSED = np.exp(complex(0, 1) * np.angle(np.conj(background_filtered)))
+    def get_params(self) -> engine.ReconParams:
+        """Snapshot the current parameters into an immutable ReconParams for the engine"""
+        return engine.ReconParams(mode=self.__dhm_mode,
+                                  pixel_x=self._pixel_x_main, pixel_y=self._pixel_y_main,
+                                  refractive_index=self._refractive_index_main,
+                                  magnification=self._magnification_main, wavelength=self._wavelength_main,
+                                  diffraction_distance=self._diffraction_distance,
+                                  rec_start=self._rec_start, rec_end=self._rec_end,
+                                  rec_zstack_qty=self._rec_zstack_qty,
+                                  filter_type=self._filter_type_main, filter_quadrant=self._filter_quadrant_main,
+                                  filter_rate=self._filter_rate_main, apo_pad_size=self._apo_pad_size,
+                                  apo_k_factor=self.__apo_k_factor,
+                                  roi=(self.left, self.right, self.top, self.bot) if self._roi_enabled else None)
 
     def hologram_process(self, holo_num : int, stop : bool) -> Optional[int]:
         """Process Off-axis Hologram in the loop, using blocking call to terminate"""
+        params = self.get_params()
+        keys = self._product_keys(holo_num, self._OFFAXIS_PRODUCTS, params)
+        if len(keys) > 0 and self._offaxis_from_outputs(holo_num, keys, params):
+            return
+        timer = self._timer
+        timer.start_frame()
         while True:
-            self.load_hologram_img(holo_num)
+            with timer.stage("load"):
+                hologram = self._load_processing_frame(holo_num, params)
 
             if self.get_block() == True:
                 self.set_block()
                 return -1
 
-            self._filter_background_process()
-
-            hologram = utils.fourier_process(self.HOLOGRAM[self.left:self.right, self.top:self.bot], self.FOURIER_FILTER)\
-                if self._roi_enabled else utils.fourier_process(self.HOLOGRAM, self.FOURIER_FILTER)
-
-            holo_cleared = hologram * self.BACKGROUND_PROCESSED
-            holo_processed = utils.apodization_process(holo_cleared, self.__apo_k_factor, self._apo_pad_size)
-            phase_reconed, intensity_reconed = self._reconstruction_offaxis(holo_processed, self._vector, self._delta, 
-                                                                self._diffraction_distance, self._apo_pad_size)
+            holo_cleared, fourier_filters = engine.offaxis_fields(hologram[np.newaxis], self.BACKGROUND, params,
+                                                                  self._cache, timer)
+            holo_cleared, self.FOURIER_FILTER = holo_cleared[0], fourier_filters[0]
+            with timer.stage("apodize"):
+                apodized = engine.apodize_offaxis_stack(holo_cleared[np.newaxis], params, self._cache)
+            if self._field_save is True and self._save_path_main != "":
+                with timer.stage("save"):
+                    field = apodized[0] if self._field_apodized else holo_cleared
+                    self.get_field_store(len(self.HOLO_LIST), field.shape).write(holo_num, field)
+            with timer.stage("propagate"):
+                phase_reconed, intensity_reconed = engine.propagate_apodized_stack(apodized, params,
+                                                                                   cache=self._cache)
 
             if self.get_block() == True:
                 self.set_block()
                 return -2
 
-            self.WRAPPED_PHASE = phase_reconed
-            self.INTENSITY_MAP = intensity_reconed            
-            self.PHASE_MAP = unwrap_phase(self.WRAPPED_PHASE)
-            self.HEIGHT_MAP = self.PHASE_MAP / self._height_factor
+            with timer.stage("unwrap"):
+                self._set_offaxis_maps(phase_reconed[0], intensity_reconed[0], params)
 
             if self.get_block() == True:
                 self.set_block()
                 return -3
 
             fname = os.path.splitext(self.HOLO_LIST[holo_num])[0]
-            self._save_results(holo_num, fname)
+            with timer.stage("save"):
+                self._save_results(holo_num, fname, keys)
+            timer.frame_done()
             return
 
+    def _set_offaxis_maps(self, phase_reconed, intensity_reconed, params: engine.ReconParams) -> None:
+        self.WRAPPED_PHASE = phase_reconed
+        self.INTENSITY_MAP = intensity_reconed
+        self.PHASE_MAP = utils.unwrap_phase(self.WRAPPED_PHASE)
+        self.HEIGHT_MAP = self.PHASE_MAP / params.height_factor
+
+    def _stored_field(self, holo_num, params: engine.ReconParams, store=None) -> np.ndarray:
+        """Apodized stored field of a frame, KeyError or FileNotFoundError if it was not stored"""
+        store = self.get_field_store() if store is None else store
+        field = store.read(holo_num)
+        if store.is_apodized():
+            return field
+        return engine.apodize_offaxis_stack(field[np.newaxis], params, self._cache)[0]
+
+    def repropagate(self, holo_num: int, store: Optional[fields.FieldStore] = None) -> Optional[int]:
+        """Height, phase and wrapped phase maps of an off-axis frame at the current diffraction distance, propagated
+        from its stored field (see set_field_store_param) and saved by the saving flags; -2 if it was not stored"""
+        params = self.get_params()
+        try:
+            field = self._stored_field(holo_num, params, store)
+        except (FileNotFoundError, KeyError):
+            return -2
+        phase_reconed, intensity_reconed = engine.propagate_apodized_stack(field[np.newaxis], params,
+                                                                           cache=self._cache)
+        self._set_offaxis_maps(phase_reconed[0], intensity_reconed[0], params)
+        keys = self._product_keys(holo_num, self._OFFAXIS_PRODUCTS, params)
+        self._save_results(holo_num, os.path.splitext(self.HOLO_LIST[holo_num])[0], keys)
+        return 1
+
+    def repropagate_stack(self, holo_num: int, store: Optional[fields.FieldStore] = None) -> Optional[int]:
+        """Z-stack of intensities between the start & end distances, propagated from the stored field of an off-axis
+        frame with one forward FFT and saved as its inline frames; -2 if the field was not stored"""
+        params = self.get_params()
+        try:
+            field = self._stored_field(holo_num, params, store)
+        except (FileNotFoundError, KeyError):
+            return -2
+        distances = [params.slice_distance(z_step) for z_step in range(1, params.rec_zstack_qty + 1)]
+        keys = self._product_keys(holo_num, ('inline_frame',), params, params.rec_zstack_qty)
+        for z_idx, (_, phase_reconed, intensity_reconed) in enumerate(
+                engine.iter_apodized_distances(field, params, distances, self._cache)):
+            self.WRAPPED_PHASE = phase_reconed
+            self.REFOCUSED_VOLUME = intensity_reconed
+            if self._inline_save is True and self._save_path_main != "":
+                self._save_current(holo_num, 'inline_frame', self.REFOCUSED_VOLUME, keys, z_idx)
+        return 1
+
+    def prepare_refocus(self, holo_num: int) -> Optional[int]:
+        """Compute the spectrum of the apodized field of an off-axis frame once, to refocus it at any distance with
+        refocus_preview and refocus_img; -1 or -2 as load_hologram_img when the frame can not be read"""
+        params = self.get_params()
+        key = (self.get_read_path(), holo_num, self.get_background_identity(),
+               params.with_changes(diffraction_distance=0.0))
+        if self._refocus is not None and self._refocus[0] == key:
+            return 1
+        ret = self.load_hologram_img(holo_num) if params.roi is None else self.load_hologram_roi(holo_num, params.roi)
+        if ret != 1:
+            return ret
+        hologram = self.HOLOGRAM if params.roi is None else self._hologram_roi
+        holo_cleared, fourier_filters = engine.offaxis_fields(hologram[np.newaxis], self.BACKGROUND, params,
+                                                              self._cache)
+        self.FOURIER_FILTER = fourier_filters[0]
+        apodized = engine.apodize_offaxis_stack(holo_cleared, params, self._cache)[0]
+        self._refocus = (key, engine.refocus_spectrum(apodized))
+        return 1
+
+    def get_refocus_shape(self) -> Optional[Tuple[int, int]]:
+        """Shape of the apodized field of the frame prepared for refocusing, None if there is none"""
+        return None if self._refocus is None else self._refocus[1].shape
+
+    def refocus_preview(self, diffrac_dist: float, factor: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Wrapped phase and intensity of the frame prepared for refocusing at diffrac_dist, about factor times
+        smaller in each dimension (see engine.refocus)"""
+        return engine.refocus(self._refocus[1], self.get_params(), diffrac_dist, factor, self._cache)
+
+    def refocus_img(self, diffrac_dist: float) -> None:
+        """Set all maps of the frame prepared for refocusing at diffrac_dist, at full resolution"""
+        params = self.get_params().with_changes(diffraction_distance=diffrac_dist)
+        phase_reconed, intensity_reconed = engine.refocus(self._refocus[1], params, diffrac_dist, cache=self._cache)
+        self._set_offaxis_maps(phase_reconed, intensity_reconed, params)
+
+    def prepare_spectrum(self, holo_num: int) -> Optional[int]:
+        """Compute the shifted spectrum of an off-axis frame (its ROI) once, to preview filter settings with
+        sideband_preview, and its log magnitude into SPECTRUM; -1 or -2 as load_hologram_img when the frame can not
+        be read"""
+        params = self.get_params()
+        key = (self.get_read_path(), holo_num, params.roi)
+        if self._spectrum is not None and self._spectrum[0] == key:
+            return 1
+        ret = self.load_hologram_img(holo_num) if params.roi is None else self.load_hologram_roi(holo_num, params.roi)
+        if ret != 1:
+            return ret
+        spectrum = engine.refocus_spectrum(self.HOLOGRAM if params.roi is None else self._hologram_roi)
+        self.SPECTRUM = np.log1p(np.abs(spectrum)).astype(np.float32)
+        self._spectrum = (key, spectrum, {})
+        # Spectrum of the background, frequency grid and sideband center are computed here rather than on the
+        # first preview
+        self.sideband_preview(params.filter_type, params.filter_rate * 100, params.filter_quadrant)
+        return 1
+
+    def sideband_preview(self, filter_type: str, filter_rate: int, filter_quadrant: str
+                         ) -> Tuple[Tuple[int, int, int], np.ndarray]:
+        """Sideband geometry (center row, column and radius) of the frame prepared with prepare_spectrum for the
+        filter params, with filter rate in percentage as set_filter_param, and the wrapped phase of the field it
+        selects at the diffraction distance, at reduced resolution (see engine.sideband_preview)"""
+        params = self.get_params().with_changes(filter_type=filter_type, filter_rate=float(filter_rate/100),
+                                                filter_quadrant=filter_quadrant)
+        _, spectrum, centers = self._spectrum
+        if filter_quadrant not in centers:
+            centers[filter_quadrant] = utils.find_sideband(spectrum, filter_quadrant, 1.0)[:2]
+        center_x, center_y = centers[filter_quadrant]
+        geometry = (center_x, center_y,
+                    utils.sideband_radius(spectrum.shape[0], spectrum.shape[1], center_x, center_y, params.filter_rate))
+        wrapped_phase, _ = engine.sideband_preview(spectrum, self.BACKGROUND, params, geometry, cache=self._cache)
+        return geometry, wrapped_phase
+
+    def has_spectrum(self) -> bool:
+        """Whether a frame is prepared with prepare_spectrum"""
+        return self._spectrum is not None
+
+    def _offaxis_from_outputs(self, holo_num, keys: dict, params: engine.ReconParams) -> bool:
+        """Incremental mode: show the up-to-date products of the frame and derive its missing products from an
+        up-to-date float32 phase or height map (or wrapped phase). False if the frame must be reconstructed."""
+        flags = dict(zip(('height_map', 'phase_map', 'wrapped_phase'), self.get_save_flags()))
+        current = [product for product in self._OFFAXIS_PRODUCTS if self._is_current(holo_num, product, keys)]
+        wanted = [product for product in self._OFFAXIS_PRODUCTS if flags[product]]
+        if len(keys) == 0 or len(wanted) == 0:
+            return False # Nothing is saved, the frame is reconstructed to be shown
+        missing = [product for product in wanted if product not in current]
+        try:
+            if len(missing) == 0:
+                for product in wanted:
+                    setattr(self, product.upper(), self._read_output(holo_num, product))
+                return True
+            source = next((product for product in current if self._output_dtypes[product] == 'float32'), None)
+            if source is None or ('wrapped_phase' in missing and self._output_dtypes['wrapped_phase'] == 'int16_complex'):
+                return False # int16_complex needs the intensity map of the reconstruction
+            image = self._read_output(holo_num, source)
+        except (FileNotFoundError, KeyError, ValueError, tf.TiffFileError):
+            return False
+        if source == 'phase_map':
+            self.PHASE_MAP = image
+        elif source == 'height_map':
+            self.PHASE_MAP = image * params.height_factor
+        else:
+            self.PHASE_MAP = utils.unwrap_phase(image)
+        self.HEIGHT_MAP = self.PHASE_MAP / params.height_factor
+        self.WRAPPED_PHASE = image if source == 'wrapped_phase' else np.angle(np.exp(1j * self.PHASE_MAP))
+        self._save_results(holo_num, os.path.splitext(self.HOLO_LIST[holo_num])[0], keys)
+        return True
+
     def hologram_inline_process(self, holo_num : int, stop : bool) -> Optional[int]:
         """Process In-line Hologram in the loop, using blocking call to terminate"""
+        params = self.get_params()
+        keys = self._product_keys(holo_num, ('inline_frame',), params, params.rec_zstack_qty) \
+            if self._inline_save else {}
+        stale = None
+        if len(keys) > 0:
+            stale = [z_idx for z_idx in range(params.rec_zstack_qty)
+                     if not self._is_current(holo_num, 'inline_frame', keys, z_idx)]
+            if len(stale) == 0 and self.load_reconstruction_img(holo_num, params.rec_zstack_qty - 1) == 1:
+                self._diffraction_distance = params.slice_distance(params.rec_zstack_qty)
+                return
+        timer = self._timer
+        timer.start_frame()
         while True:
-            self.load_hologram_img(holo_num)
+            with timer.stage("load"):
+                hologram = self._load_processing_frame(holo_num, params)
 
             if self.get_block() == True:
                 self.set_block()
                 return -1
 
-            hologram = self.HOLOGRAM[self.left:self.right, self.top:self.bot] if self._roi_enabled else self.HOLOGRAM
-            background = self.BACKGROUND[self.left:self.right, self.top:self.bot] if self._roi_enabled else self.BACKGROUND
-            
-            holo_cleared = (hologram - background) / background
+            with timer.stage("filter"):
+                holo_cleared = engine.inline_field_roi(hologram, self.BACKGROUND, params, self._cache)
 
             if self.get_block() == True:
                 self.set_block()
                 return -2
 
             fname = os.path.splitext(self.HOLO_LIST[holo_num])[0]
-            self._reconstruction_inline(holo_cleared, holo_num, fname, self._rec_start,
-                                            self._rec_end, self._rec_zstack_qty)
+            self._reconstruction_inline(holo_cleared, holo_num, fname, params, keys, stale)
+            timer.frame_done()
             return
 
-    def _reconstruction_inline(self, image, num, name, recon_start, recon_end, slice_qty) -> None:
+    def _reconstruction_inline(self, image, num, name, params: engine.ReconParams, keys=None, z_indices=None) -> None:
         """Inline reconstruction using angular spectrum method. Able to reconstruct a volume using
-        the start & end distances as well as the the z stack slice quantities. Dump result in the save dir."""
-
-        image_fft, kz, mask = utils.angular_mask(image, self._vector, self._delta)
-
-        for z_step in range(1, slice_qty+1):
-            diffract_dist = recon_start + z_step * (recon_end - recon_start) / slice_qty
-            fft_core = np.where(mask, image_fft * np.exp(complex(0, 1) * kz * diffract_dist), 0)
+        the start & end distances as well as the the z stack slice quantities. Dump result in the save dir.
+        In incremental mode, only the slices z_indices that are not up to date are reconstructed."""
+        for z_idx, diffract_dist, refocused in engine.iter_inline_slices(image, params, self._cache, z_indices,
+                                                                         self._timer):
             self._diffraction_distance = diffract_dist
-            reconed_field = np.fft.ifft2(np.fft.ifftshift(fft_core))
-            self.REFOCUSED_VOLUME = np.real(reconed_field * np.conjugate(reconed_field))
+            self.REFOCUSED_VOLUME = refocused
             if self._inline_save is True:
-                f"Saving {num}_inline_frame_{z_step-1}.tiff..."
-                tf.imwrite(f"{self._save_path_main}/{num}_inline_frame_{z_step-1}.tiff", self.REFOCUSED_VOLUME.astype('float32'))
-
-    def _reconstruction_offaxis(self, image, vector, delta, diffrac_dist, pad_size) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
-        """offaxis reconstruction using angular spectrum method. Able to reconstruct on one distance
-        slice based on the set diffraction distance only."""
-
-        if diffrac_dist == 0.0:
-            reconed_field = image
-        else:
-            fft_img, kz, mask = utils.angular_mask(image, vector, delta)
-            fft_core = np.where(mask, fft_img * np.exp(complex(0, 1) * kz * diffrac_dist), 0)
-            reconed_field = np.fft.ifft2(np.fft.ifftshift(fft_core))
-
-        if self._roi_enabled is True:
-            reconed_field = reconed_field[pad_size: pad_size + self.right - self.left,
-                pad_size: pad_size + self.bot - self.top,]
+                f"Saving {num}_inline_frame_{z_idx}.tiff..."
+                with self._timer.stage("save"):
+                    self._save_current(num, 'inline_frame', self.REFOCUSED_VOLUME, keys, z_idx)
+
+    def load_inline_sections(self, holo_num: int, row: int, column: int) -> Optional[int]:
+        """XZ section through the row and YZ section through the column of the inline volume of a frame, between
+        the start & end distances, into XZ_SECTION and YZ_SECTION (see engine.inline_sections). The spectrum of the
+        frame is computed once and its sections are cached until another frame or other parameters are sectioned.
+        -1 or -2 as load_hologram_img when the frame can not be read, -3 without slices to section."""
+        params = self.get_params()
+        if params.rec_zstack_qty < 1:
+            return -3
+        key = (self.get_read_path(), holo_num, self.get_background_identity(),
+               params.with_changes(diffraction_distance=0.0))
+        if self._sections is None or self._sections[0] != key:
+            ret = self.load_hologram_img(holo_num) if params.roi is None else \
+                self.load_hologram_roi(holo_num, params.roi)
+            if ret != 1:
+                return ret
+            hologram = self.HOLOGRAM if params.roi is None else self._hologram_roi
+            holo_cleared = engine.inline_field_roi(hologram, self.BACKGROUND, params, self._cache)
+            self._sections = (key, engine.refocus_spectrum(holo_cleared), OrderedDict())
+        _, spectrum, cached = self._sections
+        row, column = min(max(row, 0), spectrum.shape[0] - 1), min(max(column, 0), spectrum.shape[1] - 1)
+        xz, yz = engine.inline_sections(spectrum, params, None if ('xz', row) in cached else row,
+                                        None if ('yz', column) in cached else column, self._cache)
+        for section_key, section in ((('xz', row), xz), (('yz', column), yz)):
+            if section is not None:
+                cached[section_key] = section
+            cached.move_to_end(section_key)
+        while len(cached) > self._SECTION_CACHE_SIZE:
+            cached.popitem(last=False)
+        self.XZ_SECTION, self.YZ_SECTION = cached[('xz', row)], cached[('yz', column)]
+        return 1
+
+    def get_section_shape(self) -> Optional[Tuple[int, int]]:
+        """Shape of the inline field sectioned last, None if there is none"""
+        return None if self._sections is None else self._sections[1].shape
+
+    def _save_product(self, num, product, image, z_idx=None) -> None:
+        """Save one image as {num}_{product}[_{z_idx}].tiff, or append it to the stack or array of the product"""
+        if self._output_format in volume_store.VOLUME_BACKENDS:
+            self._get_volume_store().write(product, num, image.astype('float32'), z_idx,
+                                           frame_count=len(self.HOLO_LIST), z_count=self._rec_zstack_qty)
+        elif self._output_format == 'stack':
+            writer = self._stack_writers.get(product)
+            if writer is None:
+                stack_path = f"{self._save_path_main}/{stacks.stack_name(product, self._output_stack_tag)}"
+                writer = self._stack_writers[product] = stacks.StackWriter(stack_path, self._tiff_kwargs(product))
+            writer.write(num, 0 if z_idx is None else z_idx, *self._quantize(product, image))
         else:
-            reconed_field = reconed_field[pad_size: pad_size + self._shape_x_main,
-                pad_size: pad_size + self._shape_y_main,]
-
-        reconstructed_intensity = np.real(reconed_field * np.conjugate(reconed_field))
-        reconstructed_phase = np.angle(reconed_field)
-        return reconstructed_phase, reconstructed_intensity
+            suffix = "" if z_idx is None else f"_{z_idx}"
+            file_path = f"{self._save_path_main}/{num}_{product}{suffix}.tiff"
+            write = functools.partial(pyramid.write_pyramid, min_size=self._pyramid_min_size) if self._pyramid \
+                else tf.imwrite
+            if self._output_dtypes[product] == 'float32':
+                write(file_path, image.astype('float32'), **self._tiff_kwargs(product))
+            else:
+                stored, quantization = self._quantize(product, image)
+                write(file_path, stored, description=quantize.description(quantization), metadata=None,
+                      **quantize.tiff_kwargs(quantization), **self._tiff_kwargs(product))
+
+    def _quantize(self, product, image) -> Tuple[np.ndarray, quantize.Quantization]:
+        """Image of a product in its output dtype, and the quantization to recover its physical values"""
+        step = quantize.phase_step(product, self.get_params().height_factor)
+        return quantize.quantize(image, self._output_dtypes[product], step, intensity=self.INTENSITY_MAP)
+
+    def _tiff_kwargs(self, product) -> dict:
+        return compression.tiff_kwargs(self._compression[product], self._compression_workers)
+
+    def _save_current(self, num, product, image, keys=None, z_idx=None) -> None:
+        """Save a product, in incremental mode only if it is not up to date, and record its key"""
+        if keys and self._is_current(num, product, keys, z_idx):
+            return
+        self._save_product(num, product, image, z_idx)
+        if keys:
+            self._get_build_log().record(num, product, keys[(product, z_idx)], z_idx)
 
-    def _save_results(self, num, name) -> None:
+    def _save_results(self, num, name, keys=None) -> None:
         """Save Off-axis DHM images by saving flags"""
         if self._save_path_main == "":
             return
         if self._height_map_save is True:
             #f"Saving height map {num} at {self._save_path_main}..."
-            tf.imwrite(f"{self._save_path_main}/{num}_height_map.tiff", self.HEIGHT_MAP.astype('float32'))
+            self._save_current(num, 'height_map', self.HEIGHT_MAP, keys)
         if self._phase_map_save is True:
             #f"Saving phase map {num} at {self._save_path_main}..."
-            tf.imwrite(f"{self._save_path_main}/{num}_phase_map.tiff", self.PHASE_MAP.astype('float32'))
+            self._save_current(num, 'phase_map', self.PHASE_MAP, keys)
         if self._wrapped_phase_save is True:
             #f"Saving wrapped phase {num} at {self._save_path_main}..."
-            tf.imwrite(f"{self._save_path_main}/{num}_wrapped_phase.tiff", self.WRAPPED_PHASE.astype('float32'))
+            self._save_current(num, 'wrapped_phase', self.WRAPPED_PHASE, keys)
 
     def _dump_config_receipt(self, config_save_path) -> None:
         """Save Configuration Receipt .ini file to path"""
 
         config = configparser.ConfigParser()
-        config['DHM_Mode'] = {'mode': ''}
+        config['DHM_Mode'] = {'mode': self.__dhm_mode}
         config['File_Paths'] = {'read_path_main': self._read_path_main,
                             'read_path_back': self._read_path_back,
                             'save_path_main': self._save_path_main}
@@ -387,6 +1109,33 @@ class HoloGram:
                             'inline_save': self._inline_save}
         config['Processing_Range'] = {'process_range_start': self._process_range_start+1,
                             'process_range_end': self._process_range_end+1}
+        config['Output'] = {'format': self._output_format,
+                            'volume_chunks': ','.join(str(size) for size in self._volume_chunks),
+                            'volume_compression': self._volume_compression,
+                            'volume_level': self._volume_level}
+        config['Output'].update({f'{product}_dtype': dtype for product, dtype in self._output_dtypes.items()})
+        config['Output']['incremental'] = str(self._incremental)
+        config['Output']['pyramid'] = str(self._pyramid)
+        config['Output']['pyramid_min_size'] = str(self._pyramid_min_size)
+        config['Output']['save_field'] = str(self._field_save)
+        config['Output']['field_apodized'] = str(self._field_apodized)
+        config['Compression'] = {'maxworkers': self._compression_workers,
+                            **{product: str(codec) for product, codec in self._compression.items()}}
+        config['Background'] = {'method': self._background_method,
+                            'sigma': self._background_sigma,
+                            'iterations': self._background_iterations,
+                            'memory_limit': self._background_memory,
+                            'workers': self._background_workers}
+        config['Raw_Source'] = {'width': self._raw_width,
+                            'height': self._raw_height,
+                            'dtype': self._raw_dtype,
+                            'header_bytes': self._raw_header_bytes,
+                            'frame_header_bytes': self._raw_frame_header_bytes}
+        config['Live_Mode'] = {'latency_target': self._live_latency_target,
+                            'skip_frames': self._live_skip_frames,
+                            'poll_interval': self._live_poll_interval}
+        config['Display'] = {'preview_fps': self._preview_fps}
+        config['Timing'] = {'stage_timing': self._stage_timing}
         with open(f'{config_save_path}', 'w') as configfile:
             config.write(configfile)
 
@@ -399,6 +1148,8 @@ class HoloGram:
         self._load_config_path = config_read_path
         config = configparser.ConfigParser()
         config.read(config_read_path)
+        if self.__dhm_mode == '' and config.get('DHM_Mode', 'mode', fallback='') in ('Offaxis', 'Inline'):
+            self.set_dhm_mode(config['DHM_Mode']['mode'])
         self.set_sys_param( pixel_x = float(config['System_Parameters']['pixel_x_main']), 
                             pixel_y = float(config['System_Parameters']['pixel_y_main']), 
                             refractive_index = float(config['System_Parameters']['refractive_index_main']),
@@ -430,4 +1181,37 @@ class HoloGram:
         self.set_range_start(rng_start if rng_start > 0 else 0)
         self.set_range_end(rng_end if rng_end > 0 else 0)
 
+        # Sections added after the first release are optional, older receipts keep the defaults
+        self.set_output_format(config.get('Output', 'format', fallback='files'))
+        self.set_incremental(config.getboolean('Output', 'incremental', fallback=False))
+        self.set_pyramid_param(enabled = config.getboolean('Output', 'pyramid', fallback=False),
+                               min_size = config.getint('Output', 'pyramid_min_size',
+                                                        fallback=pyramid.MIN_LEVEL_SIZE))
+        self.set_field_store_param(save = config.getboolean('Output', 'save_field', fallback=False),
+                                   apodized = config.getboolean('Output', 'field_apodized', fallback=False))
+        self.set_volume_store_param(
+            chunks = volume_store.parse_chunks(config.get('Output', 'volume_chunks', fallback='1,8,256,256')),
+            compression = config.get('Output', 'volume_compression', fallback='zstd'),
+            level = config.getint('Output', 'volume_level', fallback=3))
+        for product in stacks.STACK_PRODUCTS:
+            self.set_output_dtype(product, config.get('Output', f'{product}_dtype', fallback='float32'))
+            self.set_compression_param(product, *compression.parse_codec(config.get('Compression', product,
+                                                                                    fallback='none')))
+        self.set_compression_workers(config.getint('Compression', 'maxworkers', fallback=4))
+        self.set_background_param(method = config.get('Background', 'method', fallback='mean'),
+                            sigma = config.getfloat('Background', 'sigma', fallback=3.0),
+                            iterations = config.getint('Background', 'iterations', fallback=3),
+                            memory = config.getint('Background', 'memory_limit', fallback=512),
+                            workers = config.getint('Background', 'workers', fallback=4))
+        self.set_raw_source_param(width = config.getint('Raw_Source', 'width', fallback=0),
+                            height = config.getint('Raw_Source', 'height', fallback=0),
+                            dtype = config.get('Raw_Source', 'dtype', fallback='uint16'),
+                            header_bytes = config.getint('Raw_Source', 'header_bytes', fallback=0),
+                            frame_header_bytes = config.getint('Raw_Source', 'frame_header_bytes', fallback=0))
+        self.set_live_param(latency_target = config.getfloat('Live_Mode', 'latency_target', fallback=1.0),
+                            skip_frames = config.getboolean('Live_Mode', 'skip_frames', fallback=True),
+                            poll_interval = config.getfloat('Live_Mode', 'poll_interval', fallback=0.05))
+        self.set_preview_param(max_fps = config.getfloat('Display', 'preview_fps', fallback=5.0))
+        self.set_timing_param(enabled = config.getboolean('Timing', 'stage_timing', fallback=True))
+
         self.__config = config
\ No newline at end of file
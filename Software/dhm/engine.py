@@ -0,0 +1,519 @@
+"""Stateless reconstruction engine.
+
+Everything in here is a pure function of the frame, the background and an immutable ReconParams, so several series
+or cameras can be reconstructed concurrently (threads or process pools) without sharing any buffer. HoloGram keeps
+the GUI-facing state and delegates the numerics to this module.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from threading import Lock
+from typing import Any, Callable, Collection, Hashable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from dhm import utils, timing
+
+Roi = Tuple[int, int, int, int]  # left, right, top, bot; rows are [left:right], columns are [top:bot]
+
+
+@dataclass(frozen=True)
+class ReconParams:
+    """Immutable parameters of a reconstruction run. Lengths are in micrometer."""
+    mode: str = "Offaxis"  # "Offaxis" or "Inline"
+
+    # System Parameters
+    pixel_x: float = 1.85
+    pixel_y: float = 1.85
+    refractive_index: float = 1.52
+    magnification: int = 20
+    wavelength: float = 0.635
+
+    # Reconstruction Parameters
+    diffraction_distance: float = 0.0
+    rec_start: float = 0.0
+    rec_end: float = 0.0
+    rec_zstack_qty: int = 0
+
+    # Filter Parameters
+    filter_type: str = "Hann"
+    filter_quadrant: str = "1"
+    filter_rate: float = 1.0  # ratio, not percentage
+    apo_pad_size: int = 100
+    apo_k_factor: float = 1.5  # Golden Value
+
+    roi: Optional[Roi] = None
+
+    @property
+    def delta(self) -> float:
+        """Pixel size in the sample plane"""
+        return self.pixel_x / self.magnification
+
+    @property
+    def vector(self) -> float:
+        """Wave number in the medium"""
+        return 2 * self.refractive_index * np.pi / self.wavelength
+
+    @property
+    def height_factor(self) -> float:
+        """Phase to height conversion factor"""
+        return 2 * self.refractive_index * np.pi / self.wavelength
+
+    def slice_distance(self, z_step: int) -> float:
+        """Propagation distance of the inline slice z_step, counted from 1 to rec_zstack_qty"""
+        return self.rec_start + z_step * (self.rec_end - self.rec_start) / self.rec_zstack_qty
+
+    def with_changes(self, **changes) -> "ReconParams":
+        """Return a copy with some parameters changed"""
+        return replace(self, **changes)
+
+
+@dataclass
+class ReconResult:
+    """Products of one reconstruction; products that the mode does not produce are None.
+    refocused_volume is indexed (z, y, x)."""
+    fourier_filter: Optional[np.ndarray] = None
+    wrapped_phase: Optional[np.ndarray] = None
+    phase_map: Optional[np.ndarray] = None
+    height_map: Optional[np.ndarray] = None
+    intensity_map: Optional[np.ndarray] = None
+    refocused_volume: Optional[np.ndarray] = None
+
+
+class EngineCache:
+    """Bounded LRU of the arrays that depend only on geometry and parameters: sideband filters, processed
+    backgrounds, apodization windows and propagators. Keeping one per worker (or per HoloGram) avoids recomputing
+    them for every frame. Thread-safe; values are never modified after insertion."""
+
+    _entries: "OrderedDict[Hashable, Any]"
+    _max_bytes: int
+    _nbytes: int
+
+    def __init__(self, max_bytes: int = 1 << 30) -> None:
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._max_bytes = max_bytes
+        self._nbytes = 0
+        self._lock = Lock()
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the cached value of the key, computing (outside of the lock) and storing it if missing"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = compute()
+        size = _nbytes(value)
+        if size > self._max_bytes:
+            return value
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = value
+                self._sizes[key] = size
+                self._nbytes += size
+                while self._nbytes > self._max_bytes:
+                    old_key, _ = self._entries.popitem(last=False)
+                    self._nbytes -= self._sizes.pop(old_key)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _nbytes(value: Any) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(_nbytes(item) for item in value)
+    return 0
+
+
+_NO_CACHE = EngineCache(max_bytes=0)
+_NO_TIMER = timing.StageTimer(enabled=False)
+_SHIFT_AXES = (-2, -1)
+
+
+def crop_roi(image: np.ndarray, roi: Optional[Roi]) -> np.ndarray:
+    """Return the ROI view of the image, or the image itself without ROI"""
+    if roi is None:
+        return image
+    left, right, top, bot = roi
+    return image[left:right, top:bot]
+
+
+def _sideband_filter(spectrum: np.ndarray, params: ReconParams, cache: EngineCache) -> Tuple[Hashable, np.ndarray]:
+    """Locate the sideband in the shifted spectrum and return the geometry key and the (cached) filter"""
+    center_x, center_y, radius = utils.find_sideband(spectrum, params.filter_quadrant, params.filter_rate)
+    key = (spectrum.shape, center_x, center_y, radius, params.filter_type)
+    fourier_filter = cache.get(("filter",) + key, lambda: utils.sideband_filter(
+        spectrum.shape[0], spectrum.shape[1], center_x, center_y, radius, params.filter_type))
+    return key, fourier_filter
+
+
+def _background_processed(background: np.ndarray, filter_key: Hashable, fourier_filter: np.ndarray,
+                          params: ReconParams, cache: EngineCache) -> np.ndarray:
+    """Background phase conjugate for the given sideband filter. The cache entry holds a reference to the
+    background, so that its id cannot be reused by another array while the entry is alive."""
+    def compute() -> Tuple[np.ndarray, np.ndarray]:
+        background_filtered = utils.fourier_process(_background_roi(background, params, cache), fourier_filter)
+        return background, np.exp(complex(0, 1) * np.angle(np.conj(background_filtered)))
+    key = ("background", id(background), params.roi, filter_key)
+    return cache.get(key, compute)[1]
+
+
+def _background_roi(background: np.ndarray, params: ReconParams, cache: EngineCache) -> np.ndarray:
+    """Contiguous copy of the background ROI, cropped once per background and ROI"""
+    if params.roi is None:
+        return background
+    key = ("background_roi", id(background), params.roi)
+    return cache.get(key, lambda: (background, np.ascontiguousarray(crop_roi(background, params.roi))))[1]
+
+
+def _apodization_window(shape: Tuple[int, int], params: ReconParams, cache: EngineCache) -> np.ndarray:
+    key = ("apodization", shape, params.apo_k_factor, params.apo_pad_size)
+    return cache.get(key, lambda: utils.apodization_window(shape, params.apo_k_factor, params.apo_pad_size))
+
+
+def _angular_grid(shape: Tuple[int, int], params: ReconParams, cache: EngineCache) -> Tuple[np.ndarray, np.ndarray]:
+    return cache.get(("grid", shape, params.vector, params.delta),
+                     lambda: utils.angular_spectrum_grid(shape, params.vector, params.delta))
+
+
+def _propagator(shape: Tuple[int, int], params: ReconParams, diffrac_dist: float, cache: EngineCache) -> np.ndarray:
+    """Angular spectrum transfer function (on the shifted spectrum) of a propagation over diffrac_dist"""
+    def compute() -> np.ndarray:
+        kz, mask = _angular_grid(shape, params, cache)
+        return np.where(mask, np.exp(complex(0, 1) * kz * diffrac_dist), 0)
+    return cache.get(("propagator", shape, params.vector, params.delta, diffrac_dist), compute)
+
+
+def offaxis_fields(holograms: np.ndarray, background: np.ndarray, params: ReconParams,
+                   cache: Optional[EngineCache] = None,
+                   timer: Optional[timing.StageTimer] = None) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """Filtered and background-corrected complex fields of a (n, y, x) stack of ROI-cropped off-axis holograms,
+    computed with one stacked FFT. The spectrum used to locate the sideband is reused for the filtering.
+    Return the fields and the fourier filter of every frame."""
+    cache = _NO_CACHE if cache is None else cache
+    timer = _NO_TIMER if timer is None else timer
+    with timer.stage("fft"):
+        spectra = np.fft.fftshift(np.fft.fft2(holograms), axes=_SHIFT_AXES)
+    with timer.stage("filter"):
+        backgrounds = np.empty(spectra.shape, dtype=complex)
+        fourier_filters = []
+        for idx, spectrum in enumerate(spectra):
+            filter_key, fourier_filter = _sideband_filter(spectrum, params, cache)
+            spectrum *= fourier_filter
+            backgrounds[idx] = _background_processed(background, filter_key, fourier_filter, params, cache)
+            fourier_filters.append(fourier_filter)
+    with timer.stage("fft"):
+        fields = np.fft.ifft2(np.fft.ifftshift(spectra, axes=_SHIFT_AXES))
+    with timer.stage("filter"):
+        fields *= backgrounds
+    return fields, fourier_filters
+
+
+def offaxis_field(hologram: np.ndarray, background: np.ndarray, params: ReconParams,
+                  cache: Optional[EngineCache] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Filtered and background-corrected complex field of an off-axis hologram (full frames, ROI applied here).
+    Return the field and the fourier filter used."""
+    fields, fourier_filters = offaxis_fields(crop_roi(hologram, params.roi)[np.newaxis], background, params, cache)
+    return fields[0], fourier_filters[0]
+
+
+def apodize_offaxis_stack(fields: np.ndarray, params: ReconParams, cache: Optional[EngineCache] = None) -> np.ndarray:
+    """Edge-pad a (n, y, x) stack of off-axis fields by the apodization pad size and apply the apodization window,
+    ready for propagate_apodized_stack"""
+    cache = _NO_CACHE if cache is None else cache
+    pad_size = params.apo_pad_size
+    image = np.pad(fields, pad_width=((0, 0), (pad_size, pad_size), (pad_size, pad_size)), mode='edge')
+    image *= _apodization_window(fields.shape[-2:], params, cache)
+    return image
+
+
+def _phase_intensity(reconed_field: np.ndarray, pad_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Wrapped phase and intensity of propagated apodized fields, cropped back to the field size"""
+    reconed_field = reconed_field[..., pad_size: reconed_field.shape[-2] - pad_size,
+                                  pad_size: reconed_field.shape[-1] - pad_size]
+    reconstructed_intensity = np.real(reconed_field * np.conjugate(reconed_field))
+    reconstructed_phase = np.angle(reconed_field)
+    return reconstructed_phase, reconstructed_intensity
+
+
+def propagate_apodized_stack(image: np.ndarray, params: ReconParams, diffrac_dist: Optional[float] = None,
+                             cache: Optional[EngineCache] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Propagate a stack of apodized fields (see apodize_offaxis_stack) by the angular spectrum method, to the
+    diffraction distance of the params unless given. Return the wrapped phases and the intensities, cropped back
+    to the field size."""
+    cache = _NO_CACHE if cache is None else cache
+    diffrac_dist = params.diffraction_distance if diffrac_dist is None else diffrac_dist
+
+    if diffrac_dist == 0.0:
+        reconed_field = image
+    else:
+        fft_img = np.fft.fftshift(np.fft.fft2(image), axes=_SHIFT_AXES)
+        fft_img *= _propagator(fft_img.shape[-2:], params, diffrac_dist, cache)
+        reconed_field = np.fft.ifft2(np.fft.ifftshift(fft_img, axes=_SHIFT_AXES))
+    return _phase_intensity(reconed_field, params.apo_pad_size)
+
+
+def iter_apodized_distances(image: np.ndarray, params: ReconParams, distances: Sequence[float],
+                            cache: Optional[EngineCache] = None) -> Iterator[Tuple[float, np.ndarray, np.ndarray]]:
+    """Propagate one apodized (y, x) field to several distances with a single forward FFT.
+    Yield (distance, wrapped phase, intensity) for every distance."""
+    cache = _NO_CACHE if cache is None else cache
+    fft_img = np.fft.fftshift(np.fft.fft2(image))
+    for diffrac_dist in distances:
+        if diffrac_dist == 0.0:
+            reconed_field = image
+        else:
+            reconed_field = np.fft.ifft2(np.fft.ifftshift(fft_img * _propagator(fft_img.shape, params, diffrac_dist,
+                                                                                 cache)))
+        yield (diffrac_dist,) + _phase_intensity(reconed_field, params.apo_pad_size)
+
+
+def refocus_spectrum(image: np.ndarray) -> np.ndarray:
+    """Shifted spectrum of one (y, x) field, computed once to propagate it to any number of distances: an apodized
+    off-axis field (see apodize_offaxis_stack) with refocus(), an inline field with inline_sections()"""
+    return np.fft.fftshift(np.fft.fft2(image))
+
+
+def _is_smooth(size: int) -> bool:
+    """Whether the only prime factors of size are 2, 3 and 5, the sizes numpy FFTs fastest"""
+    for prime in (2, 3, 5):
+        while size % prime == 0:
+            size //= prime
+    return size == 1
+
+
+def _smooth_size(limit: int) -> int:
+    """Largest smooth size (see _is_smooth) up to limit"""
+    for size in range(max(limit, 1), 0, -1):
+        if _is_smooth(size):
+            return size
+    return 1
+
+
+def _smooth_size_above(limit: int) -> int:
+    """Smallest smooth size (see _is_smooth) from limit on"""
+    size = max(limit, 1)
+    while not _is_smooth(size):
+        size += 1
+    return size
+
+
+def refocus(spectrum: np.ndarray, params: ReconParams, diffrac_dist: float, factor: int = 1,
+            cache: Optional[EngineCache] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Propagate an apodized field over diffrac_dist from its shifted spectrum (see refocus_spectrum). With
+    factor > 1 only the central part of the spectrum, about 1/factor of each dimension, is propagated: a field about
+    factor times smaller in each dimension (a low-pass decimation), fast enough to follow a slider. The propagators
+    of the distances passed through are not cached, only the frequency grid. Return the wrapped phase and the
+    intensity, cropped back to the field size."""
+    cache = _NO_CACHE if cache is None else cache
+    kz, mask = _angular_grid(spectrum.shape, params, cache)
+    pad_rows = pad_columns = params.apo_pad_size
+    if factor > 1:
+        height, width = spectrum.shape
+        rows, columns = _smooth_size(height // factor), _smooth_size(width // factor)
+        # The zero frequency stays where fftshift puts it for the smaller size, and the cropped grid keeps the
+        # frequencies of the full one
+        crop = (slice(height // 2 - rows // 2, height // 2 - rows // 2 + rows),
+                slice(width // 2 - columns // 2, width // 2 - columns // 2 + columns))
+        spectrum = spectrum[crop] * (rows * columns / (height * width))
+        kz, mask = kz[crop], mask[crop]
+        pad_rows, pad_columns = round(pad_rows * rows / height), round(pad_columns * columns / width)
+    if diffrac_dist != 0.0:
+        spectrum = np.where(mask, spectrum * np.exp(complex(0, 1) * kz * diffrac_dist), 0)
+    reconed_field = np.fft.ifft2(np.fft.ifftshift(spectrum))
+    reconed_field = reconed_field[pad_rows: reconed_field.shape[0] - pad_rows,
+                                  pad_columns: reconed_field.shape[1] - pad_columns]
+    return np.angle(reconed_field), np.real(reconed_field * np.conjugate(reconed_field))
+
+
+def _background_spectrum(background: np.ndarray, params: ReconParams, cache: EngineCache) -> np.ndarray:
+    """Shifted spectrum of the background ROI, computed once per background and ROI"""
+    key = ("background_spectrum", id(background), params.roi)
+    return cache.get(key, lambda: (background, np.fft.fftshift(np.fft.fft2(_background_roi(background, params,
+                                                                                             cache)))))[1]
+
+
+def sideband_preview(spectrum: np.ndarray, background: np.ndarray, params: ReconParams, geometry: Tuple[int, int, int],
+                     max_size: int = 512, cache: Optional[EngineCache] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Off-axis field selected by a sideband filter at reduced resolution, to preview filter settings: from the
+    shifted spectrum of a hologram (see refocus_spectrum) and the sideband geometry (center row, column and radius,
+    see utils.find_sideband), only the smallest square of the spectrum around the sideband that holds the filter,
+    at most max_size a side, is transformed back. The filtered field is band-limited to that square, so nothing but
+    resolution is lost; the carrier is removed by the crop and by the background correction alike. The field is
+    propagated to the diffraction distance without apodization. Return the wrapped phase and the intensity, square
+    arrays that cover the whole field."""
+    cache = _NO_CACHE if cache is None else cache
+    center_x, center_y, radius = geometry
+    height, width = spectrum.shape
+    window = _smooth_size_above(2 * radius + 2)
+    size = min(window, _smooth_size(min(height, width, max_size)))
+    # The spectrum is periodic: a sideband near the border wraps around
+    crop = np.ix_((center_x - size // 2 + np.arange(size)) % height, (center_y - size // 2 + np.arange(size)) % width)
+
+    def compute_filter() -> np.ndarray:
+        inner = slice(window // 2 - size // 2, window // 2 - size // 2 + size)
+        return utils.sideband_filter(window, window, window // 2, window // 2, radius, params.filter_type)[inner, inner]
+
+    fourier_filter = cache.get(("preview_filter", window, size, radius, params.filter_type), compute_filter)
+
+    def compute_background() -> Tuple[np.ndarray, np.ndarray]:
+        background_field = np.fft.ifft2(np.fft.ifftshift(_background_spectrum(background, params, cache)[crop]
+                                                         * fourier_filter))
+        return background, np.exp(complex(0, 1) * np.angle(np.conj(background_field)))
+
+    background_key = ("preview_background", id(background), params.roi, center_x, center_y, size, radius,
+                      params.filter_type)
+    field = np.fft.ifft2(np.fft.ifftshift(spectrum[crop] * fourier_filter)) * (size * size / (height * width))
+    field *= cache.get(background_key, compute_background)[1]
+    if params.diffraction_distance != 0.0:
+        def compute_propagator() -> np.ndarray:
+            # The frequencies of the small field are the central ones of the full field
+            kz, mask = _angular_grid(spectrum.shape, params, cache)
+            center = (slice(height // 2 - size // 2, height // 2 - size // 2 + size),
+                      slice(width // 2 - size // 2, width // 2 - size // 2 + size))
+            return np.where(mask[center], np.exp(complex(0, 1) * kz[center] * params.diffraction_distance), 0)
+
+        propagator = cache.get(("preview_propagator", spectrum.shape, size, params.vector, params.delta,
+                                params.diffraction_distance), compute_propagator)
+        field = np.fft.ifft2(np.fft.ifftshift(np.fft.fftshift(np.fft.fft2(field)) * propagator))
+    return np.angle(field), np.real(field * np.conjugate(field))
+
+
+def propagate_offaxis_stack(fields: np.ndarray, params: ReconParams, diffrac_dist: Optional[float] = None,
+                            cache: Optional[EngineCache] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Apodize and propagate a (n, y, x) stack of off-axis fields by the angular spectrum method, to the
+    diffraction distance of the params unless given. Return the wrapped phases and the intensities, cropped back
+    to the field size."""
+    return propagate_apodized_stack(apodize_offaxis_stack(fields, params, cache), params, diffrac_dist, cache)
+
+
+def propagate_offaxis(holo_cleared: np.ndarray, params: ReconParams, diffrac_dist: Optional[float] = None,
+                      cache: Optional[EngineCache] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Apodize and propagate the off-axis field by the angular spectrum method, to the diffraction distance of
+    the params unless given. Return the wrapped phase and the intensity, cropped back to the field size."""
+    phases, intensities = propagate_offaxis_stack(holo_cleared[np.newaxis], params, diffrac_dist, cache)
+    return phases[0], intensities[0]
+
+
+def _offaxis_results(fourier_filters: List[np.ndarray], wrapped_phases: np.ndarray, intensities: np.ndarray,
+                     params: ReconParams) -> List[ReconResult]:
+    results = []
+    for fourier_filter, wrapped_phase, intensity_map in zip(fourier_filters, wrapped_phases, intensities):
+        phase_map = utils.unwrap_phase(wrapped_phase)
+        results.append(ReconResult(fourier_filter=fourier_filter, wrapped_phase=wrapped_phase, phase_map=phase_map,
+                                   height_map=phase_map / params.height_factor, intensity_map=intensity_map))
+    return results
+
+
+def reconstruct_offaxis(hologram: np.ndarray, background: np.ndarray, params: ReconParams,
+                        cache: Optional[EngineCache] = None) -> ReconResult:
+    """Full off-axis reconstruction of one frame"""
+    return reconstruct_offaxis_batch([hologram], background, params, cache)[0]
+
+
+def reconstruct_offaxis_batch(frames: Sequence[np.ndarray], background: np.ndarray, params: ReconParams,
+                              cache: Optional[EngineCache] = None) -> List[ReconResult]:
+    """Off-axis reconstruction of several frames of the same shape with stacked FFTs"""
+    holograms = np.stack([crop_roi(frame, params.roi) for frame in frames])
+    fields, fourier_filters = offaxis_fields(holograms, background, params, cache)
+    wrapped_phases, intensities = propagate_offaxis_stack(fields, params, cache=cache)
+    return _offaxis_results(fourier_filters, wrapped_phases, intensities, params)
+
+
+def inline_field(hologram: np.ndarray, background: np.ndarray, params: ReconParams,
+                 cache: Optional[EngineCache] = None) -> np.ndarray:
+    """Background-normalized in-line hologram (full frames, ROI applied here)"""
+    return inline_field_roi(crop_roi(hologram, params.roi), background, params, cache)
+
+
+def inline_field_roi(hologram: np.ndarray, background: np.ndarray, params: ReconParams,
+                     cache: Optional[EngineCache] = None) -> np.ndarray:
+    """Background-normalized in-line hologram from an ROI-cropped hologram and the full background"""
+    background = _background_roi(background, params, _NO_CACHE if cache is None else cache)
+    return (hologram - background) / background
+
+
+def iter_inline_slices(holo_cleared: np.ndarray, params: ReconParams, cache: Optional[EngineCache] = None,
+                       z_indices: Optional[Collection[int]] = None,
+                       timer: Optional[timing.StageTimer] = None) -> Iterator[Tuple[int, float, np.ndarray]]:
+    """Inline reconstruction using angular spectrum method. Yield (slice index, distance, intensity) for every
+    slice between the start & end distances, or only for the slice indices given; one slice is held in memory at
+    a time."""
+    cache = _NO_CACHE if cache is None else cache
+    timer = _NO_TIMER if timer is None else timer
+    with timer.stage("fft"):
+        image_fft = np.fft.fftshift(np.fft.fft2(holo_cleared))
+
+    for z_step in range(1, params.rec_zstack_qty + 1):
+        if z_indices is not None and z_step - 1 not in z_indices:
+            continue
+        diffract_dist = params.slice_distance(z_step)
+        with timer.stage("propagate"):
+            fft_core = image_fft * _propagator(image_fft.shape, params, diffract_dist, cache)
+            reconed_field = np.fft.ifft2(np.fft.ifftshift(fft_core))
+            intensity = np.real(reconed_field * np.conjugate(reconed_field))
+        yield z_step - 1, diffract_dist, intensity
+
+
+def _line_phase(size: int, index: int) -> np.ndarray:
+    """Weights of the shifted frequencies whose sum is the inverse FFT at index along an axis of the size"""
+    return np.exp(2j * np.pi * (np.arange(size) - size // 2) * index / size) / size
+
+
+def inline_sections(spectrum: np.ndarray, params: ReconParams, row: Optional[int] = None,
+                    column: Optional[int] = None, cache: Optional[EngineCache] = None
+                    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """Orthogonal sections of the inline volume (see iter_inline_slices) from the shifted spectrum of the inline
+    field (see refocus_spectrum), without reconstructing the slices: the XZ section through the row and the YZ
+    section through the column, (z, x) and (z, y) float32 intensities. A line of a slice is the 1d inverse FFT of
+    the propagated spectrum summed with the phases of the line along the other axis, so every slice costs one
+    multiply-add over the spectrum instead of a 2d inverse FFT. None for the section not asked for."""
+    cache = _NO_CACHE if cache is None else cache
+    height, width = spectrum.shape
+    row_spectrum = spectrum * _line_phase(height, row)[:, np.newaxis] if row is not None else None
+    column_spectrum = spectrum * _line_phase(width, column)[np.newaxis, :] if column is not None else None
+    xz = np.empty((params.rec_zstack_qty, width), dtype=np.float32) if row is not None else None
+    yz = np.empty((params.rec_zstack_qty, height), dtype=np.float32) if column is not None else None
+    for z_step in range(1, params.rec_zstack_qty + 1):
+        propagator = _propagator(spectrum.shape, params, params.slice_distance(z_step), cache)
+        if row is not None:
+            line = np.fft.ifft(np.fft.ifftshift(np.einsum('ij,ij->j', row_spectrum, propagator)))
+            xz[z_step - 1] = np.real(line * np.conjugate(line))
+        if column is not None:
+            line = np.fft.ifft(np.fft.ifftshift(np.einsum('ij,ij->i', column_spectrum, propagator)))
+            yz[z_step - 1] = np.real(line * np.conjugate(line))
+    return xz, yz
+
+
+def reconstruct_inline(hologram: np.ndarray, background: np.ndarray, params: ReconParams,
+                       cache: Optional[EngineCache] = None) -> ReconResult:
+    """Full in-line reconstruction of one frame into a (z, y, x) float32 volume"""
+    holo_cleared = inline_field(hologram, background, params, cache)
+    volume = None
+    for z_idx, _, refocused in iter_inline_slices(holo_cleared, params, cache):
+        if volume is None:
+            volume = np.empty((params.rec_zstack_qty,) + refocused.shape, dtype=np.float32)
+        volume[z_idx] = refocused
+    return ReconResult(refocused_volume=volume)
+
+
+def reconstruct(frame: np.ndarray, params: ReconParams, background: np.ndarray,
+                cache: Optional[EngineCache] = None) -> ReconResult:
+    """Reconstruct one hologram frame with the mode given by the params"""
+    if params.mode == "Inline":
+        return reconstruct_inline(frame, background, params, cache)
+    return reconstruct_offaxis(frame, background, params, cache)
+
+
+def reconstruct_batch(frames: Sequence[np.ndarray], params: ReconParams, background: np.ndarray,
+                      cache: Optional[EngineCache] = None) -> List[ReconResult]:
+    """Reconstruct several frames of the same shape; off-axis frames share stacked FFTs"""
+    if params.mode == "Inline":
+        return [reconstruct_inline(frame, background, params, cache) for frame in frames]
+    return reconstruct_offaxis_batch(frames, background, params, cache)
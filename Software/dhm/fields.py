@@ -0,0 +1,151 @@
+"""Persisted complex fields of off-axis holograms, for repropagation without reading and filtering the holograms.
+
+Getting from a hologram to its filtered, background-corrected complex field (TIFF decode, carrier filtering and
+background division) is the expensive part of the off-axis reconstruction; propagating the field to a diffraction
+distance is cheap in comparison. With `save_field = True` in the [Output] section, every processed frame stores its
+field as complex64 (optionally already apodized, so propagation skips the padding as well), and
+HoloGram.repropagate / repropagate_stack produce height, phase and z-stacks at other distances from the stored
+fields:
+
+    python -m dhm.fields receipt.ini --distance 12.5
+    python -m dhm.fields receipt.ini --zstack --save-path refocused/
+
+A store is the directory `<save path>/dhm_fields/<key>`, the key being a hash of the settings the fields depend on
+(names, sizes and modification times of the holograms, background, ROI, filter and apodization), so changing any of
+them, e.g. acquiring the series again into the same directory, starts a new store. It holds
+`fields.npy`, an (n, y, x) complex64 array with one chunk per frame that is memory-mapped, so any frame is read
+without decoding, `written.npy`, the frames already stored, and `fields.json` with the parameters of the fields. The
+store is sized to the series when created; frames beyond it (appended in live mode) are not stored.
+"""
+import os
+import json
+import hashlib
+import argparse
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+FIELDS_DIR = "dhm_fields"
+_KEY_FIELDS = ("filter_type", "filter_quadrant", "filter_rate", "roi")
+_APODIZATION_FIELDS = ("apo_pad_size", "apo_k_factor")
+
+
+def store_key(read_path: str, series_identity: str, background_identity: str, params: Any, apodized: bool) -> str:
+    """Key of the store of fields computed from the series with the params (a ReconParams); the series identity
+    (see HoloGram.get_series_identity) changes when the holograms are acquired again into the same read path"""
+    fields = _KEY_FIELDS + (_APODIZATION_FIELDS if apodized else ())
+    parts = [os.path.abspath(read_path), series_identity, background_identity, f"apodized={apodized}"]
+    parts += [f"{field}={getattr(params, field)!r}" for field in fields]
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
+class FieldStore:
+    """Memory-mapped complex64 fields of the frames of a series"""
+
+    _path: str
+    _attrs: Dict[str, Any]
+
+    def __init__(self, path: str) -> None:
+        """Open an existing store, FileNotFoundError if there is none"""
+        self._path = path
+        with open(os.path.join(path, "fields.json")) as attrs_file:
+            self._attrs = json.load(attrs_file)
+        self._fields = np.load(os.path.join(path, "fields.npy"), mmap_mode="r+")
+        self._written = np.load(os.path.join(path, "written.npy"), mmap_mode="r+")
+
+    @classmethod
+    def create(cls, path: str, frame_count: int, shape: Tuple[int, int], attrs: Dict[str, Any]) -> "FieldStore":
+        """Create the store, or open it if it exists. The store is written in a temporary directory and renamed,
+        so workers creating it at the same time all end up with the same store."""
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = tempfile.mkdtemp(prefix=".creating_", dir=os.path.dirname(path))
+            np.lib.format.open_memmap(os.path.join(temp_path, "fields.npy"), mode="w+", dtype=np.complex64,
+                                      shape=(frame_count,) + tuple(shape)).flush()
+            np.save(os.path.join(temp_path, "written.npy"), np.zeros(frame_count, dtype=np.uint8))
+            with open(os.path.join(temp_path, "fields.json"), "w") as attrs_file:
+                json.dump(attrs, attrs_file, indent=2)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Created by another worker in the meantime
+                for name in os.listdir(temp_path):
+                    os.remove(os.path.join(temp_path, name))
+                os.rmdir(temp_path)
+        return cls(path)
+
+    def get_path(self) -> str:
+        return self._path
+
+    def get_attrs(self) -> Dict[str, Any]:
+        return self._attrs
+
+    def is_apodized(self) -> bool:
+        return self._attrs.get("apodized", False)
+
+    def __len__(self) -> int:
+        return self._fields.shape[0]
+
+    def frames(self) -> List[int]:
+        return [int(frame) for frame in np.flatnonzero(self._written)]
+
+    def write(self, frame: int, field: np.ndarray) -> bool:
+        """Store the field of a frame; False if the frame is beyond the series the store was created for"""
+        if frame >= len(self) or field.shape != self._fields.shape[1:]:
+            return False
+        self._fields[frame] = field
+        self._written[frame] = 1
+        return True
+
+    def read(self, frame: int) -> np.ndarray:
+        """Read the field of a frame, KeyError if it has not been stored"""
+        if not 0 <= frame < len(self) or not self._written[frame]:
+            raise KeyError(f"The field of frame {frame} is not in {self._path}")
+        return np.array(self._fields[frame])
+
+    def flush(self) -> None:
+        self._fields.flush()
+        self._written.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self._fields = self._written = None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Repropagate the stored complex fields of a series")
+    parser.add_argument("receipt", help="configuration receipt the fields were saved with")
+    parser.add_argument("--distance", type=float, help="diffraction distance of the height and phase maps")
+    parser.add_argument("--zstack", action="store_true",
+                        help="save the z-stack between rec_start and rec_end of the receipt instead")
+    parser.add_argument("--save-path", help="save the outputs here instead of the save path of the receipt")
+    args = parser.parse_args()
+
+    from dhm.core import HoloGram
+    holo = HoloGram()
+    holo.read_config_receipt(args.receipt)
+    holo.set_dhm_mode("Offaxis")
+    holo.load_series()
+    try:
+        store = FieldStore(holo.get_field_store_path()) # Kept open when the save path changes
+    except FileNotFoundError:
+        raise SystemExit(f"No fields stored for the series and settings of {args.receipt}; process it with "
+                         f"save_field = True in the [Output] section first")
+    if args.distance is not None:
+        holo.set_diffraction_dist(args.distance)
+    if args.zstack:
+        holo.set_save_flags(*holo.get_save_flags()[:3], refocused_volume=True)
+    if args.save_path:
+        os.makedirs(args.save_path, exist_ok=True)
+        holo.set_save_path(args.save_path)
+
+    frames = store.frames()
+    for holo_num in frames:
+        holo.repropagate_stack(holo_num, store) if args.zstack else holo.repropagate(holo_num, store)
+    holo.close_outputs()
+    store.close()
+    print(f"Repropagated {len(frames)} frames of {store.get_path()}")
+
+
+if __name__ == "__main__":
+    main()
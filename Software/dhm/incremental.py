@@ -0,0 +1,77 @@
+"""Incremental reprocessing: outputs that are up to date are not computed again.
+
+Every saved product is recorded in the build log `<save path>/dhm_build.log` with a content key, a hash of
+- the identity (path, size and modification time) of its hologram and of the background,
+- the parameters the product depends on (system, filter, ROI, and the distance of its slice or of the refocus),
+- its storage format (output format, dtype and compression).
+When a series is processed again in incremental mode, a product whose key is in the log is not saved again, frames
+whose products are all up to date are not reconstructed, and missing off-axis products are derived from an up-to-date
+float32 phase or height map of the frame instead of from the hologram. The log is append-only (the newest line of a
+product counts), so several workers of a sharded run share it. Lines are `frame product slice key`, slice -1 for
+off-axis products.
+"""
+import os
+import hashlib
+from typing import Dict, Optional, Tuple
+from dhm.engine import ReconParams
+
+BUILD_LOG_NAME = "dhm_build.log"
+
+_SYSTEM_FIELDS = ("pixel_x", "pixel_y", "refractive_index", "magnification", "wavelength", "roi")
+_OFFAXIS_FIELDS = _SYSTEM_FIELDS + ("diffraction_distance", "filter_type", "filter_quadrant", "filter_rate",
+                                    "apo_pad_size", "apo_k_factor")
+
+
+def file_identity(path: str) -> str:
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def product_key(frame_identity: str, background_identity: str, params: ReconParams, product: str, encoding: str,
+                z_idx: Optional[int] = None) -> str:
+    """Content key of one product of a frame (of slice z_idx of an inline frame)"""
+    fields = _SYSTEM_FIELDS if params.mode == "Inline" else _OFFAXIS_FIELDS
+    parts = [frame_identity, background_identity, product, encoding]
+    parts += [f"{field}={getattr(params, field)!r}" for field in fields]
+    if z_idx is not None:
+        parts.append(f"slice_distance={params.slice_distance(z_idx + 1)!r}")
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class BuildLog:
+    """Keys of the products saved into a save path"""
+
+    _path: str
+    _keys: Dict[Tuple[int, str, int], str]
+
+    def __init__(self, save_path: str) -> None:
+        self._path = os.path.join(save_path, BUILD_LOG_NAME)
+        self._keys = {}
+        self._file = None
+        if os.path.exists(self._path):
+            with open(self._path) as log_file:
+                for line in log_file:
+                    fields = line.split()
+                    if not line.endswith("\n") or len(fields) != 4:
+                        continue  # Being written by another worker
+                    self._keys[(int(fields[0]), fields[1], int(fields[2]))] = fields[3]
+
+    def get_path(self) -> str:
+        return self._path
+
+    def is_current(self, num: int, product: str, key: str, z_idx: Optional[int] = None) -> bool:
+        return self._keys.get((num, product, -1 if z_idx is None else z_idx)) == key
+
+    def record(self, num: int, product: str, key: str, z_idx: Optional[int] = None) -> None:
+        """Record a saved product; one short append, so concurrent workers never interleave their lines"""
+        z_idx = -1 if z_idx is None else z_idx
+        if self._file is None:
+            self._file = open(self._path, "a")
+        self._file.write(f"{num} {product} {z_idx} {key}\n")
+        self._file.flush()
+        self._keys[(num, product, z_idx)] = key
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,112 @@
+"""Watch-folder support for live, acquisition-time processing.
+
+FolderWatcher polls the hologram directory (os.scandir is cheap enough to poll at 10-20 Hz, and works on network
+shares where inotify does not) and reports TIFF files only once they are completely written. LiveQueue decides which
+of the completed frames are processed when the reconstruction falls behind the acquisition.
+"""
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+from dhm.utils import lazy_import
+tf = lazy_import("tifffile")
+
+LiveFrame = Tuple[str, float]  # file name, modification time
+
+
+def is_tiff_name(file: str) -> bool:
+    return file.lower().endswith(".tif") or file.lower().endswith(".tiff")
+
+
+def is_complete_tiff(file_path: str) -> bool:
+    """Check that all image data of the first page has been written, i.e. the file is not being written anymore"""
+    try:
+        file_size = os.path.getsize(file_path)
+        with tf.TiffFile(file_path) as tif:
+            page = tif.pages[0]
+            data_end = max(offset + count for offset, count in zip(page.dataoffsets, page.databytecounts))
+        return data_end <= file_size
+    except (OSError, ValueError, IndexError, tf.TiffFileError):
+        return False
+
+
+class FolderWatcher:
+    """Polls a directory for new TIFF files. A file is reported once its size has not changed for settle_time
+    seconds and its image data is complete, so files still being written by the acquisition software are skipped
+    until the next poll."""
+
+    _read_path: str
+    _settle_time: float
+    _reported: set
+    _pending: Dict[str, Tuple[int, float]]  # name -> (last size, time the size was last seen changing)
+
+    def __init__(self, read_path: str, known: Iterable[str] = (), settle_time: float = 0.05) -> None:
+        self._read_path = read_path
+        self._settle_time = settle_time
+        self._reported = set(known)
+        self._pending = {}
+
+    def poll(self) -> List[LiveFrame]:
+        """Return the files that have been completed since the last poll, oldest first"""
+        now = time.monotonic()
+        completed = []
+        try:
+            entries = list(os.scandir(self._read_path))
+        except OSError:
+            return completed
+
+        for entry in entries:
+            if entry.name in self._reported or not is_tiff_name(entry.name):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue  # Removed or renamed in the meantime
+            size, changed_at = self._pending.get(entry.name, (-1, now))
+            if stat.st_size != size:
+                self._pending[entry.name] = (stat.st_size, now)
+                changed_at = now
+                if size != -1:
+                    continue  # Still growing
+            if now - changed_at < self._settle_time:
+                continue
+            if not is_complete_tiff(entry.path):
+                continue
+            del self._pending[entry.name]
+            self._reported.add(entry.name)
+            completed.append((entry.name, stat.st_mtime))
+
+        completed.sort(key=lambda frame: (frame[1], frame[0]))
+        return completed
+
+
+class LiveQueue:
+    """Queue of completed frames waiting for reconstruction. With frame skipping enabled, frames older than the
+    latency target are dropped as long as a newer frame is waiting, so the viewer always catches up to the camera."""
+
+    _frames: Deque[LiveFrame]
+    _latency_target: float
+    _skip_frames: bool
+
+    def __init__(self, latency_target: float = 1.0, skip_frames: bool = True) -> None:
+        self._frames = deque()
+        self._latency_target = latency_target
+        self._skip_frames = skip_frames
+
+    def push(self, frames: Iterable[LiveFrame]) -> None:
+        self._frames.extend(frames)
+
+    def pop(self, now: Optional[float] = None) -> Tuple[Optional[LiveFrame], int]:
+        """Return the next frame to process (or None) and the number of frames skipped to get there"""
+        now = time.time() if now is None else now
+        skipped = 0
+        if self._skip_frames:
+            while len(self._frames) > 1 and now - self._frames[0][1] > self._latency_target:
+                self._frames.popleft()
+                skipped += 1
+        if len(self._frames) == 0:
+            return None, skipped
+        return self._frames.popleft(), skipped
+
+    def __len__(self) -> int:
+        return len(self._frames)
@@ -0,0 +1,99 @@
+"""Multi-resolution pyramids of the saved TIFF products, for fast browsing of full-frame maps.
+
+With `pyramid = True` in the [Output] section, every product saved as a single TIFF file carries reduced-resolution
+copies of itself in SubIFDs of its page, as OME-TIFF pyramids do: each level is the 2x2 block mean of the previous
+one, down to levels whose smaller side would fall below `pyramid_min_size`. Readers that do not know SubIFDs (and
+quantize.read_physical) still see the full-resolution page only. read_level() reads the smallest level that still
+covers a display of a given size, so a 3000x4000 map is shown from a 750x1000 level, decoding a 16th of the data.
+Levels keep the dtype and quantization of the full-resolution image; NaN pixels (the NaN code of quantized images)
+are left out of the block means, so a level is NaN only where its whole block is.
+"""
+from typing import List, Optional, Tuple
+import numpy as np
+from dhm.utils import lazy_import
+tf = lazy_import("tifffile")
+from dhm import quantize
+
+MIN_LEVEL_SIZE = 256
+
+
+def downsample(image: np.ndarray, nan_code: Optional[int] = None) -> np.ndarray:
+    """2x2 block mean of the first two axes (an odd last row or column is dropped), in the dtype of the image.
+    NaN pixels, or the pixels stored as nan_code (in every sample), are left out of the mean, blocks of NaN pixels
+    only stay NaN (nan_code)"""
+    height, width = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+    image = image[:height, :width]
+    if nan_code is not None:
+        invalid = image == nan_code
+    elif np.issubdtype(image.dtype, np.floating):
+        invalid = np.isnan(image)
+    else:
+        invalid = None
+    if invalid is not None:
+        invalid = invalid.all(axis=-1) if invalid.ndim == 3 else invalid
+        if not invalid.any():
+            invalid = None
+    if invalid is None:
+        reduced = _block_sum(image.astype(np.float32, copy=False))
+        reduced *= 0.25
+    else:
+        valid = ~invalid
+        weights = valid.reshape(valid.shape + (1,) * (image.ndim - 2))
+        count = _block_sum(valid.astype(np.float32))
+        reduced = _block_sum(np.where(weights, image, 0).astype(np.float32))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            reduced /= count.reshape(count.shape + (1,) * (image.ndim - 2))
+    if np.issubdtype(image.dtype, np.integer):
+        reduced = np.rint(reduced)
+        if invalid is not None:
+            reduced[count == 0] = nan_code
+        return reduced.astype(image.dtype)
+    return reduced.astype(image.dtype, copy=False)
+
+
+def _block_sum(image: np.ndarray) -> np.ndarray:
+    """Sum of the 2x2 blocks of the first two axes of an even sized float image"""
+    reduced = image[0::2, 0::2] + image[1::2, 0::2]  # Sum of strided views, faster than a blocked mean
+    reduced += image[0::2, 1::2]
+    reduced += image[1::2, 1::2]
+    return reduced
+
+
+def levels(image: np.ndarray, min_size: int = MIN_LEVEL_SIZE, nan_code: Optional[int] = None) -> List[np.ndarray]:
+    """The image and its reduced levels, each half the size of the previous, with no side below min_size.
+    nan_code is the stored value of NaN pixels of a quantized image"""
+    pyramid = [image]
+    while min(pyramid[-1].shape[:2]) // 2 >= max(1, min_size):
+        pyramid.append(downsample(pyramid[-1], nan_code))
+    return pyramid
+
+
+def write_pyramid(file_path: str, image: np.ndarray, min_size: int = MIN_LEVEL_SIZE, **kwargs) -> None:
+    """Write the image with its reduced levels in SubIFDs; kwargs of TiffWriter.write (compression, photometric,
+    ...) apply to every level, description and metadata to the full-resolution page only. The NaN code of the
+    quantization in the description is kept out of the block means"""
+    description = kwargs.pop("description", None)
+    metadata = kwargs.pop("metadata", {})
+    pyramid = levels(image, min_size, quantize.from_description(description).nan_code)
+    with tf.TiffWriter(file_path) as tif:
+        tif.write(pyramid[0], subifds=len(pyramid) - 1, description=description, metadata=metadata, **kwargs)
+        for level in pyramid[1:]:
+            tif.write(level, subfiletype=1, metadata=None, **kwargs)
+
+
+def choose_level(shapes: List[Tuple[int, ...]], max_shape: Optional[Tuple[int, int]]) -> int:
+    """Index of the smallest level still at least max_shape (height, width), 0 for the full resolution"""
+    if max_shape is None:
+        return 0
+    fitting = [idx for idx, shape in enumerate(shapes) if shape[0] >= max_shape[0] and shape[1] >= max_shape[1]]
+    return fitting[-1] if len(fitting) > 0 else 0
+
+
+def read_level(file_path: str, max_shape: Optional[Tuple[int, int]] = None) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """Read a saved product in its physical unit at the smallest level that covers max_shape (height, width),
+    the full resolution if None or if it was saved without a pyramid; return the image and the full shape"""
+    with tf.TiffFile(file_path) as tif:
+        page = tif.pages[0]
+        pages = [page] + list(page.pages or [])
+        level = pages[choose_level([level_page.shape for level_page in pages], max_shape)]
+        return quantize.dequantize(level.asarray(), quantize.from_description(page.description)), page.shape[:2]
@@ -0,0 +1,147 @@
+"""Quantized output formats: compact storage of the saved products with their physical units recoverable.
+
+    float32        the physical values, as before
+    float16        the physical values in half precision
+    uint16         physical = stored * scale + offset. For phase and height maps the step (scale) is the phase
+                   resolution 2 pi / PHASE_STEPS (as a height for height maps, from the wavelength and refractive
+                   index), far below the phase noise floor; it is widened only when a frame spans more than 65534
+                   steps. The offset follows the minimum of every frame.
+    int16_complex  wrapped phase only: the complex field sqrt(intensity) * exp(i * wrapped phase) as (y, x, 2)
+                   int16 real and imaginary parts, field = stored * scale. Phase and amplitude in 4 bytes per pixel.
+
+NaN pixels (masked or invalid) are stored as a reserved code, nan_code of the quantization: 65535 for uint16, whose
+values then use the codes up to 65534, and -32768 for both parts of int16_complex, which the scaled field never
+reaches. dequantize() restores them as NaN. Pages written before nan_code was recorded have none.
+
+The scale and offset are stored with full precision as JSON in the ImageDescription of the TIFF page (for stacks
+also in the stack index), so read_physical() and dequantize() give the same physical values on every machine.
+"""
+import json
+from typing import NamedTuple, Optional, Tuple
+import numpy as np
+from dhm.utils import lazy_import
+tf = lazy_import("tifffile")
+
+OUTPUT_DTYPES = ("float32", "float16", "uint16", "int16_complex")
+PHASE_STEPS = 4096  # uint16 quantization steps per 2 pi of phase
+DESCRIPTION_KEY = "quantization"
+
+
+UINT16_NAN = 65535
+INT16_NAN = -32768
+
+
+class Quantization(NamedTuple):
+    dtype: str = "float32"
+    scale: float = 1.0
+    offset: float = 0.0
+    nan_code: Optional[int] = None  # stored value of NaN pixels, None if NaN was not reserved
+
+    def is_identity(self) -> bool:
+        return self.dtype in ("float32", "float16")
+
+    def to_dict(self) -> dict:
+        fields = {"dtype": self.dtype, "scale": self.scale, "offset": self.offset}
+        if self.nan_code is not None:
+            fields["nan_code"] = self.nan_code
+        return fields
+
+
+def phase_step(product: str, height_factor: float) -> Optional[float]:
+    """uint16 step of a product in its physical unit: radians for phases, micrometer for heights (phase divided
+    by the height factor). None for products without a phase unit, which are scaled to their range."""
+    if product in ("phase_map", "wrapped_phase"):
+        return 2 * np.pi / PHASE_STEPS
+    if product == "height_map":
+        return 2 * np.pi / PHASE_STEPS / height_factor
+    return None
+
+
+def quantize(image: np.ndarray, dtype: str, step: Optional[float] = None,
+             intensity: Optional[np.ndarray] = None) -> Tuple[np.ndarray, Quantization]:
+    """Quantize a physical image to dtype; step is the uint16 step (the frame range / 65535 if None),
+    intensity the intensity map that int16_complex stores together with the wrapped phase"""
+    if dtype == "float32" or dtype == "float16":
+        return image.astype(dtype), Quantization(dtype)
+
+    if dtype == "uint16":
+        nan = np.isnan(image)
+        valid = image[~nan] if nan.any() else image
+        low, high = (float(valid.min()), float(valid.max())) if valid.size > 0 else (0.0, 0.0)
+        top = UINT16_NAN - 1
+        span = high - low
+        scale = max(step or 0.0, span / top) or 1.0
+        offset = np.floor(low / scale) * scale if step is not None else low
+        if (high - offset) / scale > top:
+            offset = low  # Step widened to the range, the floor alignment would overflow the top step
+        stored = np.clip(np.rint((image - offset) / scale), 0, top)
+        stored[nan] = UINT16_NAN
+        return stored.astype(np.uint16), Quantization(dtype, float(scale), float(offset), UINT16_NAN)
+
+    if dtype == "int16_complex":
+        if intensity is None:
+            raise ValueError("int16_complex stores the wrapped phase with the intensity map")
+        field = np.sqrt(np.maximum(intensity, 0)) * np.exp(1j * image)
+        parts = np.stack((field.real, field.imag), axis=-1)
+        nan = np.isnan(parts).any(axis=-1)
+        scale = float(np.max(np.abs(parts[~nan]), initial=0.0)) / 32767 or 1.0
+        stored = np.rint(parts / scale)
+        stored[nan] = INT16_NAN
+        return stored.astype(np.int16), Quantization(dtype, scale, 0.0, INT16_NAN)
+
+    raise ValueError(f"Unknown output dtype {dtype!r}, use one of {', '.join(OUTPUT_DTYPES)}")
+
+
+def dequantize(stored: np.ndarray, quantization: Quantization) -> np.ndarray:
+    """Physical float32 values of a stored image; the wrapped phase for int16_complex (see dequantize_field)"""
+    if quantization.dtype == "int16_complex":
+        return np.angle(dequantize_field(stored, quantization)).astype(np.float32)
+    if quantization.is_identity():
+        return stored.astype(np.float32, copy=False)
+    image = (stored * np.float64(quantization.scale) + np.float64(quantization.offset)).astype(np.float32)
+    if quantization.nan_code is not None:
+        image[stored == quantization.nan_code] = np.nan
+    return image
+
+
+def dequantize_field(stored: np.ndarray, quantization: Quantization) -> np.ndarray:
+    """Complex64 field of an int16_complex image"""
+    if quantization.dtype != "int16_complex":
+        raise ValueError(f"A {quantization.dtype} image does not hold a complex field")
+    scale = np.float32(quantization.scale)
+    field = (stored[..., 0] * scale + 1j * (stored[..., 1] * scale)).astype(np.complex64)
+    if quantization.nan_code is not None:
+        field[(stored == quantization.nan_code).all(axis=-1)] = np.nan
+    return field
+
+
+def description(quantization: Quantization, **fields) -> str:
+    """ImageDescription of a saved page, with the other fields (e.g. the frame index of a stack page)"""
+    if quantization.dtype != "float32":
+        fields[DESCRIPTION_KEY] = quantization.to_dict()
+    return json.dumps(fields)
+
+
+def tiff_kwargs(quantization: Quantization) -> dict:
+    """Keyword arguments of tifffile imwrite / TiffWriter.write for an image stored with the quantization"""
+    if quantization.dtype == "int16_complex":
+        return {"photometric": "minisblack", "planarconfig": "contig"}  # One page, real and imaginary samples
+    return {}
+
+
+def from_description(text: Optional[str]) -> Quantization:
+    """Quantization of a page from its ImageDescription, float32 for pages written without one"""
+    try:
+        fields = json.loads(text or "{}")
+    except ValueError:
+        return Quantization()
+    if not isinstance(fields, dict) or DESCRIPTION_KEY not in fields:
+        return Quantization()
+    return Quantization(**fields[DESCRIPTION_KEY])
+
+
+def read_physical(path: str, key: int = 0) -> np.ndarray:
+    """Read a saved product in its physical unit, whatever dtype it was saved with"""
+    with tf.TiffFile(path) as tif:
+        page = tif.pages[key]
+        return dequantize(page.asarray(), from_description(page.description))
@@ -0,0 +1,170 @@
+"""Persistent index of a directory of hologram files.
+
+Listing a folder of 100k+ TIFF files and reading every header takes from seconds to minutes. SeriesIndex keeps the
+result in a sidecar file (SIDECAR_NAME) in the folder: when the series is opened again, the folder is listed once and
+only files that are new, or whose size or modification time changed, are read again. Every record holds the shape,
+dtype and byte offset of the image data of a file, so uncompressed holograms are read with a memory map without
+parsing the TIFF structure again (see dhm.sources.DirectorySource). Sidecar lines are tab separated:
+
+    name  mtime_ns  size  dtype  height  width  offset  nbytes
+"""
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from dhm.utils import lazy_import
+tf = lazy_import("tifffile")
+from dhm.live import is_tiff_name
+
+SIDECAR_NAME = ".dhm_series.idx"
+INDEX_HEADER = "# dhm series index 1"
+
+Progress = Callable[[int, int], None]  # indexed files, files in the series
+
+
+def natural_key(name: str) -> Tuple:
+    """Natural sort key: digit runs compare as numbers, so 'img2.tif' < 'img10.tif' and 'a_9' < 'b_1'"""
+    return tuple(int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name))
+
+
+class FileRecord(NamedTuple):
+    name: str
+    mtime_ns: int
+    size: int
+    dtype: str  # with byte order, e.g. '<u2'; empty if the file could not be read
+    height: int
+    width: int
+    offset: int  # of the contiguous, uncompressed image data, -1 if compressed or split
+    nbytes: int
+
+    def is_mappable(self) -> bool:
+        return self.offset >= 0 and self.height > 0
+
+    def to_line(self) -> str:
+        return "\t".join(str(field) for field in self)
+
+    @classmethod
+    def from_line(cls, line: str) -> "FileRecord":
+        name, *fields = line.rstrip("\n").split("\t")
+        mtime_ns, size, dtype, height, width, offset, nbytes = fields
+        return cls(name, int(mtime_ns), int(size), dtype, int(height), int(width), int(offset), int(nbytes))
+
+
+def read_record(directory: str, name: str, stat: os.stat_result) -> FileRecord:
+    """Index one file from its TIFF header"""
+    try:
+        with tf.TiffFile(os.path.join(directory, name)) as tif:
+            page = tif.pages[0]
+            mappable = page.is_memmappable and page.ndim == 2 and page.samplesperpixel == 1
+            return FileRecord(name, stat.st_mtime_ns, stat.st_size, page.dtype.newbyteorder(tif.byteorder).str,
+                              page.shape[0], page.shape[1], page.dataoffsets[0] if mappable else -1,
+                              sum(page.databytecounts))
+    except (OSError, ValueError, IndexError, tf.TiffFileError):
+        # Unreadable or still being written, indexed again once its size or modification time changes
+        return FileRecord(name, stat.st_mtime_ns, stat.st_size, "", 0, 0, -1, 0)
+
+
+class SeriesIndex:
+    """Natural sorted index of the TIFF files of a directory, persisted in a sidecar file"""
+
+    _directory: str
+    _names: List[str]
+    _records: Dict[str, FileRecord]
+
+    def __init__(self, directory: str, workers: int = 8) -> None:
+        self._directory = directory
+        self._workers = workers
+        self._names = []
+        self._records = {}
+
+    def get_directory(self) -> str:
+        return self._directory
+
+    def sidecar_path(self) -> str:
+        return os.path.join(self._directory, SIDECAR_NAME)
+
+    def names(self) -> List[str]:
+        return self._names
+
+    def record(self, name: str) -> Optional[FileRecord]:
+        return self._records.get(name)
+
+    def _load_sidecar(self) -> Dict[str, FileRecord]:
+        try:
+            with open(self.sidecar_path(), "r", encoding="utf-8") as file:
+                if file.readline().rstrip("\n") != INDEX_HEADER:
+                    return {}
+                records = (FileRecord.from_line(line) for line in file if line.strip())
+                return {record.name: record for record in records}
+        except (OSError, ValueError):
+            return {}  # Missing or damaged, rebuilt from the files
+
+    def _save_sidecar(self) -> None:
+        temp_path = f"{self.sidecar_path()}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as file:
+                file.write(INDEX_HEADER + "\n")
+                file.writelines(self._records[name].to_line() + "\n" for name in self._names)
+            os.replace(temp_path, self.sidecar_path())
+        except OSError:
+            # Read-only acquisition folder: the index is kept for this session only
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def refresh(self, progress: Optional[Progress] = None, batch: int = 1000,
+                ready: Optional[Callable[[List[str]], None]] = None) -> int:
+        """List the directory and index the files that are new or changed since the last refresh (or since the
+        sidecar was written); return the series length. progress is called after every batch of indexed files,
+        ready with the names that follow the ones passed before, in sorted order, as soon as they are indexed."""
+        known = self._records or self._load_sidecar()
+        listing = {}
+        with os.scandir(self._directory) as entries:
+            for entry in entries:
+                if not is_tiff_name(entry.name):
+                    continue
+                try:
+                    if entry.is_file():
+                        listing[entry.name] = entry.stat()
+                except OSError:
+                    continue  # Removed in the meantime
+        names = sorted(listing, key=natural_key)
+
+        records = {}
+        stale = []
+        for name in names:
+            record = known.get(name)
+            if record is not None and (record.mtime_ns, record.size) == (listing[name].st_mtime_ns,
+                                                                          listing[name].st_size):
+                records[name] = record
+            else:
+                stale.append(name)
+        streamed = 0
+
+        def stream() -> None:
+            nonlocal streamed
+            start = streamed
+            while streamed < len(names) and names[streamed] in records:
+                streamed += 1
+            if ready is not None and streamed > start:
+                ready(names[start:streamed])
+
+        stream()
+        if progress is not None:
+            progress(len(records), len(names))
+
+        if len(stale) > 0:
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                for start in range(0, len(stale), batch):
+                    chunk = stale[start:start + batch]
+                    for record in executor.map(lambda name: read_record(self._directory, name, listing[name]),
+                                               chunk):
+                        records[record.name] = record
+                    stream()
+                    if progress is not None:
+                        progress(len(records), len(names))
+
+        changed = len(stale) > 0 or len(records) != len(known)
+        self._names, self._records = names, records
+        if changed:
+            self._save_sidecar()
+        return len(names)
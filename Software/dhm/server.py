@@ -0,0 +1,367 @@
+"""Local reconstruction server.
+
+A small daemon around the engine that many analysis scripts on the same machine can share. It keeps one EngineCache
+(sideband filters, processed backgrounds, apodization windows, propagators) and the loaded backgrounds warm, and
+batches concurrent requests with the same parameters into stacked FFTs. Frames and results travel through shared
+memory, only small descriptors go over the socket (a Unix socket, or localhost TCP on Windows).
+
+The socket carries pickles, so whoever can connect can run code as the server's user: connections are authenticated
+with a random per-user key, DHM_AUTHKEY from the environment or the key file AUTHKEY_PATH (readable by its owner
+only, created by the first server), and TCP servers only listen on loopback unless --allow-remote is given.
+
+Start the server:
+
+    python -m dhm.server --address /tmp/dhm.sock
+
+and reconstruct from any script:
+
+    with ReconClient("/tmp/dhm.sock") as client:
+        result = client.reconstruct(params, "background.tif", path="holograms/0001.tif")
+        result.height_map
+"""
+import os
+import sys
+import stat
+import time
+import queue
+import secrets
+import argparse
+import threading
+from dataclasses import fields
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from multiprocessing.connection import Listener, Client, Connection
+import numpy as np
+import tifffile as tf
+from dhm import engine
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:  # Python 3.7, arrays are then pickled over the socket
+    shared_memory = None
+
+Address = Union[str, Tuple[str, int]]
+ArrayDescriptor = Tuple[Optional[str], Tuple[int, ...], str, Optional[np.ndarray]]  # shm name, shape, dtype, data
+
+AUTHKEY_PATH = os.path.join(os.path.expanduser("~"), ".dhm_authkey")
+LOOPBACK_HOSTS = ("localhost", "::1")
+
+
+def default_authkey(create: bool = False) -> bytes:
+    """Authentication key shared by server and clients: DHM_AUTHKEY from the environment if set, else the key file
+    AUTHKEY_PATH, which a server creates with a random key if it does not exist. PermissionError if the key file is
+    readable by other users, FileNotFoundError if there is no key."""
+    key = os.environ.get("DHM_AUTHKEY", "").encode()
+    if key:
+        return key
+    if create:
+        try:
+            fd = os.open(AUTHKEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "w") as key_file:
+                key_file.write(secrets.token_hex(32))
+    if not os.path.exists(AUTHKEY_PATH):
+        raise FileNotFoundError(f"No server key: set DHM_AUTHKEY or start a server to create {AUTHKEY_PATH}")
+    if sys.platform != "win32" and stat.S_IMODE(os.stat(AUTHKEY_PATH).st_mode) & 0o077:
+        raise PermissionError(f"{AUTHKEY_PATH} is readable by other users, chmod 600 it")
+    with open(AUTHKEY_PATH) as key_file:
+        key = key_file.read().strip().encode()
+    if not key:
+        raise FileNotFoundError(f"The server key file {AUTHKEY_PATH} is empty")
+    return key
+
+
+PRODUCTS = tuple(field.name for field in fields(engine.ReconResult))
+
+
+def parse_address(address: str, allow_remote: bool = False) -> Address:
+    """'host:port' or ':port' is a TCP address, anything else a Unix socket path. ValueError for a TCP host other
+    than loopback unless allow_remote."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and os.sep not in address:
+        host = host.strip("[]") or "127.0.0.1"
+        if not allow_remote and not (host in LOOPBACK_HOSTS or host.startswith("127.")):
+            raise ValueError(f"{host} is not a loopback address, allow remote clients (--allow-remote) "
+                             f"to listen on it")
+        return host, int(port)
+    return address
+
+
+def _attach(name: str) -> "shared_memory.SharedMemory":
+    """Attach to a block owned by the other process, without our resource tracker unlinking it at exit"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def share_array(array: np.ndarray) -> Tuple[ArrayDescriptor, Optional[Any]]:
+    """Copy the array into a new shared memory block. Return its descriptor and the block, which the caller owns
+    and must unlink once the other side is done with it."""
+    array = np.ascontiguousarray(array)
+    if shared_memory is None or array.nbytes == 0:
+        return (None, array.shape, array.dtype.str, array), None
+    shm = shared_memory.SharedMemory(create=True, size=array.nbytes)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return (shm.name, array.shape, array.dtype.str, None), shm
+
+
+def read_array(descriptor: ArrayDescriptor) -> np.ndarray:
+    """Copy an array out of the descriptor received from the other side"""
+    name, shape, dtype, data = descriptor
+    if name is None:
+        return data
+    shm = _attach(name)
+    try:
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf).copy()
+    finally:
+        shm.close()
+
+
+def _release(blocks: List[Any]) -> None:
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+class _Job:
+    """One frame waiting to be reconstructed in a batch"""
+
+    def __init__(self, frame: np.ndarray, params: engine.ReconParams, background_path: str) -> None:
+        self.frame = frame
+        self.params = params
+        self.background_path = background_path
+        self.result: Optional[engine.ReconResult] = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+    def batch_key(self) -> Tuple:
+        return self.params, self.background_path, self.frame.shape
+
+
+class ReconServer:
+    """Serves reconstruction requests from local clients. One thread per connection receives the requests,
+    a single batching thread runs the engine on groups of up to batch_size frames that share parameters,
+    background and shape, waiting at most batch_window seconds for a batch to fill up."""
+
+    _address: Address
+    _jobs: "queue.Queue[_Job]"
+    _backgrounds: Dict[str, Tuple[float, np.ndarray]]
+
+    def __init__(self, address: Address, authkey: Optional[bytes] = None, batch_size: int = 4,
+                 batch_window: float = 0.005, cache_bytes: int = 2 << 30) -> None:
+        self._address = address
+        self._authkey = default_authkey(create=True) if authkey is None else authkey
+        self._batch_size = batch_size
+        self._batch_window = batch_window
+        self._cache = engine.EngineCache(max_bytes=cache_bytes)
+        self._jobs = queue.Queue()
+        self._backgrounds = {}
+        self._background_lock = threading.Lock()
+        self._listener: Optional[Listener] = None
+        self._stopped = threading.Event()
+
+    def serve_forever(self) -> None:
+        """Accept connections until stop() is called"""
+        if isinstance(self._address, str) and os.path.lexists(self._address):
+            if not stat.S_ISSOCK(os.lstat(self._address).st_mode):
+                raise FileExistsError(f"{self._address} exists and is not a socket")
+            os.remove(self._address)  # Stale socket of a previous run
+        self._listener = Listener(self._address, authkey=self._authkey)
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    conn = self._listener.accept()
+                except (OSError, EOFError):
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            self._listener.close()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._listener is not None:
+            # Wake up accept() with a last connection
+            try:
+                Client(self._address, authkey=self._authkey).close()
+            except OSError:
+                pass
+
+    def _background(self, background_path: str) -> np.ndarray:
+        """Background image, read once and reloaded only when the file changes"""
+        mtime = os.path.getmtime(background_path)
+        with self._background_lock:
+            cached = self._backgrounds.get(background_path)
+            if cached is None or cached[0] != mtime:
+                cached = self._backgrounds[background_path] = (mtime, tf.imread(background_path))
+            return cached[1]
+
+    def _serve_connection(self, conn: Connection) -> None:
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if request.get("op") == "shutdown":
+                    conn.send({"ok": True})
+                    self.stop()
+                    return
+                if request.get("op") == "ping":
+                    conn.send({"ok": True, "cached_entries": len(self._cache)})
+                    continue
+
+                blocks = []
+                try:
+                    response = self._reconstruct(request, blocks)
+                except Exception as e:
+                    response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                try:
+                    conn.send(response)
+                    if len(blocks) > 0:
+                        conn.recv()  # The client acknowledges once it has copied the products
+                except (EOFError, OSError):
+                    return
+                finally:
+                    _release(blocks)
+
+    def _reconstruct(self, request: Dict[str, Any], blocks: List[Any]) -> Dict[str, Any]:
+        """Run a request through the batch queue, share the requested products and add their blocks to blocks"""
+        job = self._submit(request)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        products = {}
+        for name in request.get("products") or PRODUCTS:
+            value = getattr(job.result, name)
+            if value is not None:
+                products[name], shm = share_array(value)
+                if shm is not None:
+                    blocks.append(shm)
+        return {"ok": True, "products": products}
+
+    def _submit(self, request: Dict[str, Any]) -> _Job:
+        """Read the frame of a request (shared memory, inline array or file path) and queue it"""
+        if request.get("frame") is not None:
+            frame = read_array(request["frame"])
+        else:
+            frame = tf.imread(request["path"])
+        job = _Job(frame, request["params"], request["background"])
+        self._jobs.put(job)
+        return job
+
+    def _batch_loop(self) -> None:
+        pending: List[_Job] = []
+        while True:
+            if len(pending) == 0:
+                pending.append(self._jobs.get())
+            deadline = time.monotonic() + self._batch_window
+            while len(pending) < self._batch_size * 4:
+                try:
+                    pending.append(self._jobs.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            key = pending[0].batch_key()
+            batch = [job for job in pending if job.batch_key() == key][:self._batch_size]
+            pending = [job for job in pending if job not in batch]
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: Sequence[_Job]) -> None:
+        try:
+            params = batch[0].params
+            background = self._background(batch[0].background_path)
+            results = engine.reconstruct_batch([job.frame for job in batch], params, background, self._cache)
+            for job, result in zip(batch, results):
+                job.result = result
+        except Exception as e:
+            for job in batch:
+                job.error = e
+        finally:
+            for job in batch:
+                job.frame = None
+                job.done.set()
+
+
+class ReconClient:
+    """Connection to a running ReconServer. Not thread-safe, use one client per thread."""
+
+    def __init__(self, address: Address, authkey: Optional[bytes] = None) -> None:
+        self._conn = Client(parse_address(address, allow_remote=True) if isinstance(address, str) else address,
+                            authkey=default_authkey() if authkey is None else authkey)
+
+    def reconstruct(self, params: engine.ReconParams, background_path: str, frame: Optional[np.ndarray] = None,
+                    path: Optional[str] = None, products: Sequence[str] = PRODUCTS) -> engine.ReconResult:
+        """Reconstruct a frame given as array or as a file path readable by the server. Only the requested
+        products are transferred back."""
+        if (frame is None) == (path is None):
+            raise ValueError("Give either a frame or a path")
+        blocks = []
+        try:
+            request = {"op": "reconstruct", "params": params, "background": os.path.abspath(background_path),
+                       "frame": None, "path": None if path is None else os.path.abspath(path),
+                       "products": tuple(products)}
+            if frame is not None:
+                request["frame"], shm = share_array(frame)
+                if shm is not None:
+                    blocks.append(shm)
+            self._conn.send(request)
+            response = self._conn.recv()
+        finally:
+            _release(blocks)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+
+        result = engine.ReconResult(**{name: read_array(descriptor)
+                                       for name, descriptor in response["products"].items()})
+        if any(descriptor[0] is not None for descriptor in response["products"].values()):
+            self._conn.send({"op": "release"})
+        return result
+
+    def ping(self) -> Dict[str, Any]:
+        self._conn.send({"op": "ping"})
+        return self._conn.recv()
+
+    def shutdown_server(self) -> None:
+        self._conn.send({"op": "shutdown"})
+        self._conn.recv()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "ReconClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Local DHM reconstruction server")
+    parser.add_argument("--address", default="127.0.0.1:5757" if sys.platform == "win32" else "/tmp/dhm.sock",
+                        help="Unix socket path, or host:port for TCP")
+    parser.add_argument("--batch-size", type=int, default=4, help="maximum frames per stacked FFT")
+    parser.add_argument("--batch-window", type=float, default=0.005, help="seconds to wait for a batch to fill")
+    parser.add_argument("--cache-mb", type=int, default=2048, help="size of the warm cache")
+    parser.add_argument("--allow-remote", action="store_true",
+                        help="listen on a TCP host other than loopback; every client holding the key can run code "
+                             "as this user")
+    args = parser.parse_args(argv)
+
+    try:
+        address = parse_address(args.address, args.allow_remote)
+        authkey = default_authkey(create=True)
+    except (ValueError, OSError) as e:
+        parser.exit(1, f"dhm.server: {e}\n")
+    server = ReconServer(address, authkey, batch_size=args.batch_size, batch_window=args.batch_window,
+                         cache_bytes=args.cache_mb << 20)
+    print(f"Serving DHM reconstructions on {args.address}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
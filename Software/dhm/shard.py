@@ -0,0 +1,318 @@
+"""Directory-sharded batch processing on several nodes sharing a filesystem.
+
+All workers are started with the same configuration receipt. The first one writes a manifest of the series into
+`<save_path>/_shards/`, so every node processes the same, identically ordered HOLO_LIST. The processing range is
+split into chunks that workers claim with lock files: a claim is created atomically (O_EXCL), renewed after every
+frame, and taken over by another worker once its lease expires, so the chunk of a dead worker is processed again.
+Claims are numbered by generation (`chunk_000003.claim.0`, `.claim.1`, ...): a takeover creates the next generation
+with O_EXCL, so of the workers racing for a stale claim exactly one wins, and a worker whose claim was taken over sees
+the newer generation and stops.
+Lock files are used rather than a database as file creation and rename stay atomic on network filesystems where
+database locking does not.
+
+Every frame is saved under its index in the series, so all workers write into one output set; `--merge` checks that
+every chunk is done and writes `shard_results.json` listing the outputs of every frame.
+
+    python -m dhm.shard run.ini --worker node1
+    python -m dhm.shard run.ini --status
+    python -m dhm.shard run.ini --merge
+"""
+import os
+import json
+import time
+import socket
+import hashlib
+import argparse
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from dhm import stacks, volume_store
+from dhm.core import HoloGram
+
+SHARD_DIR_NAME = "_shards"
+MANIFEST_NAME = "manifest.json"
+RESULTS_NAME = "shard_results.json"
+
+
+def _config_digest(config_path: str) -> str:
+    with open(config_path, "rb") as config_file:
+        return hashlib.sha1(config_file.read()).hexdigest()
+
+
+class ShardQueue:
+    """Chunk claims of one sharded run, stored as lock files in the shard directory"""
+
+    _shard_dir: str
+    _worker: str
+    _lease: float
+
+    def __init__(self, shard_dir: str, worker: str, lease: float = 300.0) -> None:
+        self._shard_dir = shard_dir
+        self._worker = worker
+        self._lease = lease
+        self._owned = {}  # chunk -> generation of the claim this worker created
+
+    def _path(self, chunk: int, suffix: str) -> str:
+        return os.path.join(self._shard_dir, f"chunk_{chunk:06d}.{suffix}")
+
+    def is_done(self, chunk: int) -> bool:
+        return os.path.exists(self._path(chunk, "done"))
+
+    def _claim_path(self, chunk: int, generation: int) -> str:
+        return self._path(chunk, f"claim.{generation}")
+
+    def _generation(self, chunk: int) -> int:
+        """Newest generation of the claims of a chunk, -1 if it is not claimed"""
+        generation = -1
+        while os.path.exists(self._claim_path(chunk, generation + 1)):
+            generation += 1
+        return generation
+
+    def _try_create_claim(self, chunk: int, generation: int) -> bool:
+        """Create the claim of the generation; only one worker can, and only while the chunk is not done"""
+        try:
+            fd = os.open(self._claim_path(chunk, generation), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as claim_file:
+            claim_file.write(self._worker)
+        if self.is_done(chunk):
+            os.remove(self._claim_path(chunk, generation))  # Completed while we looked, its claims removed
+            return False
+        self._owned[chunk] = generation
+        return True
+
+    def claim(self, chunk: int) -> bool:
+        """Try to claim a chunk that is not done, taking over the claim of another worker if its lease expired"""
+        if self.is_done(chunk):
+            return False
+        generation = self._generation(chunk)
+        if generation >= 0:
+            try:
+                expired = time.time() - os.path.getmtime(self._claim_path(chunk, generation)) > self._lease
+            except FileNotFoundError:
+                expired = True  # Completed meanwhile
+            if not expired:
+                return False
+        # Of the workers that saw the same newest claim, only one creates the next generation
+        return self._try_create_claim(chunk, generation + 1)
+
+    def owns(self, chunk: int) -> bool:
+        """Whether this worker holds the newest claim of the chunk"""
+        generation = self._owned.get(chunk)
+        if generation is None or os.path.exists(self._claim_path(chunk, generation + 1)):
+            return False
+        try:
+            with open(self._claim_path(chunk, generation)) as claim_file:
+                return claim_file.read() == self._worker
+        except FileNotFoundError:
+            return False
+
+    def renew(self, chunk: int) -> bool:
+        """Extend the lease of an owned chunk; False if another worker took it over meanwhile"""
+        if not self.owns(chunk):
+            return False
+        os.utime(self._claim_path(chunk, self._owned[chunk]))
+        return True
+
+    def complete(self, chunk: int, record: Dict[str, Any]) -> bool:
+        """Mark an owned chunk as done with its record, and release the claims of every generation"""
+        if not self.owns(chunk):
+            return False
+        tmp_path = self._path(chunk, f"done.{self._worker}.tmp")
+        with open(tmp_path, "w") as done_file:
+            json.dump(record, done_file)
+        os.replace(tmp_path, self._path(chunk, "done"))
+        for generation in range(self._owned.pop(chunk) + 1):
+            try:
+                os.remove(self._claim_path(chunk, generation))
+            except FileNotFoundError:
+                pass
+        return True
+
+    def record(self, chunk: int) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(chunk, "done")) as done_file:
+                return json.load(done_file)
+        except FileNotFoundError:
+            return None
+
+    def claimed_by(self, chunk: int) -> Optional[Tuple[str, float]]:
+        """Worker holding the newest claim of the chunk and the age of its lease in seconds, or None"""
+        claim_path = self._claim_path(chunk, self._generation(chunk))
+        try:
+            with open(claim_path) as claim_file:
+                return claim_file.read(), time.time() - os.path.getmtime(claim_path)
+        except FileNotFoundError:
+            return None
+
+
+def chunk_ranges(start: int, end: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """Split the inclusive range start..end into inclusive chunks"""
+    return [(first, min(first + chunk_size - 1, end)) for first in range(start, end + 1, chunk_size)]
+
+
+def _shard_dir(holo: HoloGram) -> str:
+    return os.path.join(holo.get_save_path(), SHARD_DIR_NAME)
+
+
+def load_manifest(holo: HoloGram, config_path: str, chunk_size: int) -> Dict[str, Any]:
+    """Read the manifest of the run, or create it from the series of this node if it is the first worker.
+    HOLO_LIST of the HoloGram is set from the manifest."""
+    shard_dir = _shard_dir(holo)
+    os.makedirs(shard_dir, exist_ok=True)
+    manifest_path = os.path.join(shard_dir, MANIFEST_NAME)
+
+    if not os.path.exists(manifest_path):
+        holo.load_series()
+        start, end = holo.get_range_start(), min(holo.get_range_end(), len(holo.HOLO_LIST) - 1)
+        manifest = {"config_digest": _config_digest(config_path), "mode": holo.get_dhm_mode(),
+                    "series": list(holo.HOLO_LIST), "chunks": chunk_ranges(start, end, chunk_size)}
+        tmp_path = f"{manifest_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        try:
+            os.link(tmp_path, manifest_path)  # Atomic and fails if another worker was first
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest["config_digest"] != _config_digest(config_path):
+        raise ValueError(f"{manifest_path} belongs to a run with another configuration receipt")
+    holo.HOLO_LIST.clear()
+    holo.HOLO_LIST.extend(manifest["series"])
+    return manifest
+
+
+def _prepare(config_path: str, mode: Optional[str]) -> HoloGram:
+    holo = HoloGram()
+    if mode is not None:
+        holo.set_dhm_mode(mode)
+    holo.read_config_receipt(config_path)
+    if holo.get_dhm_mode() not in ("Offaxis", "Inline"):
+        raise ValueError("Set [DHM_Mode] mode to Offaxis or Inline in the receipt, or pass --mode")
+    if holo.get_save_path() == "":
+        raise ValueError("A sharded run needs save_path_main in the receipt")
+    if holo.get_output_format() == "hdf5":
+        raise ValueError("HDF5 files can not be written by several workers, use the zarr output format")
+    if holo.get_output_format() == "zarr" and holo.get_volume_store_param()[0][0] != 1:
+        raise ValueError("Workers share the zarr store chunk by chunk, set the t chunk of volume_chunks to 1")
+    return holo
+
+
+def run_worker(config_path: str, worker: str, chunk_size: int = 16, lease: float = 300.0,
+               mode: Optional[str] = None) -> int:
+    """Process chunks until none is left to claim; return the number of frames processed by this worker"""
+    holo = _prepare(config_path, mode)
+    manifest = load_manifest(holo, config_path, chunk_size)
+    if holo.set_background_img() != 1:
+        raise FileNotFoundError(f"Can not read background {holo.get_back_path()}")
+    queue = ShardQueue(_shard_dir(holo), worker, lease)
+    chunks = manifest["chunks"]
+    holo.set_output_stack_tag(worker)  # Stack output: one stack per worker, as only one process may append to it
+    try:
+        return _process_chunks(holo, queue, chunks, worker, lease)
+    finally:
+        holo.close_outputs()
+
+
+def _process_chunks(holo: HoloGram, queue: ShardQueue, chunks: List[Tuple[int, int]], worker: str,
+                    lease: float) -> int:
+    processed = 0
+    while True:
+        pending = [idx for idx in range(len(chunks)) if not queue.is_done(idx)]
+        claimed = next((idx for idx in pending if queue.claim(idx)), None)
+        if claimed is None:
+            if len(pending) == 0:
+                return processed
+            time.sleep(min(lease / 4, 10.0))  # Others are busy, wait for them to finish or for a lease to expire
+            continue
+
+        first, last = chunks[claimed]
+        start_time = time.time()
+        for holo_num in range(first, last + 1):
+            if holo.get_dhm_mode() == "Offaxis":
+                holo.hologram_process(holo_num, False)
+            else:
+                holo.hologram_inline_process(holo_num, False)
+            processed += 1
+            if not queue.renew(claimed):
+                break  # Our lease expired and the chunk was taken over
+        else:
+            holo.close_outputs()  # Flushes the stacks and stores before the chunk is reported as done
+            queue.complete(claimed, {"worker": worker, "first": first, "last": last,
+                                     "seconds": round(time.time() - start_time, 3)})
+
+
+def _frame_outputs(save_path: str, holo_num: int) -> List[str]:
+    prefix = f"{holo_num}_"
+    return sorted(file for file in os.listdir(save_path) if file.startswith(prefix))
+
+
+def _stack_outputs(save_path: str, worker: str) -> List[str]:
+    return sorted(stacks.stack_name(product, worker) for product in stacks.STACK_PRODUCTS
+                  if os.path.exists(os.path.join(save_path, stacks.stack_name(product, worker))))
+
+
+def status(config_path: str, chunk_size: int = 16, mode: Optional[str] = None) -> Dict[str, Any]:
+    holo = _prepare(config_path, mode)
+    manifest = load_manifest(holo, config_path, chunk_size)
+    queue = ShardQueue(_shard_dir(holo), worker="")
+    done = [idx for idx in range(len(manifest["chunks"])) if queue.is_done(idx)]
+    claimed = {idx: queue.claimed_by(idx) for idx in range(len(manifest["chunks"])) if idx not in done}
+    return {"chunks": len(manifest["chunks"]), "done": len(done),
+            "claimed": {idx: claim for idx, claim in claimed.items() if claim is not None}}
+
+
+def merge(config_path: str, chunk_size: int = 16, mode: Optional[str] = None) -> str:
+    """Check that all chunks are done and write the merged results index of the run; return its path"""
+    holo = _prepare(config_path, mode)
+    manifest = load_manifest(holo, config_path, chunk_size)
+    queue = ShardQueue(_shard_dir(holo), worker="")
+    missing = [idx for idx in range(len(manifest["chunks"])) if not queue.is_done(idx)]
+    if len(missing) > 0:
+        raise RuntimeError(f"{len(missing)} chunk(s) not done yet, e.g. chunk {missing[0]}")
+
+    save_path = holo.get_save_path()
+    frames = {}
+    for idx, (first, last) in enumerate(manifest["chunks"]):
+        worker = queue.record(idx)["worker"]
+        for holo_num in range(first, last + 1):
+            if holo.get_output_format() == "stack":
+                outputs = _stack_outputs(save_path, worker)
+            elif holo.get_output_format() == "zarr":
+                outputs = [volume_store.store_name("zarr")]
+            else:
+                outputs = _frame_outputs(save_path, holo_num)
+            frames[holo_num] = {"hologram": manifest["series"][holo_num], "worker": worker, "outputs": outputs}
+    results_path = os.path.join(save_path, RESULTS_NAME)
+    with open(results_path, "w") as results_file:
+        json.dump({"mode": manifest["mode"], "read_path": holo.get_read_path(), "frames": frames},
+                  results_file, indent=1)
+    return results_path
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Sharded DHM batch processing over a shared filesystem")
+    parser.add_argument("config", help="configuration receipt (.ini) shared by all workers")
+    parser.add_argument("--worker", default=f"{socket.gethostname()}-{os.getpid()}", help="unique worker name")
+    parser.add_argument("--chunk-size", type=int, default=16, help="frames per claim")
+    parser.add_argument("--lease", type=float, default=300.0, help="seconds before an unrenewed claim is taken over")
+    parser.add_argument("--mode", choices=("Offaxis", "Inline"), help="override [DHM_Mode] of the receipt")
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--status", action="store_true", help="print the progress of the run")
+    action.add_argument("--merge", action="store_true", help="write the merged results index once all is done")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        print(json.dumps(status(args.config, args.chunk_size, args.mode), indent=1))
+    elif args.merge:
+        print(f"Results index written to {merge(args.config, args.chunk_size, args.mode)}")
+    else:
+        processed = run_worker(args.config, args.worker, args.chunk_size, args.lease, args.mode)
+        print(f"Worker {args.worker} processed {processed} frame(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Hologram input sources behind HoloGram.HOLO_LIST and load_hologram_img.
+
+A series can be a directory of single-image TIFF files, one multi-page TIFF stack, or a raw binary dump of the camera
+SDK. Every source builds its frame index once when it is opened and then reads frame N directly: directories through
+the persistent dhm.series_index, stacks through the recorded IFD offsets (or a memory map of the whole series when the
+stack is uncompressed and contiguous, as ImageJ and tifffile write them), raw dumps through a memory map. All sources
+read ROI-only (see dhm.tiff_io) and prefetch frames on a background thread, so reading the next frame overlaps with
+processing the current one.
+"""
+import os
+import abc
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+import numpy as np
+from dhm.utils import lazy_import
+tf = lazy_import("tifffile")
+from dhm import tiff_io
+from dhm.live import is_tiff_name
+from dhm.series_index import SeriesIndex
+from dhm.tiff_io import Roi
+
+# width, height, dtype, bytes of file header, bytes of header before every frame
+RawParams = Tuple[int, int, str, int, int]
+
+
+class HologramSource(abc.ABC):
+    """Indexed series of holograms with random access and prefetching"""
+
+    _path: str
+    _prefetched: "OrderedDict[Tuple[int, Optional[Roi]], Future]"
+
+    def __init__(self, path: str, prefetch_depth: int = 2) -> None:
+        self._path = path
+        self._prefetch_depth = prefetch_depth
+        self._prefetched = OrderedDict()
+        self._prefetch_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def get_path(self) -> str:
+        return self._path
+
+    @abc.abstractmethod
+    def names(self) -> List[str]:
+        """Frame names, as listed in HOLO_LIST"""
+
+    def __len__(self) -> int:
+        return len(self.names())
+
+    @abc.abstractmethod
+    def _read(self, idx: int, roi: Optional[Roi]) -> np.ndarray:
+        """Read frame idx (its ROI only if given) from the source"""
+
+    def read(self, idx: int, roi: Optional[Roi] = None) -> np.ndarray:
+        """Read frame idx (its ROI only if given), from the prefetched frames if it was prefetched"""
+        with self._prefetch_lock:
+            future = self._prefetched.pop((idx, roi), None)
+        if future is not None:
+            return future.result()
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Frame {idx} is out of the {len(self)} frames of {self._path}")
+        return self._read(idx, roi)
+
+    def prefetch(self, idx: int, roi: Optional[Roi] = None) -> None:
+        """Start reading frame idx in the background, keeping at most prefetch_depth frames ahead"""
+        if not 0 <= idx < len(self) or self._prefetch_depth == 0:
+            return
+        with self._prefetch_lock:
+            if (idx, roi) in self._prefetched:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dhm-prefetch")
+            self._prefetched[(idx, roi)] = self._executor.submit(self._read, idx, roi)
+            while len(self._prefetched) > self._prefetch_depth:
+                self._prefetched.popitem(last=False)
+
+    def close(self) -> None:
+        with self._prefetch_lock:
+            self._prefetched.clear()
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+class DirectorySource(HologramSource):
+    """Directory of single-image TIFF files. The names list is shared with HOLO_LIST, so frames appended to it
+    (e.g. in live mode) are readable right away. Files recorded as uncompressed in the series index are memory
+    mapped at their recorded data offset, the others are read through tifffile."""
+
+    def __init__(self, path: str, names: List[str], index: Optional[SeriesIndex] = None,
+                 prefetch_depth: int = 2) -> None:
+        super().__init__(path, prefetch_depth)
+        self._names = names
+        self._index = index
+
+    def names(self) -> List[str]:
+        return self._names
+
+    def _read(self, idx: int, roi: Optional[Roi]) -> np.ndarray:
+        file_path = os.path.join(self._path, self._names[idx])
+        record = self._index.record(self._names[idx]) if self._index is not None else None
+        if record is not None and record.is_mappable():
+            stat = os.stat(file_path)
+            if (stat.st_mtime_ns, stat.st_size) == (record.mtime_ns, record.size):
+                image = np.memmap(file_path, dtype=record.dtype, mode="r", offset=record.offset,
+                                  shape=(record.height, record.width))
+                left, right, top, bot = tiff_io.clip_roi(roi, image.shape)
+                return np.array(image[left:right, top:bot], dtype=image.dtype.newbyteorder("="))
+        return tf.imread(file_path) if roi is None else tiff_io.read_region(file_path, roi)
+
+
+class TiffStackSource(HologramSource):
+    """Multi-page TIFF stack, one hologram per page. The file stays open while the source is used."""
+
+    def __init__(self, path: str, prefetch_depth: int = 2) -> None:
+        super().__init__(path, prefetch_depth)
+        self._tif = tf.TiffFile(path)
+        self._lock = threading.Lock()
+        self._series: Optional[np.ndarray] = None
+        series = self._tif.series[0]
+        if series.dataoffset is not None and series.ndim == 3 and series.keyframe.samplesperpixel == 1:
+            # Uncompressed and contiguous (also ImageJ stacks that hold more frames than pages): one memory map
+            self._series = np.memmap(path, dtype=series.dtype.newbyteorder(self._tif.byteorder), mode="r",
+                                     offset=series.dataoffset, shape=series.shape)
+            self._offsets = []
+            frame_count = series.shape[0]
+        else:
+            self._offsets = [page.offset for page in self._tif.pages]  # IFD of every frame, walked once
+            frame_count = len(self._offsets)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        self._names = [f"{stem}[{idx}]" for idx in range(frame_count)]
+
+    def names(self) -> List[str]:
+        return self._names
+
+    def _read(self, idx: int, roi: Optional[Roi]) -> np.ndarray:
+        if self._series is not None:
+            left, right, top, bot = tiff_io.clip_roi(roi, self._series.shape[1:])
+            return np.array(self._series[idx, left:right, top:bot], dtype=self._series.dtype.newbyteorder("="))
+        with self._lock:
+            self._tif.filehandle.seek(self._offsets[idx])
+            page = tf.TiffPage(self._tif, index=idx)
+            return tiff_io.read_page_region(self._tif, page, roi)
+
+    def close(self) -> None:
+        super().close()
+        self._series = None
+        self._tif.close()
+
+
+class RawSource(HologramSource):
+    """Raw binary dump of consecutive frames, e.g. from the camera SDK, described by its RawParams"""
+
+    def __init__(self, path: str, raw_params: RawParams, prefetch_depth: int = 2) -> None:
+        super().__init__(path, prefetch_depth)
+        width, height, dtype, header_bytes, frame_header_bytes = raw_params
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Set the frame size of the raw source {path} ([Raw_Source] of the receipt)")
+        frame_dtype = np.dtype([("header", np.uint8, (frame_header_bytes,)), ("image", dtype, (height, width))])
+        frame_count = (os.path.getsize(path) - header_bytes) // frame_dtype.itemsize
+        frames = np.memmap(path, dtype=frame_dtype, mode="r", offset=header_bytes, shape=(frame_count,))
+        self._frames = frames["image"]
+        stem = os.path.splitext(os.path.basename(path))[0]
+        self._names = [f"{stem}[{idx}]" for idx in range(frame_count)]
+
+    def names(self) -> List[str]:
+        return self._names
+
+    def _read(self, idx: int, roi: Optional[Roi]) -> np.ndarray:
+        left, right, top, bot = tiff_io.clip_roi(roi, self._frames.shape[1:])
+        return np.array(self._frames[idx, left:right, top:bot])
+
+
+def open_source(path: str, names: List[str], raw_params: Optional[RawParams] = None,
+                index: Optional[SeriesIndex] = None) -> HologramSource:
+    """Source for a directory of the given file names (indexed by index, if given), a multi-page TIFF stack or a
+    raw dump"""
+    if os.path.isdir(path):
+        return DirectorySource(path, names, index)
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    if is_tiff_name(path):
+        return TiffStackSource(path)
+    if raw_params is None:
+        raise ValueError(f"{path} is neither a directory nor a TIFF stack")
+    return RawSource(path, raw_params)
@@ -0,0 +1,243 @@
+"""Single-file stack output: one BigTIFF per saved product instead of one file per frame (and per slice).
+
+A StackWriter appends every frame as a page of `<product>_stack.tiff`, with its frame and slice index in the page
+description. Next to the stack, an append-only text index `<stack>.idx` lists for every page its frame, slice, page
+number, the file offsets of its IFD and of its data (and the scale and offset of quantized pages, see dhm.quantize),
+so a StackReader can read any frame with one seek instead of walking the IFD chain: uncompressed pages are read at
+their data offset, compressed pages (see dhm.compression) are parsed at their IFD offset and decoded through tifffile.
+Frames that are processed again are appended, and the index then points to the newest page. The index can always be
+rebuilt from the page descriptions with rebuild_index(); a writer does so when the index does not list every page of
+its stack, e.g. after a crash between writing a page and indexing it.
+
+Workers that write into the same save directory at the same time (see dhm.shard) each get their own stack, tagged
+with the worker name, e.g. `height_map_stack.node1.tiff`; a StackSet reads a product over all of its stacks.
+"""
+import os
+import glob
+import json
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+from dhm.utils import lazy_import
+tf = lazy_import("tifffile")
+from dhm.quantize import Quantization, dequantize, description, from_description, tiff_kwargs
+
+STACK_PRODUCTS = ("height_map", "phase_map", "wrapped_phase", "inline_frame")
+INDEX_SUFFIX = ".idx"
+
+
+def stack_name(product: str, tag: str = "") -> str:
+    return f"{product}_stack.{tag}.tiff" if tag else f"{product}_stack.tiff"
+
+
+class StackEntry(NamedTuple):
+    """One page of a stack. offset is -1 when the page data is not contiguous (e.g. compressed), ifd is -1 in
+    indexes written before IFD offsets were recorded"""
+    page: int
+    offset: int
+    nbytes: int
+    dtype: str
+    shape: Tuple[int, int]
+    quantization: Quantization = Quantization()
+    ifd: int = -1
+
+
+def _format_entry(frame: int, z_idx: int, entry: StackEntry) -> str:
+    line = (f"{frame} {z_idx} {entry.page} {entry.ifd} {entry.offset} {entry.nbytes} {entry.dtype} "
+            f"{entry.shape[0]} {entry.shape[1]}")
+    if entry.quantization.dtype != "float32":
+        line += f" {entry.quantization.dtype} {entry.quantization.scale!r} {entry.quantization.offset!r}"
+        if entry.quantization.nan_code is not None:
+            line += f" {entry.quantization.nan_code}"
+    return line + "\n"
+
+
+def _parse_entry(line: str) -> Tuple[Tuple[int, int], StackEntry]:
+    fields = line.split()
+    if len(fields) in (8, 11):
+        fields.insert(3, "-1")  # Index without IFD offsets
+    frame, z_idx, page, ifd, offset, nbytes, dtype, height, width, *quantized = fields
+    quantization = Quantization(quantized[0], float(quantized[1]), float(quantized[2]),
+                                *(int(code) for code in quantized[3:])) if quantized else Quantization()
+    return (int(frame), int(z_idx)), StackEntry(int(page), int(offset), int(nbytes), dtype, (int(height), int(width)),
+                                                quantization, int(ifd))
+
+
+def rebuild_index(stack_path: str) -> int:
+    """Write the index of a stack from its page descriptions, e.g. after a crash; return the number of pages"""
+    with tf.TiffFile(stack_path) as tif, open(stack_path + INDEX_SUFFIX, "w") as index_file:
+        for page_num, page in enumerate(tif.pages):
+            key = json.loads(page.description)
+            contiguous = page.is_contiguous
+            offset, nbytes = (page.dataoffsets[0], page.databytecounts[0]) if contiguous else (-1, 0)
+            index_file.write(_format_entry(key["frame"], key["z"], StackEntry(
+                page_num, offset, nbytes, page.dtype.str, page.shape[:2], from_description(page.description),
+                page.offset)))
+        return len(tif.pages)
+
+
+def _count_lines(path: str) -> int:
+    """Complete lines of a text file"""
+    with open(path) as text_file:
+        return sum(1 for line in text_file if line.endswith("\n"))
+
+
+class StackWriter:
+    """Persistent writer appending the frames of one product to its BigTIFF stack"""
+
+    _path: str
+    _pages: int
+
+    def __init__(self, stack_path: str, write_kwargs: Optional[Dict[str, Any]] = None) -> None:
+        """write_kwargs of every page, e.g. its compression (see dhm.compression.tiff_kwargs)"""
+        self._path = stack_path
+        self._write_kwargs = write_kwargs or {}
+        index_path = stack_path + INDEX_SUFFIX
+        self._pages = 0
+        if os.path.exists(stack_path):
+            # Page numbers come from the stack, an index missing pages (or lines) is rebuilt
+            with tf.TiffFile(stack_path) as tif:
+                self._pages = len(tif.pages)
+            if not os.path.exists(index_path) or _count_lines(index_path) != self._pages:
+                rebuild_index(stack_path)
+        elif os.path.exists(index_path):
+            os.remove(index_path)  # Index of a deleted stack
+        self._tif = tf.TiffWriter(stack_path, bigtiff=True, append=True)
+        self._index = open(index_path, "a")
+
+    def write(self, frame: int, z_idx: int, image: np.ndarray, quantization: Quantization = Quantization()) -> None:
+        """Append one frame (slice z_idx of an inline volume, 0 otherwise), stored with the quantization (see
+        dhm.quantize), and index it"""
+        # tifffile writes the IFD of an appended page at the (word-aligned) end of the file, ahead of its data;
+        # StackReader checks the page it finds there
+        handle = self._tif.filehandle
+        handle.seek(0, os.SEEK_END)
+        ifd = handle.tell() + handle.tell() % 2
+        location = self._tif.write(image, description=description(quantization, frame=frame, z=z_idx),
+                                   metadata=None, contiguous=False, returnoffset=True, **self._write_kwargs,
+                                   **tiff_kwargs(quantization))
+        offset, nbytes = location if location is not None else (-1, 0)
+        # Flush the page before indexing it, readers in other threads or processes then never see a partial page
+        handle.flush()
+        self._index.write(_format_entry(frame, z_idx, StackEntry(self._pages, offset, nbytes, image.dtype.str,
+                                                                 image.shape[:2], quantization, ifd)))
+        self._index.flush()
+        self._pages += 1
+
+    def get_path(self) -> str:
+        return self._path
+
+    def close(self) -> None:
+        self._tif.close()
+        self._index.close()
+
+
+class StackReader:
+    """Random access to the frames of one stack. The index is read incrementally, so frames appended by a running
+    writer become readable without reloading the whole index."""
+
+    _path: str
+    _entries: Dict[Tuple[int, int], StackEntry]
+
+    def __init__(self, stack_path: str, write_kwargs: Optional[Dict[str, Any]] = None) -> None:
+        """write_kwargs of every page, e.g. its compression (see dhm.compression.tiff_kwargs)"""
+        self._path = stack_path
+        self._write_kwargs = write_kwargs or {}
+        self._entries = {}
+        self._index_pos = 0
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Read the index lines appended since the last refresh"""
+        index_path = self._path + INDEX_SUFFIX
+        if not os.path.exists(index_path):
+            rebuild_index(self._path)
+        if os.path.getsize(index_path) == self._index_pos:
+            return
+        with self._lock, open(index_path) as index_file:
+            index_file.seek(self._index_pos)
+            for line in index_file:
+                if not line.endswith("\n"):
+                    break  # Being written, read it on the next refresh
+                key, entry = _parse_entry(line)
+                self._entries[key] = entry
+                self._index_pos += len(line)
+
+    def frames(self) -> List[Tuple[int, int]]:
+        return sorted(self._entries)
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        return key in self._entries
+
+    def read(self, frame: int, z_idx: int = 0) -> np.ndarray:
+        """Read the newest page of one frame in its physical unit, KeyError if the stack does not contain it"""
+        self.refresh()
+        entry = self._entries[(frame, z_idx)]
+        if entry.offset < 0:
+            return dequantize(self._read_page(frame, z_idx, entry), entry.quantization)
+        shape = entry.shape + ((2,) if entry.quantization.dtype == "int16_complex" else ())
+        stored = np.fromfile(self._path, dtype=np.dtype(entry.dtype), count=int(np.prod(shape)), offset=entry.offset)
+        return dequantize(stored.reshape(shape), entry.quantization)
+
+    def _read_page(self, frame: int, z_idx: int, entry: StackEntry) -> np.ndarray:
+        """Decode a page parsed at its IFD offset; pages of an older index, or whose description does not match,
+        are found by walking the IFD chain"""
+        with tf.TiffFile(self._path) as tif:
+            if 0 <= entry.ifd < tif.filehandle.size:
+                tif.filehandle.seek(entry.ifd)
+                try:
+                    page = tf.TiffPage(tif, index=entry.page)
+                    key = json.loads(page.description)
+                    if (key.get("frame"), key.get("z")) == (frame, z_idx):
+                        return page.asarray()
+                except (tf.TiffFileError, ValueError, AttributeError):
+                    pass
+            return tif.pages[entry.page].asarray()
+
+
+class StackSet:
+    """All stacks of one product in a save directory, from a single writer or from several shard workers"""
+
+    _save_path: str
+    _product: str
+    _readers: Dict[str, StackReader]
+
+    def __init__(self, save_path: str, product: str) -> None:
+        self._save_path = save_path
+        self._product = product
+        self._readers = {}
+
+    def _refresh(self) -> None:
+        pattern = os.path.join(glob.escape(self._save_path), f"{self._product}_stack*.tiff")
+        stack_paths = sorted(glob.glob(pattern))
+        # Forget the stacks deleted since, their frames are gone
+        self._readers = {stack_path: reader for stack_path, reader in self._readers.items()
+                         if stack_path in stack_paths}
+        for stack_path in stack_paths:
+            if stack_path not in self._readers:
+                self._readers[stack_path] = StackReader(stack_path)
+            self._readers[stack_path].refresh()
+
+    def read(self, frame: int, z_idx: int = 0) -> np.ndarray:
+        """Read one frame from whichever stack holds it, FileNotFoundError if none does"""
+        for _ in range(2):
+            for reader in self._readers.values():
+                if (frame, z_idx) in reader:
+                    return reader.read(frame, z_idx)
+            self._refresh()
+        raise FileNotFoundError(f"Frame {frame} slice {z_idx} is not in the {self._product} stacks "
+                                f"of {self._save_path}")
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        """Whether a stack on disk holds the (frame, slice), looking for new and deleted stacks first"""
+        self._refresh()
+        return any(key in reader for reader in self._readers.values())
+
+    def frames(self) -> List[Tuple[int, int]]:
+        self._refresh()
+        return sorted({key for reader in self._readers.values() for key in reader.frames()})
+
+
+def read_stack_frame(save_path: str, product: str, frame: int, z_idx: int = 0) -> np.ndarray:
+    """Read one frame of a product without keeping the stacks open, e.g. from scripts"""
+    return StackSet(save_path, product).read(frame, z_idx)
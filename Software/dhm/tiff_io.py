@@ -0,0 +1,70 @@
+"""Region reads of single-image TIFF files: only the data of a region of interest is read from disk.
+
+Uncompressed, contiguous images are memory-mapped, so only the pages of the file holding ROI rows are touched.
+Compressed striped or tiled images decode only the strips or tiles that overlap the ROI. Anything else (RGB,
+planar or volumetric pages) is decoded fully and cropped.
+"""
+from typing import Optional, Tuple
+import numpy as np
+from dhm.utils import lazy_import
+tf = lazy_import("tifffile")
+
+Roi = Tuple[int, int, int, int]  # left, right, top, bot as in engine.crop_roi: image[left:right, top:bot]
+
+
+def clip_roi(roi: Optional[Roi], shape: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    if roi is None:
+        return 0, shape[0], 0, shape[1]
+    left, right, top, bot = (slice(roi[0], roi[1]).indices(shape[0])[:2] + slice(roi[2], roi[3]).indices(shape[1])[:2])
+    return left, max(left, right), top, max(top, bot)
+
+
+def _read_segments(tif: "tf.TiffFile", page: "tf.TiffPage", region: Tuple[int, int, int, int]) -> np.ndarray:
+    """Decode the strips or tiles of the page that overlap the region, and assemble the region from them"""
+    left, right, top, bot = region
+    chunk_h, chunk_w = page.chunks[-2:] if page.is_tiled else (page.rowsperstrip, page.imagewidth)
+    grid_w = page.chunked[-1] if page.is_tiled else 1
+    out = np.empty((right - left, bot - top), dtype=page.dtype)
+    fh = tif.filehandle
+
+    for grid_y in range(left // chunk_h, (right - 1) // chunk_h + 1):
+        for grid_x in range(top // chunk_w, (bot - 1) // chunk_w + 1):
+            index = grid_y * grid_w + grid_x
+            fh.seek(page.dataoffsets[index])
+            segment, indices, _ = page.decode(fh.read(page.databytecounts[index]), index,
+                                              jpegtables=page.jpegtables)
+            segment = segment.reshape(segment.shape[-3:-1])  # (1, h, w, 1) -> (h, w)
+            seg_top, seg_left = indices[-3], indices[-2]
+            rows = slice(max(left, seg_top), min(right, seg_top + segment.shape[0]))
+            cols = slice(max(top, seg_left), min(bot, seg_left + segment.shape[1]))
+            out[rows.start - left:rows.stop - left, cols.start - top:cols.stop - top] = \
+                segment[rows.start - seg_top:rows.stop - seg_top, cols.start - seg_left:cols.stop - seg_left]
+    return out
+
+
+def read_page_region(tif: "tf.TiffFile", page: "tf.TiffPage", roi: Optional[Roi] = None) -> np.ndarray:
+    """Read image[left:right, top:bot] of a page of an open file, reading only the data the ROI needs"""
+    if page.shaped[:2] != (1, 1) or page.samplesperpixel != 1:
+        return np.array(page.asarray()[_roi_slices(roi, page.shape)])
+    region = clip_roi(roi, page.shape)
+    if region[0] == region[1] or region[2] == region[3]:
+        return np.empty((region[1] - region[0], region[3] - region[2]), dtype=page.dtype)
+
+    if page.is_memmappable:
+        image = np.memmap(tif.filehandle.path, dtype=page.dtype.newbyteorder(tif.byteorder), mode="r",
+                          offset=page.dataoffsets[0], shape=page.shape)
+        return np.array(image[region[0]:region[1], region[2]:region[3]], dtype=page.dtype)
+    if len(page.dataoffsets) == 1:
+        return page.asarray()[region[0]:region[1], region[2]:region[3]]  # One segment, nothing to skip
+    return _read_segments(tif, page, region)
+
+
+def read_region(file_path: str, roi: Optional[Roi] = None) -> np.ndarray:
+    """Read image[left:right, top:bot] of the first page, reading only the data the ROI needs"""
+    with tf.TiffFile(file_path) as tif:
+        return read_page_region(tif, tif.pages[0], roi)
+
+
+def _roi_slices(roi: Optional[Roi], shape: Tuple[int, ...]) -> Tuple[slice, slice]:
+    left, right, top, bot = clip_roi(roi, shape[:2])
+    return slice(left, right), slice(top, bot)
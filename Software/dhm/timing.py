@@ -0,0 +1,145 @@
+"""Per-stage timing of the processing: load, filter, FFT, apodize, propagate, unwrap and save.
+
+HoloGram.hologram_process and hologram_inline_process run every stage of a frame inside StageTimer.stage(name), and
+the engine times its FFTs and filtering the same way when given the timer. The timer sums the stages of a frame and,
+when the frame is done, folds the sums into an exponentially weighted moving average (EWMA) per stage and into the
+totals of the run. Disabled, a stage costs one attribute test and a shared null context, so the hooks stay in place.
+At the end of a run, one line with the mean time of every stage is appended to TIMING_LOG_NAME in the save path:
+`<date> <mode> frames=<n> <stage>=<ms> ... total=<ms>`.
+
+The remaining time of a run is estimated with an Ewma of the measured seconds per frame as well, which follows a
+change of the throughput (other parameters, a slower disk) within a few updates instead of never, as a mean would.
+"""
+import os
+import time
+import threading
+import contextlib
+from typing import Dict, Optional
+
+STAGES = ("load", "filter", "fft", "apodize", "propagate", "unwrap", "save")
+TIMING_LOG_NAME = "dhm_timing.log"
+DEFAULT_ALPHA = 0.2 # weight of the newest value of the moving averages
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class Ewma:
+    """Exponentially weighted moving average, None until the first value"""
+
+    def __init__(self, alpha: float = DEFAULT_ALPHA) -> None:
+        self._alpha = alpha
+        self._value = None
+
+    def update(self, value: float) -> float:
+        self._value = value if self._value is None else self._value + self._alpha * (value - self._value)
+        return self._value
+
+    def get(self) -> Optional[float]:
+        return self._value
+
+    def reset(self) -> None:
+        self._value = None
+
+
+class _Stage:
+    """Context adding its elapsed time to a stage of the timer"""
+
+    __slots__ = ("_timer", "_name", "_start")
+
+    def __init__(self, timer: "StageTimer", name: str) -> None:
+        self._timer = timer
+        self._name = name
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        self._timer.add(self._name, time.perf_counter() - self._start)
+
+
+class StageTimer:
+    """Time per frame of every stage, as moving average and as total of the run, in seconds"""
+
+    def __init__(self, enabled: bool = False, alpha: float = DEFAULT_ALPHA) -> None:
+        self._enabled = enabled
+        self._alpha = alpha
+        self._lock = threading.Lock()
+        self._frame = {}
+        self._ewma = {}
+        self._totals = {}
+        self._frames = 0
+
+    def set_enabled(self, enabled: bool) -> None:
+        self._enabled = enabled
+
+    def is_enabled(self) -> bool:
+        return self._enabled
+
+    def stage(self, name: str):
+        """Context manager timing the code it runs as the stage name"""
+        if not self._enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def add(self, name: str, seconds: float) -> None:
+        """Add time to a stage of the current frame"""
+        self._frame[name] = self._frame.get(name, 0.0) + seconds
+
+    def start_frame(self) -> None:
+        """Drop the stages of a frame that was not done, e.g. stopped while processing"""
+        if self._frame:
+            self._frame = {}
+
+    def frame_done(self) -> None:
+        """Fold the stages of the current frame into the moving averages and the totals of the run"""
+        if not self._frame:
+            return
+        frame, self._frame = self._frame, {}
+        with self._lock:
+            for name, seconds in frame.items():
+                previous = self._ewma.get(name)
+                self._ewma[name] = seconds if previous is None else previous + self._alpha * (seconds - previous)
+                self._totals[name] = self._totals.get(name, 0.0) + seconds
+            self._frames += 1
+
+    def ewma(self) -> Dict[str, float]:
+        """Moving average time per frame of every stage timed yet, in STAGES order"""
+        with self._lock:
+            return {name: self._ewma[name] for name in STAGES if name in self._ewma}
+
+    def summary(self) -> Dict[str, float]:
+        """Mean time per frame of every stage timed in the run, in STAGES order"""
+        with self._lock:
+            if self._frames == 0:
+                return {}
+            return {name: self._totals[name] / self._frames for name in STAGES if name in self._totals}
+
+    def get_frames(self) -> int:
+        return self._frames
+
+    def reset(self) -> None:
+        """Start a new run: forget the averages and the totals"""
+        with self._lock:
+            self._frame = {}
+            self._ewma = {}
+            self._totals = {}
+            self._frames = 0
+
+    def log_run(self, save_path: str, mode: str) -> Optional[str]:
+        """Append the mean stage times of the run to the timing log of the save path; return the line, None if
+        no frame was timed"""
+        stages = self.summary()
+        if not stages:
+            return None
+        line = " ".join([time.strftime("%Y-%m-%dT%H:%M:%S"), mode, f"frames={self._frames}"] +
+                        [f"{name}={seconds * 1000:.1f}" for name, seconds in stages.items()] +
+                        [f"total={sum(stages.values()) * 1000:.1f}"])
+        if save_path != "":
+            with open(os.path.join(save_path, TIMING_LOG_NAME), "a") as log_file:
+                log_file.write(line + "\n")
+        return line
+
+
+def format_stages(stages: Dict[str, float]) -> str:
+    """Stage times as `load 12 ms, fft 30 ms, ...`"""
+    return ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in stages.items())
@@ -1,9 +1,24 @@
 """Utilities Functions for DHM Processing"""
 
-import numpy as np
+import sys
+import types
 import warnings
+import importlib
+import numpy as np
 from typing import Tuple
-from skimage.filters import gaussian
+
+class _LazyModule(types.ModuleType):
+    """Stand-in of a module that imports it on the first access of one of its attributes"""
+
+    def __getattr__(self, attr: str):
+        module = importlib.import_module(self.__name__)  # Under the import lock, executed once
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Module imported on its first attribute access, for dependencies that are slow to import and not needed by
+    every user of dhm; the module itself if it was imported already"""
+    return sys.modules.get(name) or _LazyModule(name)
 
 def _hanning_filter(sh_x, sh_y, cent_x, cent_y, r) -> np.ndarray:
     """Returning a hanning filter based on the radius and relative position in the quadrant."""
@@ -35,15 +50,14 @@ def fourier_process(img_pre, filter_pre) -> np.ndarray:
     fourier_selected = np.fft.ifft2(fourier_selected)
     return fourier_selected
 
-def apodization_process(img, k_factor, pad_size) -> np.ndarray:
-    """Apodize the hologram image by padding the sides."""
-    l0x, l0y = img.shape
+def apodization_window(shape, k_factor, pad_size) -> np.ndarray:
+    """Window of the apodization for a hologram of the given shape, before padding."""
+    l0x, l0y = shape
+    lx = l0x + 2 * pad_size
+    ly = l0y + 2 * pad_size
     l0x = l0x - (pad_size * 3)
     l0y = l0y - (pad_size * 3)
 
-    holo = np.pad(img, pad_width=pad_size, mode='edge')
-    lx, ly = holo.shape
-
     ax = - (np.pi / 2) * (lx - l0x) / (l0x - lx + 2)
     bx = (np.pi / 2) * (lx + l0x + 2) / (lx - l0x - 2)
     ay = - (np.pi / 2) * (ly - l0y) / (l0y - ly + 2)
@@ -56,16 +70,18 @@ def apodization_process(img, k_factor, pad_size) -> np.ndarray:
         wy = _flat_window(ly, l0y, ay, by, k_factor)
 
     x, y = np.meshgrid(wy, wx)
-    window = x * y
-    img_processed = holo * window
+    return x * y
 
-    return img_processed
+def apodization_process(img, k_factor, pad_size) -> np.ndarray:
+    """Apodize the hologram image by padding the sides."""
+    holo = np.pad(img, pad_width=pad_size, mode='edge')
+    img_processed = holo * apodization_window(img.shape, k_factor, pad_size)
 
-def angular_mask(image, vector, delta) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    """Angular mask creation for the angular spectrum method."""
+    return img_processed
 
-    image_fft = np.fft.fftshift(np.fft.fft2(image))
-    n_x, m_y = image_fft.shape
+def angular_spectrum_grid(shape, vector, delta) -> Tuple[np.ndarray, np.ndarray]:
+    """Axial wave numbers and propagating-wave mask of the (shifted) spectrum for the angular spectrum method."""
+    n_x, m_y = shape
     extent_x = m_y * delta
     extent_y = n_x * delta
     kx = np.linspace(-np.pi * m_y // 2 / (extent_x / 2), np.pi * m_y // 2 / (extent_x / 2), m_y)
@@ -78,10 +94,25 @@ def angular_mask(image, vector, delta) -> Tuple[np.ndarray, np.ndarray, np.ndarr
         kz = np.sqrt(vector ** 2 - kx ** 2 - ky ** 2)
 
     mask = (vector ** 2 - kx ** 2 - ky ** 2) > 0
+    return kz, mask
+
+def angular_mask(image, vector, delta) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Angular mask creation for the angular spectrum method."""
+
+    image_fft = np.fft.fftshift(np.fft.fft2(image))
+    kz, mask = angular_spectrum_grid(image_fft.shape, vector, delta)
     return image_fft, kz, mask
 
+def unwrap_phase(wrapped_phase) -> np.ndarray:
+    """Unwrap the phase map. skimage is imported at first use only, as it dominates the import time of dhm."""
+    # On Windows, install 'Microsoft's vcredist_x64.exe' to fix potential unwrap_phase dependency error
+    # ( https://docs.microsoft.com/en-us/cpp/windows/latest-supported-vc-redist?view=msvc-170)
+    from skimage.restoration import unwrap_phase as _unwrap_phase
+    return _unwrap_phase(wrapped_phase)
+
 def background_unit(img) -> np.ndarray:
     """Smoothing the final image."""
+    from skimage.filters import gaussian  # Deferred, skimage is slow to import
 
     img = img - gaussian(img, sigma=150)
     histogram, bin_edges = np.histogram(img, bins=256)
@@ -89,11 +120,9 @@ def background_unit(img) -> np.ndarray:
     image_back = img - max_histogram
     return image_back
 
-def filter_fixed_point(hologram_raw, quad: str, filter_rate: float, filter_type: str) -> np.ndarray:
-    """Filter the hologram with an optimized adn maximized region selection in a given quadrant, 
-        either with Flat or Hanning Method."""
-    
-    frequency = np.fft.fftshift(np.fft.fft2(hologram_raw))
+def find_sideband(frequency, quad: str, filter_rate: float) -> Tuple[int, int, int]:
+    """Locate the sideband in a given quadrant of the shifted hologram spectrum, return its center and the
+    filter radius scaled by the filter rate."""
     shape_x, shape_y = np.shape(frequency)
     center_x = None; center_y = None
     v_pad = int(np.floor(shape_x / 2)); h_pad = int(np.floor(shape_y / 2))
@@ -107,10 +136,17 @@ def filter_fixed_point(hologram_raw, quad: str, filter_rate: float, filter_type:
     center_x = indices[0] + ((v_pad + 30) if quad == ('3' or '4') else 0)
     center_y = indices[1] + ((h_pad + 30) if quad == ('1' or '4') else 0)
 
+    return int(center_x[0]), int(center_y[0]), sideband_radius(shape_x, shape_y, center_x[0], center_y[0], filter_rate)
+
+def sideband_radius(shape_x: int, shape_y: int, center_x: int, center_y: int, filter_rate: float) -> int:
+    """Filter radius of a sideband: a third of its distance to the spectrum center, scaled by the filter rate."""
     distance = np.sqrt(np.power(np.abs(center_x - int(shape_x / 2)), 2)
                     + np.power(np.abs(int(shape_y / 2) - center_y), 2))
-    radius = int((distance / 3) * filter_rate)
+    return int((distance / 3) * filter_rate)
 
+def sideband_filter(shape_x: int, shape_y: int, center_x: int, center_y: int, radius: int,
+                    filter_type: str) -> np.ndarray:
+    """Circular window around the sideband, either Flat or Hanning."""
     mesh_m, mesh_n = np.meshgrid(np.arange(0, shape_y), np.arange(0, shape_x))
     region = np.sqrt((mesh_n - float(center_x)) ** 2 + (mesh_m - float(center_y)) ** 2)
     circle_window = np.array(region <= radius)
@@ -118,4 +154,13 @@ def filter_fixed_point(hologram_raw, quad: str, filter_rate: float, filter_type:
     if filter_type == "Hann":
         filter_hann = _hanning_filter(shape_x, shape_y, center_x, center_y, radius)
         circle_window = circle_window * filter_hann
-    return circle_window
\ No newline at end of file
+    return circle_window
+
+def filter_fixed_point(hologram_raw, quad: str, filter_rate: float, filter_type: str) -> np.ndarray:
+    """Filter the hologram with an optimized adn maximized region selection in a given quadrant, 
+        either with Flat or Hanning Method."""
+    
+    frequency = np.fft.fftshift(np.fft.fft2(hologram_raw))
+    shape_x, shape_y = np.shape(frequency)
+    center_x, center_y, radius = find_sideband(frequency, quad, filter_rate)
+    return sideband_filter(shape_x, shape_y, center_x, center_y, radius, filter_type)
@@ -0,0 +1,232 @@
+"""Chunked array store output: the reconstructions of a series as n-dimensional arrays in one Zarr or HDF5 store.
+
+The inline volumes of a series form one (t, z, y, x) array `refocused_volume`, the off-axis maps (t, y, x) arrays
+named by their product. Arrays are chunked (by default one frame, 8 slices and 256 x 256 pixels per chunk) and
+Blosc compressed, so downstream tools read one z-column or the time series of one pixel by touching a few chunks
+instead of opening thousands of files, and reads of a part of an array are lazy.
+
+With the Zarr backend (a directory store) every chunk is its own file; workers writing whole frames never share a
+chunk, so several processes (see dhm.shard) write into one store in parallel. HDF5 keeps one file that only a single
+process may write. Both are optional dependencies: `pip install zarr` or `pip install h5py` (and `hdf5plugin` for
+Blosc in HDF5, the built-in gzip filter is used without it).
+
+    store = open_volume_store("save_dir/dhm_volume.zarr")
+    store.z_column(t=10, y=120, x=300)      # (z,) intensities along the optical axis
+    store.time_series(z=4, y=120, x=300)    # (t,) intensities of one voxel over the series
+"""
+import os
+from typing import Any, Dict, Optional, Sequence, Tuple
+import numpy as np
+
+VOLUME_BACKENDS = ("zarr", "hdf5")
+BLOSC_CODECS = ("zstd", "lz4", "lz4hc", "blosclz", "zlib")
+DEFAULT_CHUNKS = (1, 8, 256, 256)  # t, z, y, x
+
+# Arrays of the store by the product names of HoloGram
+ARRAY_NAMES = {"inline_frame": "refocused_volume", "height_map": "height_map", "phase_map": "phase_map",
+               "wrapped_phase": "wrapped_phase"}
+
+
+def store_name(backend: str) -> str:
+    return "dhm_volume.zarr" if backend == "zarr" else "dhm_volume.h5"
+
+
+def parse_chunks(text: str) -> Tuple[int, ...]:
+    """Parse a 't,z,y,x' chunk shape from a configuration receipt"""
+    chunks = tuple(int(size) for size in text.replace(" ", "").split(","))
+    if len(chunks) != 4 or min(chunks) < 1:
+        raise ValueError(f"Chunk shape must be four positive sizes t,z,y,x, got {text!r}")
+    return chunks
+
+
+def _array_chunks(chunks: Sequence[int], shape: Sequence[int]) -> Tuple[int, ...]:
+    """Chunk shape for an array, dropping the z chunk of (t, y, x) arrays and clipping to the array shape"""
+    chunks = tuple(chunks) if len(shape) == 4 else (chunks[0],) + tuple(chunks[2:])
+    return tuple(max(1, min(chunk, size)) for chunk, size in zip(chunks, shape))
+
+
+class _ZarrBackend:
+    def __init__(self, path: str, mode: str) -> None:
+        try:
+            import zarr
+        except ImportError as e:
+            raise ImportError("The zarr output format needs the zarr package, pip install zarr") from e
+        self._zarr = zarr
+        self._v3 = int(zarr.__version__.split(".")[0]) >= 3
+        self._group = zarr.open_group(path, mode=mode)
+
+    def get(self, name: str) -> Optional[Any]:
+        return self._group[name] if name in self._group else None
+
+    def create(self, name: str, shape: Tuple[int, ...], chunks: Tuple[int, ...], compression: str,
+               level: int) -> Any:
+        try:
+            if self._v3:
+                from zarr.codecs import BloscCodec
+                compressors = None if compression == "none" else \
+                    [BloscCodec(cname=compression, clevel=level, shuffle="bitshuffle")]
+                return self._group.create_array(name, shape=shape, chunks=chunks, dtype="float32",
+                                                compressors=compressors, fill_value=np.nan)
+            from numcodecs import Blosc
+            compressor = None if compression == "none" else \
+                Blosc(cname=compression, clevel=level, shuffle=Blosc.BITSHUFFLE)
+            return self._group.create_dataset(name, shape=shape, chunks=chunks, dtype="float32",
+                                              compressor=compressor, fill_value=np.nan)
+        except ValueError:
+            # Created by another worker in the meantime
+            if name not in self._group:
+                raise
+            return self._group[name]
+
+    def resize(self, array: Any, shape: Tuple[int, ...]) -> None:
+        array.resize(shape)
+
+    def attrs(self) -> Any:
+        return self._group.attrs
+
+    def close(self) -> None:
+        pass
+
+
+class _HDF5Backend:
+    def __init__(self, path: str, mode: str) -> None:
+        try:
+            import h5py
+        except ImportError as e:
+            raise ImportError("The hdf5 output format needs the h5py package, pip install h5py") from e
+        self._file = h5py.File(path, mode)
+
+    def get(self, name: str) -> Optional[Any]:
+        return self._file[name] if name in self._file else None
+
+    def create(self, name: str, shape: Tuple[int, ...], chunks: Tuple[int, ...], compression: str,
+               level: int) -> Any:
+        filter_args = {}
+        if compression != "none":
+            try:
+                import hdf5plugin
+                filter_args = dict(hdf5plugin.Blosc(cname=compression, clevel=level,
+                                                    shuffle=hdf5plugin.Blosc.BITSHUFFLE))
+            except ImportError:
+                filter_args = {"compression": "gzip", "compression_opts": min(level, 9), "shuffle": True}
+        return self._file.create_dataset(name, shape=shape, chunks=chunks, dtype="float32", fillvalue=np.nan,
+                                         maxshape=(None,) + shape[1:], **filter_args)
+
+    def resize(self, array: Any, shape: Tuple[int, ...]) -> None:
+        array.resize(shape)
+
+    def attrs(self) -> Any:
+        return self._file.attrs
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class VolumeStore:
+    """One Zarr or HDF5 store with an array per product. Slices of an inline frame are buffered until a z chunk is
+    complete, so every chunk is compressed and written once."""
+
+    _path: str
+    _chunks: Tuple[int, ...]
+    _pending: Dict[Tuple[str, int], Tuple[int, np.ndarray]]  # (array, frame) -> (first slice, buffered slices)
+
+    def __init__(self, path: str, mode: str = "a", chunks: Sequence[int] = DEFAULT_CHUNKS,
+                 compression: str = "zstd", level: int = 3) -> None:
+        self._path = path
+        backend = _ZarrBackend if path.endswith(".zarr") else _HDF5Backend
+        self._backend = backend(path, mode)
+        self._chunks = tuple(chunks)
+        self._compression = compression
+        self._level = level
+        self._pending = {}
+
+    def get_path(self) -> str:
+        return self._path
+
+    def array(self, product: str) -> Any:
+        """Lazy array of a product (zarr.Array or h5py.Dataset), only the chunks of a selection are read"""
+        array = self._backend.get(ARRAY_NAMES.get(product, product))
+        if array is None:
+            raise FileNotFoundError(f"No {product} array in {self._path}")
+        return array
+
+    def _require(self, name: str, frame: int, frame_count: int, image_shape: Tuple[int, ...]) -> Any:
+        array = self._backend.get(name)
+        if array is None:
+            shape = (max(frame_count, frame + 1),) + image_shape
+            array = self._backend.create(name, shape, _array_chunks(self._chunks, shape), self._compression,
+                                         self._level)
+        elif frame >= array.shape[0]:
+            self._backend.resize(array, (frame + 1,) + tuple(array.shape[1:]))  # Growing series (live mode)
+        return array
+
+    def write(self, product: str, frame: int, image: np.ndarray, z_idx: Optional[int] = None,
+              frame_count: int = 1, z_count: int = 1) -> None:
+        """Write a 2D product of a frame, or slice z_idx of its inline volume with z_count slices.
+        frame_count is the series length, to size the arrays once."""
+        name = ARRAY_NAMES.get(product, product)
+        if z_idx is None:
+            self._require(name, frame, frame_count, image.shape)[frame] = image
+            return
+
+        array = self._require(name, frame, frame_count, (z_count,) + image.shape)
+        first, block = self._pending.pop((name, frame), (z_idx, []))
+        if z_idx != first + len(block):  # Not the next slice, e.g. only the stale slices of an incremental run
+            array[frame, first:first + len(block)] = np.stack(block)
+            first, block = z_idx, []
+        block.append(image.astype("float32"))
+        z_chunk = _array_chunks(self._chunks, array.shape)[1]
+        if (z_idx + 1) % z_chunk == 0 or z_idx + 1 == z_count:
+            array[frame, first:z_idx + 1] = np.stack(block)
+        else:
+            self._pending[(name, frame)] = (first, block)
+
+    def read(self, product: str, frame: int, z_idx: Optional[int] = None) -> np.ndarray:
+        """Read a product of a frame (one slice of an inline volume), FileNotFoundError if it was not written"""
+        array = self.array(product)
+        if frame >= array.shape[0]:
+            raise FileNotFoundError(f"Frame {frame} is not in {self._path}")
+        image = array[frame] if z_idx is None else array[frame, z_idx]
+        if np.isnan(image).all():
+            raise FileNotFoundError(f"Frame {frame} has not been written to {self._path}")
+        return image
+
+    def has(self, product: str, frame: int, z_idx: Optional[int] = None) -> bool:
+        """Whether a product of a frame (one slice of an inline volume) was written: its slot is not all NaN, the
+        fill value of unwritten chunks. One pixel is read first, so a written slot costs one chunk."""
+        array = self._backend.get(ARRAY_NAMES.get(product, product))
+        if array is None or frame >= array.shape[0]:
+            return False
+        slot = (frame,) if z_idx is None else (frame, z_idx)
+        if not np.isnan(array[slot + (0, 0)]):
+            return True
+        return not np.isnan(array[slot]).all()
+
+    def z_column(self, t: int, y: int, x: int, product: str = "inline_frame") -> np.ndarray:
+        return self.array(product)[t, :, y, x]
+
+    def time_series(self, z: int, y: int, x: int, product: str = "inline_frame") -> np.ndarray:
+        return self.array(product)[:, z, y, x]
+
+    def set_attrs(self, **attrs) -> None:
+        self._backend.attrs().update(attrs)
+
+    def get_attrs(self) -> Dict[str, Any]:
+        return dict(self._backend.attrs())
+
+    def flush(self) -> None:
+        """Write the slices of incomplete z chunks, e.g. of a frame interrupted by the blocking call"""
+        for (name, frame), (first, block) in self._pending.items():
+            self._backend.get(name)[frame, first:first + len(block)] = np.stack(block)
+        self._pending = {}
+
+    def close(self) -> None:
+        self.flush()
+        self._backend.close()
+
+
+def open_volume_store(path: str) -> VolumeStore:
+    """Open a store written by HoloGram for reading"""
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    return VolumeStore(path, mode="r")
@@ -1,7 +1,6 @@
 import os, sys
 from typing import Any, Optional, Tuple
 
-from PyQt5 import uic
 from PyQt5.QtWidgets import QApplication, QMainWindow, QSpacerItem, QSizePolicy
 from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtGui import QFont, QFontDatabase, QIcon
@@ -9,9 +8,11 @@ from gui.spoiler_widgets import Spoiler
 
 from gui import APP_NAME
 from gui.gui_threading import Scheduler
+from gui.ui_loader import load_ui
 import gui.dialog as dialog
+import matplotlib
+from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas, NavigationToolbar2QT as NavigationToolbar
-import matplotlib.pyplot as plt
 
 from dhm.core import HoloGram
 
@@ -26,7 +27,7 @@ class Launcher(QMainWindow):
 
     def __init__(self) -> None:
         super(Launcher, self).__init__()  # Call the inherited classes __init__ method
-        uic.loadUi(f'{source_dir}/ui_files/launcher_window.ui', self)  # Load the .ui file
+        load_ui(f'{source_dir}/ui_files/launcher_window.ui', self)  # Load the (cached) .ui file
 
         self.off_axis_TDHM.clicked.connect(self._launch_tdhm_std)
         self.in_line_TDHM.clicked.connect(self._launch_in_line)
@@ -42,14 +43,14 @@ class Launcher(QMainWindow):
 
 class Window (QMainWindow):
     """The bases for the Main Window class"""
-    plt.rcParams['svg.fonttype'] = 'none'
-    plt.rcParams["font.family"] = "Helvetica, sans-serif"
-    plt.rcParams["xtick.direction"] = "in"
-    plt.rcParams["ytick.direction"] = "in"
+    matplotlib.rcParams['svg.fonttype'] = 'none'
+    matplotlib.rcParams["font.family"] = "Helvetica, sans-serif"
+    matplotlib.rcParams["xtick.direction"] = "in"
+    matplotlib.rcParams["ytick.direction"] = "in"
 
     __scheduler: Optional[Scheduler] = None
     
-    _dhm = HoloGram()
+    _dhm: HoloGram
     _sp_list = []
     _name = ""
      
@@ -57,12 +58,13 @@ class Window (QMainWindow):
    
     def __init__(self) -> None:
         super(Window, self).__init__()
-        uic.loadUi(f'{source_dir}/ui_files/main_window.ui', self)  # Load the .ui file
+        self._dhm = HoloGram()
+        load_ui(f'{source_dir}/ui_files/main_window.ui', self)  # Load the (cached) .ui file
 
         self.text_info_show.setText("")
         self.setWindowTitle(APP_NAME)
         self.setBaseSize(1280, 800)
-        self.img_canvas = FigureCanvas(plt.Figure())
+        self.img_canvas = FigureCanvas(Figure())
         self.img_canvas.minimumWidth = 800
         self.img_canvas.minimumHeight = 600
         self.bar_layout.addWidget(NavigationToolbar(self.img_canvas, self))
@@ -268,6 +270,8 @@ class load_img_Spoiler(Spoiler):
         self.read_path = ''
         self.background_read_address = ''
         self.pushButton_read_add.clicked.connect(self.add_holo_read)
+        self.lineEdit_read_add.setToolTip("Directory of hologram images, a multi-page TIFF stack, "
+                                          "or a raw camera dump described in [Raw_Source] of the configuration")
         self.pushButton_background_read.clicked.connect(self.background_read)
 
     def background_read(self) -> None:
@@ -1,8 +1,8 @@
 import sys
-from PyQt5 import uic
 from PyQt5.QtWidgets import QWidget
 from PyQt5.QtGui import QFont, QFontDatabase
 from PyQt5.QtCore import Qt, pyqtSignal, QParallelAnimationGroup, QPropertyAnimation, QAbstractAnimation
+from gui.ui_loader import load_ui
 
 
 class Spoiler(QWidget):
@@ -15,8 +15,8 @@ class Spoiler(QWidget):
     
     def __init__(self, parent=None, ui_path = '', animationDuration=300):
         super(Spoiler, self).__init__(parent=parent)
-        # Load Spoiler-specific controls by imporitng the .ui file
-        uic.loadUi(ui_path, self)  
+        # Load Spoiler-specific controls by importing the (cached) .ui file
+        load_ui(ui_path, self)
 
         self.label_check.hide()
         self.label_done_text.hide()
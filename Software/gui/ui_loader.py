@@ -0,0 +1,99 @@
+"""Cached loading of the Qt Designer .ui files.
+
+Each .ui file is compiled once into a Python module in a __uicache__ folder next to it, and recompiled only when the
+.ui file is newer. The compiled form classes are also kept per process, so rebuilding the spoilers on a mode switch
+does not parse any XML. Run `python -m gui.ui_loader` to precompile all forms, e.g. after editing them in Designer.
+"""
+import os
+import importlib.util
+from typing import Dict, Optional
+
+from PyQt5 import uic
+from PyQt5.QtWidgets import QWidget
+
+_CACHE_DIR_NAME = "__uicache__"
+_UI_FILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ui_files")
+
+_form_classes: Dict[str, type] = {}
+
+
+def _compiled_path(ui_path: str) -> str:
+    """Location of the compiled module for the given .ui file"""
+    ui_dir, ui_name = os.path.split(ui_path)
+    return os.path.join(ui_dir, _CACHE_DIR_NAME, os.path.splitext(ui_name)[0] + "_ui.py")
+
+
+def _is_up_to_date(ui_path: str, py_path: str) -> bool:
+    try:
+        return os.path.getmtime(py_path) >= os.path.getmtime(ui_path)
+    except OSError:
+        return False
+
+
+def compile_ui(ui_path: str) -> Optional[str]:
+    """Compile the .ui file into the cache folder, return the module path or None if the folder is not writable"""
+    py_path = _compiled_path(ui_path)
+    tmp_path = f"{py_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(py_path), exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as py_file:
+            uic.compileUi(ui_path, py_file)
+        os.replace(tmp_path, py_path)  # Atomic, so that a concurrent launch never imports half a module
+        return py_path
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+
+def _import_form_class(py_path: str) -> type:
+    """Import the compiled module and return its (single) Ui_ form class"""
+    module_name = "_uicache_" + os.path.splitext(os.path.basename(py_path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, py_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for name, value in vars(module).items():
+        if name.startswith("Ui_") and isinstance(value, type):
+            return value
+    raise ImportError(f"No form class found in {py_path}")
+
+
+def get_form_class(ui_path: str) -> type:
+    """Return the form class of a .ui file, compiling it on first use"""
+    ui_path = os.path.abspath(ui_path)
+    form_class = _form_classes.get(ui_path)
+    if form_class is not None:
+        return form_class
+
+    py_path = _compiled_path(ui_path)
+    if not _is_up_to_date(ui_path, py_path):
+        py_path = compile_ui(ui_path)
+    if py_path is not None:
+        form_class = _import_form_class(py_path)
+    else:
+        # Read-only install, compile in memory instead
+        form_class, _ = uic.loadUiType(ui_path)
+    _form_classes[ui_path] = form_class
+    return form_class
+
+
+def load_ui(ui_path: str, widget: QWidget) -> QWidget:
+    """Drop-in replacement of uic.loadUi(ui_path, widget): build the form on the widget and expose all its
+    child widgets and layouts as attributes of the widget."""
+    form = get_form_class(ui_path)()
+    form.setupUi(widget)
+    for name, value in vars(form).items():
+        setattr(widget, name, value)
+    return widget
+
+
+def precompile_all(ui_dir: str = _UI_FILES_DIR) -> None:
+    """Compile every .ui file of the given folder into the cache"""
+    for file in sorted(os.listdir(ui_dir)):
+        if file.lower().endswith(".ui"):
+            ui_path = os.path.join(ui_dir, file)
+            print(f"{file} -> {compile_ui(ui_path)}")
+
+
+if __name__ == "__main__":
+    precompile_all()
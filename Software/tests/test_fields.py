@@ -0,0 +1,66 @@
+"""The field store of a series is found again before its averaged background is loaded."""
+import os
+import shutil
+import sys
+from dhm import core, fields
+from benchmarks import synthetic
+
+SHAPE = (128, 128)
+FRAMES = 2
+
+
+def _hologram(directory: str) -> core.HoloGram:
+    synthetic.write_series(directory, "Offaxis", SHAPE, frames=FRAMES)
+    background_dir = os.path.join(directory, "background")
+    os.makedirs(background_dir)
+    for index in range(3):
+        shutil.copy(os.path.join(directory, "background.tiff"), os.path.join(background_dir, f"{index}.tiff"))
+    hologram = core.HoloGram()
+    hologram.set_dhm_mode("Offaxis")
+    hologram.set_sys_param(1.85, 1.85, 1.52, 20, 635)
+    hologram.set_filter_param(20, "Hann", 120, "1")
+    hologram.set_diffraction_dist(5.0)
+    hologram.set_read_path(os.path.join(directory, "holograms"))
+    hologram.set_back_path(background_dir)
+    hologram.set_background_img()
+    hologram.load_series()
+    os.makedirs(os.path.join(directory, "out"))
+    hologram.set_save_path(os.path.join(directory, "out"))
+    hologram.set_save_flags(True, False, False, False)
+    hologram.set_field_store_param(True, False)
+    return hologram
+
+
+def test_store_path_without_loaded_background(tmp_path):
+    hologram = _hologram(str(tmp_path))
+    for holo_num in range(FRAMES):
+        hologram.hologram_process(holo_num, False)
+    hologram.close_outputs()
+
+    fresh = core.HoloGram()
+    fresh.set_dhm_mode("Offaxis")
+    fresh.set_sys_param(1.85, 1.85, 1.52, 20, 635)
+    fresh.set_filter_param(20, "Hann", 120, "1")
+    fresh.set_diffraction_dist(5.0)
+    fresh.set_read_path(hologram.get_read_path())
+    fresh.set_back_path(hologram.get_back_path())
+    fresh.load_series()
+    fresh.set_save_path(hologram.get_save_path())
+    fresh.set_field_store_param(True, False)
+    assert fresh.get_background_identity() == hologram.get_background_identity()
+    assert fresh.get_field_store_path() == hologram.get_field_store_path()
+
+
+def test_cli_repropagates(tmp_path, monkeypatch, capsys):
+    hologram = _hologram(str(tmp_path))
+    for holo_num in range(FRAMES):
+        hologram.hologram_process(holo_num, False)
+    hologram.close_outputs()
+    receipt = os.path.join(str(tmp_path), "receipt.ini")
+    hologram._dump_config_receipt(receipt)
+
+    out = os.path.join(str(tmp_path), "refocused")
+    monkeypatch.setattr(sys, "argv", ["dhm.fields", receipt, "--distance", "8.0", "--save-path", out])
+    fields.main()
+    assert f"Repropagated {FRAMES} frames" in capsys.readouterr().out
+    assert len(os.listdir(out)) >= FRAMES
@@ -0,0 +1,91 @@
+"""Incremental reprocessing rewrites the outputs that are recorded in the build log but gone from the save path."""
+import os
+import glob
+import shutil
+import numpy as np
+import pytest
+from dhm import core, quantize, stacks, volume_store
+from benchmarks import synthetic
+
+SHAPE = (128, 128)
+FRAMES = 2
+
+
+def _hologram(directory: str, output_format: str) -> core.HoloGram:
+    synthetic.write_series(directory, "Offaxis", SHAPE, frames=FRAMES)
+    hologram = core.HoloGram()
+    hologram.set_dhm_mode("Offaxis")
+    hologram.set_sys_param(1.85, 1.85, 1.52, 20, 635)
+    hologram.set_filter_param(20, "Hann", 120, "1")
+    hologram.set_diffraction_dist(5.0)
+    hologram.set_read_path(os.path.join(directory, "holograms"))
+    hologram.set_back_path(os.path.join(directory, "background.tiff"))
+    hologram.set_background_img()
+    hologram.load_series()
+    os.makedirs(os.path.join(directory, "out"), exist_ok=True)
+    hologram.set_save_path(os.path.join(directory, "out"))
+    hologram.set_output_format(output_format)
+    hologram.set_incremental(True)
+    hologram.set_save_flags(True, True, True, False)
+    return hologram
+
+
+def _process(hologram: core.HoloGram) -> None:
+    for holo_num in range(FRAMES):
+        hologram.hologram_process(holo_num, False)
+    hologram.close_outputs()
+
+
+def _read(save_path: str, output_format: str, holo_num: int) -> np.ndarray:
+    if output_format == "stack":
+        return stacks.read_stack_frame(save_path, "phase_map", holo_num)
+    if output_format == "zarr":
+        return volume_store.open_volume_store(os.path.join(save_path, volume_store.store_name("zarr"))).read(
+            "phase_map", holo_num)
+    return quantize.read_physical(os.path.join(save_path, f"{holo_num}_phase_map.tiff"))
+
+
+@pytest.mark.parametrize("output_format", ["files", "stack", "zarr"])
+def test_deleted_outputs_are_rewritten(tmp_path, output_format):
+    if output_format == "zarr":
+        pytest.importorskip("zarr")
+    hologram = _hologram(str(tmp_path), output_format)
+    save_path = hologram.get_save_path()
+    _process(hologram)
+    saved = [_read(save_path, output_format, holo_num) for holo_num in range(FRAMES)]
+
+    for path in glob.glob(os.path.join(save_path, "*")):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.basename(path) != "dhm_build.log":
+            os.remove(path)
+    _process(hologram)
+
+    for holo_num in range(FRAMES):
+        np.testing.assert_allclose(_read(save_path, output_format, holo_num), saved[holo_num], atol=1e-6)
+
+
+def test_frames_are_reconstructed_without_save_flags(tmp_path):
+    hologram = _hologram(str(tmp_path), "files")
+    _process(hologram)
+    hologram.set_save_flags(False, False, False, False)
+    hologram.hologram_process(0, False)
+    first = hologram.PHASE_MAP.copy()
+    hologram.hologram_process(1, False)
+    assert hologram.PHASE_MAP.shape == SHAPE
+    assert not np.array_equal(hologram.PHASE_MAP, first)
+
+
+def test_volume_store_ignores_tiff_settings(tmp_path):
+    pytest.importorskip("zarr")
+    hologram = _hologram(str(tmp_path), "zarr")
+    _process(hologram)
+    keys = hologram._product_keys(0, core.HoloGram._OFFAXIS_PRODUCTS, hologram.get_params())
+
+    hologram.set_output_dtype("phase_map", "uint16")
+    hologram.set_compression_param("phase_map", "deflate", 6, False)
+    assert hologram._product_keys(0, core.HoloGram._OFFAXIS_PRODUCTS, hologram.get_params()) == keys
+    hologram.set_incremental(False)
+    with pytest.warns(UserWarning, match="phase_map_dtype = uint16"):
+        hologram.hologram_process(0, False)
+    hologram.close_outputs()
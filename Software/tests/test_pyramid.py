@@ -0,0 +1,48 @@
+"""Reduced pyramid levels of quantized maps leave NaN pixels out of the block means."""
+import os
+import numpy as np
+import pytest
+from dhm import pyramid, quantize
+
+
+def _phase_map() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    image = rng.uniform(0.0, 3.0, (64, 64)).astype(np.float32)
+    image[0, 0] = 3.0
+    image[5, 7] = np.nan
+    image[10:12, 20:22] = np.nan  # A whole 2x2 block
+    return image
+
+
+def _expected_level(image: np.ndarray) -> np.ndarray:
+    blocks = image.reshape(image.shape[0] // 2, 2, image.shape[1] // 2, 2)
+    with np.errstate(invalid="ignore"), pytest.warns(RuntimeWarning):
+        return np.nanmean(blocks, axis=(1, 3))
+
+
+@pytest.mark.parametrize("dtype", ["float32", "uint16"])
+def test_level_is_nan_aware_block_mean(tmp_path, dtype):
+    image = _phase_map()
+    stored, quantization = quantize.quantize(image, dtype, quantize.phase_step("phase_map", 1.0))
+    path = os.path.join(str(tmp_path), "0_phase_map.tiff")
+    pyramid.write_pyramid(path, stored, min_size=16, description=quantize.description(quantization), metadata=None)
+
+    level, full_shape = pyramid.read_level(path, (32, 32))
+    expected = _expected_level(image)
+    assert full_shape == (64, 64)
+    assert level.shape == (32, 32)
+    np.testing.assert_array_equal(np.isnan(level), np.isnan(expected))
+    np.testing.assert_allclose(level, expected, atol=2e-3, equal_nan=True)
+    assert np.nanmax(level) <= np.nanmax(image)
+
+
+def test_int16_complex_level_keeps_nan_code():
+    image = _phase_map()
+    intensity = np.ones_like(image)
+    stored, quantization = quantize.quantize(image, "int16_complex", intensity=intensity)
+
+    reduced = pyramid.downsample(stored, quantization.nan_code)
+    field = quantize.dequantize_field(reduced, quantization)
+    assert np.isnan(field[5, 10])
+    assert np.isfinite(field[2, 3])
+    assert (np.abs(field[np.isfinite(field)]) <= 1.0 + 1e-3).all()
@@ -0,0 +1,72 @@
+"""Quantized outputs give back their physical values, NaN pixels included."""
+import os
+import numpy as np
+import pytest
+import tifffile as tf
+from dhm import quantize
+
+SHAPE = (32, 48)
+
+
+def _image() -> np.ndarray:
+    rng = np.random.default_rng(1)
+    image = rng.uniform(-4.0, 9.0, SHAPE).astype(np.float32)
+    image[3, 4] = np.nan
+    image[20:22, 30:40] = np.nan
+    return image
+
+
+@pytest.mark.parametrize("dtype, atol", [("float32", 0.0), ("float16", 1e-2), ("uint16", None)])
+def test_round_trip(dtype, atol):
+    image = _image()
+    step = quantize.phase_step("phase_map", 1.0)
+    stored, quantization = quantize.quantize(image, dtype, step)
+    restored = quantize.dequantize(stored, quantization)
+    np.testing.assert_array_equal(np.isnan(restored), np.isnan(image))
+    np.testing.assert_allclose(restored, image, atol=step / 2 + 1e-6 if atol is None else atol, equal_nan=True)
+
+
+def test_uint16_reserves_nan_code():
+    image = _image()
+    stored, quantization = quantize.quantize(image, "uint16")
+    assert quantization.nan_code == quantize.UINT16_NAN
+    assert (stored[np.isnan(image)] == quantize.UINT16_NAN).all()
+    assert stored[~np.isnan(image)].max() == quantize.UINT16_NAN - 1
+
+
+def test_uint16_wide_range_widens_step():
+    image = np.linspace(0.0, 1000.0, 64, dtype=np.float32).reshape(8, 8)
+    stored, quantization = quantize.quantize(image, "uint16", quantize.phase_step("phase_map", 1.0))
+    assert quantization.scale > quantize.phase_step("phase_map", 1.0)
+    np.testing.assert_allclose(quantize.dequantize(stored, quantization), image, atol=quantization.scale / 2 + 1e-4)
+
+
+def test_int16_complex_round_trip():
+    image = _image()
+    intensity = np.random.default_rng(2).uniform(0.5, 2.0, SHAPE).astype(np.float32)
+    wrapped = np.angle(np.exp(1j * image)).astype(np.float32)
+    stored, quantization = quantize.quantize(wrapped, "int16_complex", intensity=intensity)
+    assert stored.shape == SHAPE + (2,)
+    assert quantization.nan_code == quantize.INT16_NAN
+    field = quantize.dequantize_field(stored, quantization)
+    valid = ~np.isnan(image)
+    np.testing.assert_array_equal(np.isnan(field), ~valid)
+    np.testing.assert_allclose(np.abs(field[valid]) ** 2, intensity[valid], rtol=2e-3, atol=1e-3)
+    phase = quantize.dequantize(stored, quantization)
+    assert np.abs(np.angle(np.exp(1j * (phase[valid] - wrapped[valid])))).max() < 2e-3
+
+
+def test_read_physical(tmp_path):
+    image = _image()
+    stored, quantization = quantize.quantize(image, "uint16", quantize.phase_step("height_map", 4.0))
+    path = os.path.join(str(tmp_path), "0_height_map.tiff")
+    tf.imwrite(path, stored, description=quantize.description(quantization), metadata=None)
+    restored = quantize.read_physical(path)
+    np.testing.assert_allclose(restored, quantize.dequantize(stored, quantization), equal_nan=True)
+
+
+def test_description_without_nan_code():
+    old = quantize.from_description('{"quantization": {"dtype": "uint16", "scale": 0.5, "offset": 1.0}}')
+    assert old.nan_code is None
+    np.testing.assert_array_equal(quantize.dequantize(np.array([65535], np.uint16), old), [65535 * 0.5 + 1.0])
+    assert quantize.from_description(None) == quantize.Quantization()
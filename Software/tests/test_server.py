@@ -0,0 +1,77 @@
+"""Server key file rules and loopback-only TCP addresses."""
+import os
+import stat
+import sys
+import pytest
+from dhm import server
+
+
+@pytest.fixture
+def key_path(tmp_path, monkeypatch):
+    path = os.path.join(str(tmp_path), ".dhm_authkey")
+    monkeypatch.setattr(server, "AUTHKEY_PATH", path)
+    monkeypatch.delenv("DHM_AUTHKEY", raising=False)
+    return path
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="POSIX file modes")
+def test_server_creates_private_key(key_path):
+    key = server.default_authkey(create=True)
+    assert len(key) == 64
+    assert stat.S_IMODE(os.stat(key_path).st_mode) == 0o600
+    assert server.default_authkey() == key  # Clients read the same key
+    assert server.default_authkey(create=True) == key  # Not replaced by the next server
+
+
+def test_client_without_key(key_path):
+    with pytest.raises(FileNotFoundError):
+        server.default_authkey()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="POSIX file modes")
+@pytest.mark.parametrize("mode", [0o640, 0o604, 0o644])
+def test_key_readable_by_others_is_rejected(key_path, mode):
+    server.default_authkey(create=True)
+    os.chmod(key_path, mode)
+    with pytest.raises(PermissionError):
+        server.default_authkey()
+    with pytest.raises(PermissionError):
+        server.default_authkey(create=True)
+
+
+def test_environment_key(key_path, monkeypatch):
+    monkeypatch.setenv("DHM_AUTHKEY", "secret")
+    assert server.default_authkey(create=True) == b"secret"
+    assert not os.path.exists(key_path)
+
+
+@pytest.mark.parametrize("address, expected", [("127.0.0.1:5757", ("127.0.0.1", 5757)), (":5757", ("127.0.0.1", 5757)),
+                                               ("localhost:80", ("localhost", 80)), ("[::1]:5757", ("::1", 5757)),
+                                               ("/tmp/dhm.sock", "/tmp/dhm.sock")])
+def test_loopback_addresses(address, expected):
+    assert server.parse_address(address) == expected
+
+
+@pytest.mark.parametrize("address", ["0.0.0.0:5757", "192.168.1.20:5757", "dhm-node:5757", "[::]:5757"])
+def test_remote_host_is_rejected(address):
+    with pytest.raises(ValueError):
+        server.parse_address(address)
+    assert server.parse_address(address, allow_remote=True)[1] == 5757
+
+
+def test_cli_rejects_remote_host(key_path, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        server.main(["--address", "0.0.0.0:5757"])
+    assert exit_info.value.code == 1
+    assert "not a loopback address" in capsys.readouterr().err
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Unix sockets")
+def test_path_that_is_not_a_socket_is_kept(tmp_path, key_path):
+    path = os.path.join(str(tmp_path), "dhm.sock")
+    with open(path, "w") as text_file:
+        text_file.write("data")
+    with pytest.raises(FileExistsError):
+        server.ReconServer(path, b"key").serve_forever()
+    with open(path) as text_file:
+        assert text_file.read() == "data"
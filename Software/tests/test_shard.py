@@ -0,0 +1,54 @@
+"""Chunk claims: stale claims are taken over by exactly one worker, which the previous owner notices."""
+import os
+import time
+from dhm.shard import ShardQueue
+
+
+def _expire(queue: ShardQueue, chunk: int) -> None:
+    claim_path = queue._claim_path(chunk, queue._generation(chunk))
+    past = time.time() - 3600
+    os.utime(claim_path, (past, past))
+
+
+def test_claim_is_exclusive(tmp_path):
+    first, second = ShardQueue(str(tmp_path), "node1"), ShardQueue(str(tmp_path), "node2")
+    assert first.claim(0)
+    assert not second.claim(0)
+    assert first.owns(0) and not second.owns(0)
+    assert first.claimed_by(0)[0] == "node1"
+
+
+def test_stale_claim_takeover_creates_next_generation(tmp_path):
+    first, second, third = (ShardQueue(str(tmp_path), name, lease=60.0) for name in ("node1", "node2", "node3"))
+    assert first.claim(0)
+    _expire(first, 0)
+    assert second.claim(0)
+    assert not third.claim(0)  # Raced for the same stale claim, the next generation exists already
+    assert second._generation(0) == 1
+    assert second.owns(0)
+    assert second.claimed_by(0)[0] == "node2"
+
+
+def test_owner_loses_chunk_after_takeover(tmp_path):
+    first, second = ShardQueue(str(tmp_path), "node1", lease=60.0), ShardQueue(str(tmp_path), "node2", lease=60.0)
+    assert first.claim(0)
+    _expire(first, 0)
+    assert second.claim(0)
+    assert not first.owns(0)
+    assert not first.renew(0)
+    assert not first.complete(0, {"frames": []})
+    assert not first.is_done(0)
+
+    assert second.renew(0)
+    assert second.complete(0, {"frames": [0]})
+    assert second.record(0) == {"frames": [0]}
+    assert second._generation(0) == -1  # Claims of every generation released
+    assert not first.claim(0)
+
+
+def test_done_chunk_is_not_claimed(tmp_path):
+    first, second = ShardQueue(str(tmp_path), "node1"), ShardQueue(str(tmp_path), "node2")
+    assert first.claim(3)
+    assert first.complete(3, {})
+    assert not second.claim(3)
+    assert second.claimed_by(3) is None
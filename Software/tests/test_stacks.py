@@ -0,0 +1,137 @@
+"""Stack outputs: index, reads at the recorded offsets, rebuilds after a crash, and ROI reads of TIFF inputs."""
+import os
+import numpy as np
+import pytest
+import tifffile as tf
+from dhm import compression, quantize, sources, stacks, tiff_io
+
+SHAPE = (40, 56)
+FRAMES = 4
+
+
+def _frame(frame: int) -> np.ndarray:
+    image = np.random.default_rng(frame).uniform(-3.0, 3.0, SHAPE).astype(np.float32)
+    image[frame, frame] = np.nan
+    return image
+
+
+def _write(stack_path: str, dtype: str, codec: str = "none") -> None:
+    writer = stacks.StackWriter(stack_path, compression.tiff_kwargs(compression.parse_codec(codec)))
+    for frame in range(FRAMES):
+        writer.write(frame, 0, *quantize.quantize(_frame(frame), dtype, quantize.phase_step("phase_map", 1.0)))
+    writer.close()
+
+
+def _entries(stack_path: str) -> dict:
+    with open(stack_path + stacks.INDEX_SUFFIX) as index_file:
+        return dict(stacks._parse_entry(line) for line in index_file)
+
+
+@pytest.mark.parametrize("codec", ["none", "deflate"])
+@pytest.mark.parametrize("dtype", ["float32", "uint16"])
+def test_read_frames(tmp_path, codec, dtype):
+    stack_path = os.path.join(str(tmp_path), stacks.stack_name("phase_map"))
+    _write(stack_path, dtype, codec)
+    reader = stacks.StackReader(stack_path)
+    for frame in range(FRAMES):
+        expected = quantize.dequantize(*quantize.quantize(_frame(frame), dtype, quantize.phase_step("phase_map", 1.0)))
+        np.testing.assert_array_equal(reader.read(frame), expected)
+
+
+def test_index_records_ifd_offsets(tmp_path):
+    stack_path = os.path.join(str(tmp_path), stacks.stack_name("phase_map"))
+    _write(stack_path, "uint16", "deflate")
+    entries = _entries(stack_path)
+    with tf.TiffFile(stack_path) as tif:
+        assert [entries[(frame, 0)].ifd for frame in range(FRAMES)] == [page.offset for page in tif.pages]
+        assert [entries[(frame, 0)].page for frame in range(FRAMES)] == list(range(FRAMES))
+    assert all(entry.offset == -1 for entry in entries.values())  # Compressed pages are parsed at their IFD
+
+
+def test_compressed_page_read_at_ifd(tmp_path, monkeypatch):
+    stack_path = os.path.join(str(tmp_path), stacks.stack_name("phase_map"))
+    _write(stack_path, "float32", "deflate")
+
+    def no_walk(*args, **kwargs):
+        raise AssertionError("the IFD chain was walked")
+
+    reader = stacks.StackReader(stack_path)
+    reader.refresh()
+    monkeypatch.setattr(tf.TiffPages, "__getitem__", no_walk)
+    np.testing.assert_array_equal(reader.read(FRAMES - 1), _frame(FRAMES - 1))
+
+
+def test_reprocessed_frame_reads_newest_page(tmp_path):
+    stack_path = os.path.join(str(tmp_path), stacks.stack_name("phase_map"))
+    _write(stack_path, "float32")
+    writer = stacks.StackWriter(stack_path)
+    writer.write(1, 0, np.zeros(SHAPE, np.float32))
+    writer.close()
+    np.testing.assert_array_equal(stacks.read_stack_frame(str(tmp_path), "phase_map", 1), 0.0)
+    assert _entries(stack_path)[(1, 0)].page == FRAMES
+
+
+def test_missing_index_is_rebuilt(tmp_path):
+    stack_path = os.path.join(str(tmp_path), stacks.stack_name("phase_map"))
+    _write(stack_path, "uint16", "deflate")
+    written = _entries(stack_path)
+    os.remove(stack_path + stacks.INDEX_SUFFIX)
+    restored = stacks.StackReader(stack_path).read(2)
+    np.testing.assert_array_equal(np.isnan(restored), np.isnan(_frame(2)))
+    assert _entries(stack_path) == written
+
+
+def test_writer_rebuilds_index_missing_pages(tmp_path):
+    """A crash between writing a page and indexing it: the reopened writer numbers pages from the stack"""
+    stack_path = os.path.join(str(tmp_path), stacks.stack_name("phase_map"))
+    _write(stack_path, "float32")
+    index_path = stack_path + stacks.INDEX_SUFFIX
+    with open(index_path) as index_file:
+        lines = index_file.readlines()
+    with open(index_path, "w") as index_file:
+        index_file.writelines(lines[:-1])
+        index_file.write(lines[-1][:5])  # Partial line
+
+    writer = stacks.StackWriter(stack_path)
+    writer.write(FRAMES, 0, _frame(FRAMES))
+    writer.close()
+    entries = _entries(stack_path)
+    assert entries[(FRAMES - 1, 0)].page == FRAMES - 1
+    assert entries[(FRAMES, 0)].page == FRAMES
+    for frame in range(FRAMES + 1):
+        np.testing.assert_array_equal(stacks.read_stack_frame(str(tmp_path), "phase_map", frame), _frame(frame))
+
+
+def test_index_without_ifd_offsets(tmp_path):
+    stack_path = os.path.join(str(tmp_path), stacks.stack_name("phase_map"))
+    _write(stack_path, "uint16", "deflate")
+    index_path = stack_path + stacks.INDEX_SUFFIX
+    with open(index_path) as index_file:
+        lines = [line.split() for line in index_file]
+    with open(index_path, "w") as index_file:  # Format before IFD offsets and NaN codes were recorded
+        index_file.writelines(" ".join(fields[:3] + fields[4:12]) + "\n" for fields in lines)
+
+    reader = stacks.StackReader(stack_path)
+    reader.refresh()
+    assert reader._entries[(2, 0)].ifd == -1
+    np.testing.assert_array_equal(np.isnan(reader.read(2)), False)
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"compression": "zlib", "rowsperstrip": 8},
+                                    {"compression": "zlib", "tile": (16, 16)}])
+def test_roi_reads(tmp_path, kwargs):
+    image = np.arange(100 * 120, dtype=np.uint16).reshape(100, 120)
+    path = os.path.join(str(tmp_path), "0.tiff")
+    tf.imwrite(path, image, **kwargs)
+    for roi in [(10, 50, 20, 90), (0, 100, 0, 120), (95, 140, 110, 130), (30, 30, 0, 10)]:
+        np.testing.assert_array_equal(tiff_io.read_region(path, roi), image[roi[0]:roi[1], roi[2]:roi[3]])
+
+    stack_path = os.path.join(str(tmp_path), "stack.tiff")
+    with tf.TiffWriter(stack_path) as tif:
+        for frame in range(3):
+            tif.write(image + frame, **kwargs)
+    source = sources.TiffStackSource(stack_path, prefetch_depth=0)
+    try:
+        np.testing.assert_array_equal(source.read(2, (10, 50, 20, 90)), image[10:50, 20:90] + 2)
+    finally:
+        source.close()
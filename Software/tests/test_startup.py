@@ -0,0 +1,15 @@
+"""import dhm.core stays free of the dependencies that are slow to import."""
+import os
+import subprocess
+import sys
+
+SOFTWARE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_core_defers_tiff_codecs():
+    code = ("import sys, dhm.core; "
+            "print(sorted(name for name in ('tifffile', 'imagecodecs', 'skimage', 'matplotlib', 'PIL') "
+            "if name in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=SOFTWARE_DIR, capture_output=True, text=True,
+                            check=True)
+    assert result.stdout.strip() == "[]"
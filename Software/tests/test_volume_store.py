@@ -0,0 +1,26 @@
+"""Slices of inline volumes land at their own z index, also when only some of them are written."""
+import os
+import numpy as np
+import pytest
+from dhm import volume_store
+
+SHAPE = (8, 8)
+Z_COUNT = 8
+
+
+@pytest.mark.parametrize("backend", ["zarr", "hdf5"])
+def test_non_contiguous_slices(tmp_path, backend):
+    pytest.importorskip("zarr" if backend == "zarr" else "h5py")
+    path = os.path.join(str(tmp_path), volume_store.store_name(backend))
+    store = volume_store.VolumeStore(path)
+    for z_idx in (2, 5, 6, 7):
+        store.write("refocused_volume", 0, np.full(SHAPE, z_idx, np.float32), z_idx, z_count=Z_COUNT)
+    store.close()
+
+    store = volume_store.open_volume_store(path)
+    for z_idx in range(Z_COUNT):
+        if z_idx in (2, 5, 6, 7):
+            np.testing.assert_array_equal(store.read("refocused_volume", 0, z_idx), z_idx)
+        else:
+            assert not store.has("refocused_volume", 0, z_idx)
+    store.close()
@@ -1,10 +1,14 @@
+from typing import Optional, Tuple
 import numpy as np
-from skimage import exposure
 from matplotlib import patches
 
 from gui.main_window import Window
 from gui.dialog import popup_message
 from visualizer import Visualizer
+from visualizer import contrast
+from visualizer.renderer import ImageRenderer
+from visualizer.display_cache import DisplayCache, display_buffer
+from visualizer.preview import PreviewPipe
 
 class AbstractImageVisualizer(Visualizer):
     """Some Abstractions of Standard image visualizer."""
@@ -12,6 +16,11 @@ class AbstractImageVisualizer(Visualizer):
     ROI_LIST = []
     _img_buf = np.ndarray(shape=(3000, 4000), dtype=np.uint16)
     _cmap = 'gist_gray'
+    _img_extent = None # full-resolution extent of an image loaded at a reduced pyramid level
+    _img_full_shape = None # full-resolution shape of the image on display
+    _contrast = None # contrast stats of the image on display
+    _worker_contrast = None # contrast stats prepared with the preview of the next frame to show
+    _preview_buffer = None # display buffer and full shape of the next frame to show, prepared off the GUI thread
     _text_info_show_misc = ""
     _total_img = 0
     # _viewer_events = {"set_param", "load_config", "load_sources", "set_roi", "set_saving", "processing"}
@@ -22,6 +31,7 @@ class AbstractImageVisualizer(Visualizer):
         "Hologram" : "hologram",
         "Wrapped Phase" : "wrapped_phase",
         "FFT Filter" : "fft_filter",
+        "Spectrum" : "spectrum",
         "Reconstructed Map" : "refocused_volume",
         "Phase map" : "phase_map",
         "Height map": "height_map",
@@ -31,10 +41,16 @@ class AbstractImageVisualizer(Visualizer):
     def __init__(self, window: Window) -> None:
         """Initialize main window assets"""
         super().__init__(window)
+        self._renderer = ImageRenderer(self._ax)
+        self._display_cache = DisplayCache()
+        self._locked_contrast = {} # image type: stats kept across the series while contrast is locked
         self._window.spinBox_select_img.textChanged.connect(self._signal_canvas_update)
         self._window.relink_all.connect(self._link_sp_signals)
         self._window.load_config.connect(self._load_config)
         self._window.dump_config.connect(self._dump_config)
+        self._window.actionLive_Imaging.triggered.connect(self._live_process)
+        self._window.actionLock_Contrast.toggled.connect(self._lock_contrast)
+        self._fig.canvas.mpl_connect('button_press_event', self._on_mouse_click)
 
     def load_canvas(self) -> None:
         """load image ndarray from HoloGram by copying onto a buffer,
@@ -43,9 +59,10 @@ class AbstractImageVisualizer(Visualizer):
 
         self._img_types = {
             "background":       lambda _: self._dhm().BACKGROUND,
-            "hologram":         lambda _: self._dhm().HOLOGRAM,
+            "hologram":         lambda _: self._dhm().get_hologram_img(),
             "wrapped_phase":    lambda _: self._dhm().WRAPPED_PHASE,
             "fft_filter" :      lambda _: self._dhm().FOURIER_FILTER,
+            "spectrum" :        lambda _: self._dhm().SPECTRUM,
             "refocused_volume": lambda _: self._dhm().REFOCUSED_VOLUME,
             "phase_map":        lambda _: self._dhm().PHASE_MAP,
             "height_map":       lambda _: self._dhm().HEIGHT_MAP,
@@ -75,9 +92,16 @@ class AbstractImageVisualizer(Visualizer):
                     str([k for k,v in self._img_type_str_mapper.items() if v == self._img_type_on_display][0]) +
                     f", {self._img_idx_on_display+1} out of {self._total_img} from the folder. " + ("" if self._text_info_show_misc == "" else "\n") +
                     self._text_info_show_misc)
+        elif self._current_viewer_event == "live":
+            self._window.text_info_show.setText(f"Live imaging: viewing {self._img_idx_on_display+1}" +
+                f" out of {self._total_img} images in the folder. {self._text_info_show_misc}")
         
-        self._img_buf = exposure.equalize_hist(self._img_types[self._img_type_on_display](1)) if self._img_type_on_display == "refocused_volume" else \
-                        exposure.rescale_intensity(self._img_types[self._img_type_on_display](1))
+        self._img_buf, full_shape = self._display_image()
+        self._img_extent = None
+        self._img_full_shape = self._img_buf.shape[:2] if full_shape is None else tuple(full_shape[:2])
+        if full_shape is not None and full_shape != self._img_buf.shape[:2]:
+            self._img_extent = [-0.5, full_shape[1]-0.5, full_shape[0]-0.5, -0.5]
+        self._contrast = self._display_contrast()
         self._cmap = 'magma_r' if self._img_type_on_display == "height_map" else 'gist_heat_r' if self._img_type_on_display == "refocused_volume" else 'gist_gray'
         self.draw_view()
         if len(self.ROI_LIST) > 0:
@@ -86,25 +110,131 @@ class AbstractImageVisualizer(Visualizer):
     def _load_2d_image(self) -> None:
         self.draw_view()
 
+    def _scaled_image(self, image: np.ndarray) -> np.ndarray:
+        """Contrast-scaled image for display, in [0, 1]"""
+        return contrast.scale(image, self._contrast or self._compute_contrast(image))
+
+    def _compute_contrast(self, image: Optional[np.ndarray] = None) -> contrast.ContrastStats:
+        """Contrast stats of an image, by default of the image of the type on display from HoloGram"""
+        if image is None:
+            image = self._img_types[self._img_type_on_display](1)
+        return contrast.compute_stats(image, equalize=self._img_type_on_display == "refocused_volume")
+
+    def _preview_pipe(self) -> PreviewPipe:
+        """Preview of the frames being processed, of the image type on display, at the rate of HoloGram; the
+        previews are reduced to the canvas resolution and their contrast stats computed on the preview thread"""
+        canvas_shape = self._canvas_shape()
+
+        def produce(frame: np.ndarray) -> tuple:
+            return display_buffer(frame, canvas_shape), frame.shape[:2], self._compute_contrast(frame)
+
+        preview = PreviewPipe(self._dhm().get_preview_param(),
+                              lambda: self._img_types[self._img_type_on_display](1), produce)
+        preview.ready.connect(lambda: self._show_preview(preview))
+        return preview
+
+    def _show_preview(self, preview: PreviewPipe) -> None:
+        """Upon slot trigger (PreviewPipe ready), show the latest prepared preview"""
+        produced = preview.take()
+        if produced is None:
+            return
+        holo_num, buffer, full_shape, self._worker_contrast = produced
+        self._preview_buffer = (buffer, full_shape)
+        self._img_idx_on_display = holo_num
+        self._window.spinBox_select_img.setValue(holo_num+1)
+        self.load_canvas()
+
+    def _display_contrast(self) -> contrast.ContrastStats:
+        """Contrast stats of the display buffer: those of its type while contrast is locked and they are set,
+        else those sent by the processing worker, else those of a subsample of the buffer"""
+        locked = self._window.actionLock_Contrast.isChecked()
+        if locked and self._img_type_on_display in self._locked_contrast:
+            stats = self._locked_contrast[self._img_type_on_display]
+        elif self._worker_contrast is not None:
+            stats = self._worker_contrast
+        else:
+            stats = self._compute_contrast(self._img_buf)
+        self._worker_contrast = None
+        if locked:
+            self._locked_contrast.setdefault(self._img_type_on_display, stats)
+        return stats
+
+    def _lock_contrast(self, checked: bool) -> None:
+        """Upon slot trigger (Lock Contrast QAction), keep the contrast of the image on display for the rest of
+        the series, or go back to the contrast of every frame"""
+        self._locked_contrast.clear()
+        if checked and self._contrast is not None:
+            self._locked_contrast[self._img_type_on_display] = self._contrast
+
+    def _display_key(self, holo_num: int) -> Optional[tuple]:
+        """Display cache key of a frame of the image type on display, None if the type is not cached: only
+        holograms are, the other images change with the processing parameters"""
+        if self._img_type_on_display != "hologram" or len(self._dhm().HOLO_LIST) == 0:
+            return None
+        return (self._dhm().get_read_path(), holo_num, self._img_type_on_display, None)
+
+    def _display_image(self) -> Tuple[np.ndarray, Optional[Tuple[int, int]]]:
+        """Display buffer of the image on display and the full-resolution shape it covers (None if it is at full
+        resolution). Cached images are reduced to the canvas resolution; when zoomed in, the full resolution is
+        shown instead."""
+        preview, self._preview_buffer = self._preview_buffer, None
+        if preview is not None and not self._renderer.is_zoomed():
+            return preview
+        key = self._display_key(self._img_idx_on_display)
+        if key is not None and not self._renderer.is_zoomed():
+            cached = self._display_cache.get(key)
+            if cached is not None:
+                return cached
+            image = self._img_types[self._img_type_on_display](1)
+            self._display_cache.put(key, display_buffer(image, self._canvas_shape()), image.shape)
+            return self._display_cache.get(key)
+        image = self._img_types[self._img_type_on_display](1)
+        output_shape = self._dhm().get_output_shape() if self._img_type_on_display == "refocused_volume" else None
+        return image, output_shape
+
+    def _prefetch_display(self, holo_num: int) -> None:
+        """Prepare the display buffers of the frames next to holo_num on the display cache worker"""
+        if self._display_key(holo_num) is None:
+            return
+        source = self._dhm().get_source()
+        canvas_shape = self._canvas_shape()
+        for num in (holo_num + 1, holo_num - 1, holo_num + 2, holo_num - 2):
+            if 0 <= num < len(self._dhm().HOLO_LIST):
+                self._display_cache.prefetch(self._display_key(num),
+                                             lambda num=num: self._read_display(source, num, canvas_shape))
+
+    @staticmethod
+    def _read_display(source, num: int, canvas_shape: Tuple[int, int]) -> tuple:
+        """Display buffer and full shape of a hologram read on the display cache worker"""
+        frame = source.read(num)
+        return display_buffer(frame, canvas_shape), frame.shape
+
     def draw_view(self) -> None:
-        self._clear_axis()
+        """Update the image in place; only the ROI overlays are removed, the image artist and zoom are kept"""
+        self._clear_overlays()
         self._ax.set_facecolor((0.2, 0.2, 0.2))
         self._draw_image()
-        self._fig.canvas.draw()
+
+    def _clear_overlays(self) -> None:
+        """Remove the ROI rectangles and labels drawn on the canvas"""
+        for artist in list(self._ax.patches) + list(self._ax.texts):
+            artist.remove()
 
     def _draw_image(self) -> None:
-        """Draw the whole image, or draw ROI with respective positioning"""
-        if self._img_type_on_display != "background" and \
-        self._img_type_on_display != "hologram" and (len(self.ROI_LIST) > 0):
+        """Draw the whole image, or draw ROI with respective positioning, at the resolution of the canvas"""
+        if self._img_type_on_display not in ("background", "hologram", "spectrum") and (len(self.ROI_LIST) > 0):
             roi = self.ROI_LIST[0]
             x0 = roi[0]; y0 = roi[1]; x1 = roi[2]; y1 = roi[3]
-            self._ax.imshow(self._img_buf,
-                            aspect='auto',
-                            origin='upper',
-                            extent=[x1, x0, y0, y1],
-                            cmap=self._cmap)
+            self._renderer.show(self._img_buf, self._cmap, extent=[x1, x0, y0, y1], aspect='auto',
+                                stats=self._contrast)
         else:
-            self._ax.imshow(self._img_buf, cmap=self._cmap)
+            self._renderer.show(self._img_buf, self._cmap, extent=self._img_extent, aspect='equal',
+                                stats=self._contrast)
+
+    def _canvas_shape(self) -> tuple:
+        """Height and width of the canvas in pixels"""
+        width, height = self._fig.get_size_inches() * self._fig.dpi
+        return int(height), int(width)
 
     def refresh_data(self) -> None:
         self._load_2d_image()  # Reload image, as image is a reconstruction of the data
@@ -145,7 +275,7 @@ class AbstractImageVisualizer(Visualizer):
         import tifffile as tf
         tf.imwrite(f"{self._dhm().get_save_path()}/live_save_" +
                     f"{self._img_idx_on_display}_{str(self._img_type_on_display)}.tiff",
-                    self._img_buf)
+                    self._scaled_image(self._img_types[self._img_type_on_display](1)))
 
     def _signal_canvas_update(self) -> None:
         """Upon slot trigger (viewer QSpinbox), enables update Qbutton"""
@@ -153,9 +283,18 @@ class AbstractImageVisualizer(Visualizer):
         self._window.pushButton_view_img.clicked.connect(self._update_canvas_img)
 
     def _update_canvas_img(self) -> None:
-        """Upon slot trigger (viewer Update image Qbutton), update canvas image"""
+        """Upon slot trigger (viewer Update image Qbutton), update canvas image; from the display cache when the
+        hologram is in it, the file is then only read when the full frame is needed"""
         holo_num = self._window.spinBox_select_img.value()-1
-        self._load_from_hololist(holo_num)
+        self._img_type_on_display = "hologram"
+        key = self._display_key(holo_num)
+        if key is not None and not self._renderer.is_zoomed() and self._display_cache.get(key) is not None:
+            self._img_idx_on_display = holo_num
+            self._dhm().defer_hologram_img(holo_num)
+            self.load_canvas()
+        else:
+            self._load_from_hololist(holo_num)
+        self._prefetch_display(holo_num)
         self._draw_all_roi()
         self._window.pushButton_view_img.setEnabled(False)
 
@@ -167,4 +306,4 @@ class AbstractImageVisualizer(Visualizer):
                         float(x1-x0), float(y1-y0), fc ='none', ec ='y', lw = 1.5))
             self._ax.text(float(x0), float(y0), f"ROI",
                 verticalalignment='bottom', horizontalalignment='right',color='w')
-        self._fig.canvas.draw()
+        self._fig.canvas.draw_idle()
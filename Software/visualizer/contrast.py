@@ -0,0 +1,74 @@
+"""Contrast of the displayed images from statistics of a subsample, mapped on the display-resolution data only.
+
+Scaling a full 12 MP map with exposure.rescale_intensity or exposure.equalize_hist for every frame shown costs
+hundreds of milliseconds of the GUI thread. The statistics the mapping needs are taken instead from a strided
+subsample of about SAMPLE_SIZE pixels, on the processing worker when there is one: the 0.1 and 99.9 percentiles for a
+linear mapping, or the quantiles of the sample, which make the lookup table of a histogram equalization. The viewer
+then maps only the pixels it renders, after they are reduced to the canvas resolution: linear mappings by the color
+limits of the image, equalization by interpolating in the quantiles.
+"""
+import math
+from typing import NamedTuple, Optional
+import numpy as np
+
+SAMPLE_SIZE = 2 ** 18
+PERCENTILES = (0.1, 99.9)
+LUT_SIZE = 256
+TABLE_SIZE = 4096
+
+
+class ContrastStats(NamedTuple):
+    """Display range of an image; with quantiles, the lookup table of its histogram equalization"""
+    vmin: float
+    vmax: float
+    quantiles: Optional[np.ndarray] = None
+
+
+def subsample(image: np.ndarray, sample: int = SAMPLE_SIZE) -> np.ndarray:
+    """Strided view of a 2d image with about sample pixels"""
+    step = max(1, math.ceil(math.sqrt(image.shape[0] * image.shape[1] / max(sample, 1))))
+    return image[::step, ::step]
+
+
+def compute_stats(image: np.ndarray, equalize: bool = False, sample: int = SAMPLE_SIZE) -> ContrastStats:
+    """Contrast statistics of an image from a subsample of its finite values"""
+    values = subsample(image, sample).astype(np.float32).ravel()
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return ContrastStats(0.0, 1.0)
+    if equalize:
+        quantiles = np.quantile(values, np.linspace(0, 1, LUT_SIZE)).astype(np.float32)
+        return ContrastStats(float(quantiles[0]), float(quantiles[-1]), quantiles)
+    vmin, vmax = np.percentile(values, PERCENTILES)
+    return ContrastStats(float(vmin), float(vmax))
+
+
+def get_clim(stats: ContrastStats) -> tuple:
+    """Color limits of data mapped with the stats: [0, 1] for equalized data, the display range otherwise"""
+    if stats.quantiles is not None:
+        return 0.0, 1.0
+    return stats.vmin, stats.vmax if stats.vmax > stats.vmin else stats.vmin + 1
+
+
+def apply_lut(data: np.ndarray, stats: ContrastStats) -> np.ndarray:
+    """Map display-resolution data through the equalization lookup table, in [0, 1]; data of linear stats is
+    returned as is, its mapping is done by the color limits"""
+    if stats.quantiles is None:
+        return data
+    if stats.vmax <= stats.vmin:
+        return np.zeros(data.shape, dtype=np.float32)
+    # Table lookup on a uniform grid of the range, much faster per pixel than interpolating in the quantiles
+    grid = np.linspace(stats.vmin, stats.vmax, TABLE_SIZE)
+    table = np.interp(grid, stats.quantiles, np.linspace(0, 1, stats.quantiles.size)).astype(np.float32)
+    index = (data - stats.vmin) * ((TABLE_SIZE - 1) / (stats.vmax - stats.vmin))
+    np.clip(np.nan_to_num(index, copy=False), 0, TABLE_SIZE - 1, out=index)
+    return table[index.astype(np.intp)]
+
+
+def scale(image: np.ndarray, stats: ContrastStats) -> np.ndarray:
+    """Image mapped to [0, 1] with the stats as float32, for images saved or cached as displayed"""
+    if stats.quantiles is not None:
+        return apply_lut(image, stats)
+    vmin, vmax = get_clim(stats)
+    scaled = (image.astype(np.float32) - vmin) * (1 / (vmax - vmin))
+    return np.clip(scaled, 0, 1, out=scaled)
@@ -0,0 +1,86 @@
+"""Cache of display-ready images, so stepping through a series shows frames from memory instead of from disk.
+
+Entries are images reduced (block means) to the canvas resolution, keyed by (frame, image type, ROI), together with the
+full-resolution shape they cover; their contrast is mapped when they are shown (visualizer.contrast). The least
+recently shown entries are evicted once the cache holds more than its byte budget. Frames next to the one on display
+are prepared ahead on a worker thread.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable, Optional, Tuple
+import numpy as np
+from visualizer.renderer import block_mean
+
+Entry = Tuple[np.ndarray, Tuple[int, int]]  # display buffer, full-resolution shape
+
+
+def display_buffer(image: np.ndarray, canvas_shape: Tuple[int, int]) -> np.ndarray:
+    """Image reduced to no less than the canvas resolution, as float32"""
+    factor = max(1, min(image.shape[0] // max(canvas_shape[0], 1), image.shape[1] // max(canvas_shape[1], 1)))
+    return block_mean(image, factor).astype(np.float32, copy=False)
+
+
+class DisplayCache:
+    """LRU of display buffers within a byte budget, with prefetching on a worker thread"""
+
+    _entries: "OrderedDict[Hashable, Entry]"
+
+    def __init__(self, budget: int = 256 * 2 ** 20) -> None:
+        self._budget = budget
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def get(self, key: Hashable) -> Optional[Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, buffer: np.ndarray, full_shape: Tuple[int, int]) -> None:
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._nbytes -= previous[0].nbytes
+            self._entries[key] = (buffer, tuple(full_shape[:2]))
+            self._nbytes += buffer.nbytes
+            while self._nbytes > self._budget and len(self._entries) > 1:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+    def get_nbytes(self) -> int:
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def prefetch(self, key: Hashable, load: Callable[[], Entry]) -> None:
+        """Prepare the entry of key on the worker thread with load(), unless it is cached or being prepared"""
+        with self._lock:
+            if key in self._entries or key in self._pending:
+                return
+            self._pending.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dhm-display")
+
+        def run() -> None:
+            try:
+                buffer, full_shape = load()
+                self.put(key, buffer, full_shape)
+            except (OSError, ValueError, IndexError):
+                pass  # Unreadable frames are reported when they are shown
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+        self._executor.submit(run)
+
+    def clear(self) -> None:
+        """Drop all entries, e.g. when another series is loaded"""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
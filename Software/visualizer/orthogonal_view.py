@@ -0,0 +1,50 @@
+"""Orthogonal sections of the inline volume through a point clicked on the canvas.
+
+Stepping through the reconstructed slices shows one distance at a time, so the z-profile of an object can not be
+seen. Clicking the canvas while viewing the reconstructed map of an inline series shows the XZ section through the
+clicked row and the YZ section through the clicked column in a window of their own, distances along the vertical axis.
+The sections are propagated from the spectrum of the hologram line by line (HoloGram.load_inline_sections), without
+building the volume or reading its slices, and are cached per hologram.
+"""
+from typing import Optional, Sequence
+import numpy as np
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QVBoxLayout, QWidget
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas, \
+    NavigationToolbar2QT as NavigationToolbar
+from visualizer import contrast
+from visualizer.renderer import ImageRenderer
+
+
+class OrthogonalView(QWidget):
+    """Window of the XZ section (top) and YZ section (bottom) through a point of the inline volume"""
+
+    def __init__(self, parent: Optional[QWidget] = None) -> None:
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("Orthogonal View")
+        self.resize(640, 640)
+        self._canvas = FigureCanvas(Figure())
+        layout = QVBoxLayout(self)
+        layout.addWidget(NavigationToolbar(self._canvas, self))
+        layout.addWidget(self._canvas)
+        self._axes = self._canvas.figure.subplots(nrows=2)
+        self._canvas.figure.subplots_adjust(left=0.1, bottom=0.08, right=0.97, top=0.95, hspace=0.35)
+        self._renderers = [ImageRenderer(ax) for ax in self._axes]
+
+    def show_sections(self, xz: np.ndarray, yz: np.ndarray, row: int, column: int,
+                      distances: Sequence[float], cmap: str = 'gist_heat_r') -> None:
+        """Show the sections through the row and the column, whose lines are at the distances, and raise the window"""
+        step = (distances[-1] - distances[0]) / max(len(distances) - 1, 1)
+        top, bottom = distances[0] - step / 2, distances[-1] + step / 2
+        for ax, renderer, section, title, xlabel in ((self._axes[0], self._renderers[0], xz, f"XZ at y = {row}", "x"),
+                                                     (self._axes[1], self._renderers[1], yz, f"YZ at x = {column}",
+                                                      "y")):
+            renderer.show(section, cmap, extent=(-0.5, section.shape[1] - 0.5, bottom, top), aspect='auto',
+                          stats=contrast.compute_stats(section))
+            ax.set_title(title)
+            ax.set_xlabel(f"{xlabel} (pixel)")
+            ax.set_ylabel("z (um)")
+        self._canvas.draw_idle()
+        self.show()
+        self.raise_()
@@ -0,0 +1,93 @@
+"""Rate-limited previews of the frames being processed, produced off the GUI thread.
+
+Redrawing the canvas for every processed frame makes the GUI the bottleneck of fast pipelines: the redraws queue up
+and the view lags further and further behind the processing. The processing worker instead offers each processed frame
+to a PreviewPipe, which takes at most max_fps frames per second (and always the last one) and prepares them on its own
+thread: the image reduced to the canvas resolution and its contrast stats. Offering a frame only keeps a reference to
+its image, so the batch never waits for a preview. A frame offered while the previous one is still being prepared,
+and a preview prepared while the GUI has not taken the previous one yet, replace them: the latest frame wins and at
+most one redraw is ever pending on the GUI thread.
+"""
+import time
+import threading
+from typing import Any, Callable, Optional, Tuple
+import numpy as np
+from PyQt5.QtCore import pyqtSignal, QObject
+
+DEFAULT_FPS = 5.0
+PROGRESS_INTERVAL = 0.25 # unit in second, between two progress signals of the processing worker
+
+
+class Throttle:
+    """Lets an event through at most once per interval"""
+
+    def __init__(self, interval: float) -> None:
+        self._interval = interval
+        self._last = -float("inf")
+
+    def ready(self, force: bool = False) -> bool:
+        """Whether the interval has passed since the last event let through; if so, the event is let through"""
+        now = time.monotonic()
+        if not force and now - self._last < self._interval:
+            return False
+        self._last = now
+        return True
+
+
+class PreviewPipe(QObject):
+    """Previews of processed frames at most max_fps per second (0 for the last frame only), prepared on a thread
+    by produce(image), which returns the display buffer, the full-resolution shape and the contrast stats; image()
+    returns the processed image to preview. ready is emitted when a preview waits for take()."""
+
+    ready = pyqtSignal()
+
+    def __init__(self, max_fps: float, image: Callable[[], np.ndarray],
+                 produce: Callable[[np.ndarray], Tuple[np.ndarray, Tuple[int, int], Any]]) -> None:
+        super().__init__()
+        self._throttle = Throttle(1 / max_fps) if max_fps > 0 else None
+        self._image = image
+        self._produce = produce
+        self._condition = threading.Condition()
+        self._offered = None # frame number and image waiting for the thread
+        self._produced = None # preview waiting for the GUI
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="dhm-preview", daemon=True)
+        self._thread.start()
+
+    def offer(self, holo_num: int, final: bool = False) -> None:
+        """Hand a processed frame over without waiting; frames beyond the rate are dropped unless final"""
+        if not final and (self._throttle is None or not self._throttle.ready()):
+            return
+        image = self._image()
+        with self._condition:
+            self._offered = (holo_num, image)
+            self._condition.notify()
+
+    def take(self) -> Optional[tuple]:
+        """The latest preview (frame number, display buffer, full shape, contrast stats), None if taken already"""
+        with self._condition:
+            produced, self._produced = self._produced, None
+            return produced
+
+    def close(self) -> None:
+        """Stop the thread once the frame offered last is prepared"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while self._offered is None and not self._closed:
+                    self._condition.wait()
+                if self._offered is None:
+                    return
+                (holo_num, image), self._offered = self._offered, None
+            try:
+                buffer, full_shape, stats = self._produce(image)
+            except (ValueError, IndexError, TypeError):
+                continue  # No image of the type on display yet
+            with self._condition:
+                waiting, self._produced = self._produced is not None, (holo_num, buffer, full_shape, stats)
+            if not waiting:
+                self.ready.emit()
@@ -82,4 +82,34 @@ def process_finished(window: Window) -> None:
     window.pushButton_start_pause.hide()
     window.pushButton_end_task.hide()
     window.text_info_show.setText(\
-            f" Finished exporting {proc_end-proc_start+1} images from Series.")
\ No newline at end of file
+            f" Finished exporting {proc_end-proc_start+1} images from Series.")
+
+def live_process(window: Window, start_live) -> None:
+    """Preparatory UI actions for watch-folder live processing"""
+    window.progressBar.hide()
+    window.pushButton_start_pause.hide()
+    window.pushButton_end_task.show()
+    window.pushButton_end_task.setEnabled(True)
+    window.actionLive_Imaging.setEnabled(False)
+    window.sp_dict["process_dhm_Spoiler"].pushButton_Confirm.setEnabled(False)
+    window.label_current_receipt.setText(window.label_current_receipt.text().replace("Local Imaging", "Live Imaging"))
+
+    if window.get_dhm().get_block() == True:
+        window.get_dhm().set_unblock()
+    window.text_info_show.setText(f"Watching {window.get_dhm().get_read_path()} for new holograms...")
+    start_live()
+
+def stop_live_thread(window: Window) -> None:
+    """Upon slot trigger (End task QButton), stop watching by Blocking Running Call"""
+    window.get_dhm().set_block()
+    window.pushButton_end_task.setEnabled(False)
+    window.text_info_show.setText("Stopping live imaging...")
+
+def live_finished(window: Window) -> None:
+    """GUI cleanups after live processing is stopped"""
+    window.get_dhm().set_unblock()
+    window.pushButton_end_task.hide()
+    window.actionLive_Imaging.setEnabled(True)
+    window.sp_dict["process_dhm_Spoiler"].pushButton_Confirm.setEnabled(True)
+    window.label_current_receipt.setText(window.label_current_receipt.text().replace("Live Imaging", "Local Imaging"))
+    window.text_info_show.setText(f"Live imaging stopped, {len(window.get_dhm().HOLO_LIST)} images in the series.")
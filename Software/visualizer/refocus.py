@@ -0,0 +1,56 @@
+"""Interactive refocusing of the hologram on display with the focus slider of the process step.
+
+The spectrum of the apodized field of the hologram is computed once (HoloGram.prepare_refocus); every slider position
+then costs one propagation. While the slider is dragged, only the central part of the spectrum is propagated, for an
+image of at most PREVIEW_SIZE pixels a side; on release, the distance is propagated at full resolution and becomes the
+diffraction distance. Slider moves are debounced by DEBOUNCE_MS and collected in a RefocusRequest, from which the
+worker always takes the newest distance: positions passed while a propagation runs are skipped, and a result that is
+already superseded when it is ready is not shown.
+"""
+import math
+import threading
+from typing import Optional, Tuple
+
+PREVIEW_SIZE = 512 # unit in pixel, longest side of the images shown while dragging
+DEBOUNCE_MS = 30
+SLIDER_RANGE = 200.0 # unit in micrometer, either side of the diffraction distance
+SLIDER_STEP = 0.1 # unit in micrometer, distance of one slider tick
+
+
+def preview_factor(shape: Tuple[int, int]) -> int:
+    """Decimation factor of the refocused previews of a field of the shape"""
+    return max(1, math.ceil(max(shape) / PREVIEW_SIZE))
+
+
+class RefocusRequest:
+    """Newest refocusing asked for: frame, distance and whether at full resolution. Every request supersedes the
+    previous ones."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pending = None
+        self._generation = 0
+
+    def put(self, holo_num: int, distance: float, full: bool) -> None:
+        with self._lock:
+            self._pending = (holo_num, distance, full)
+            self._generation += 1
+
+    def take(self) -> Optional[Tuple[int, Tuple[int, float, bool]]]:
+        """The pending request and its generation, None if there is none"""
+        with self._lock:
+            if self._pending is None:
+                return None
+            pending, self._pending = self._pending, None
+            return self._generation, pending
+
+    def is_pending(self) -> bool:
+        return self._pending is not None
+
+    def is_superseded(self, generation: int) -> bool:
+        """Whether a request was put after the one of the generation"""
+        return generation != self._generation
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pending = None
@@ -0,0 +1,151 @@
+"""Canvas rendering of full-resolution images at display resolution.
+
+Drawing a 12 MP image with imshow after clearing the axes costs hundreds of milliseconds, most of it resampling
+pixels that never reach the screen. ImageRenderer keeps one AxesImage alive and only replaces its data: the part of
+the image inside the current view, reduced by block means to about the pixel size of the axes. Zooming in renders
+the view again at the detail it needs; panning or zooming within what is already rendered costs nothing. With contrast
+statistics (visualizer.contrast), the full image is not scanned for its range and equalization is applied to the
+rendered data only.
+"""
+import math
+from typing import Optional, Sequence, Tuple
+import numpy as np
+from matplotlib.axes import Axes
+from matplotlib.image import AxesImage
+from visualizer.contrast import ContrastStats, apply_lut, get_clim
+
+
+def block_mean(image: np.ndarray, factor: int) -> np.ndarray:
+    """Mean of factor x factor blocks of a 2d image as float32 (the incomplete last blocks are dropped)"""
+    if factor <= 1:
+        return image
+    height, width = image.shape[0] // factor * factor, image.shape[1] // factor * factor
+    reduced = image[0:height:factor, 0:width:factor].astype(np.float32)  # Sum of strided views, no blocked copy
+    for row in range(factor):
+        for column in range(factor):
+            if row > 0 or column > 0:
+                reduced += image[row:height:factor, column:width:factor]
+    reduced *= 1 / factor ** 2
+    return reduced
+
+
+class _ViewImage(AxesImage):
+    """AxesImage that lets its renderer refresh the data for the current view right before every draw"""
+
+    def __init__(self, ax: Axes, before_draw, **kwargs) -> None:
+        super().__init__(ax, **kwargs)
+        self._before_draw = before_draw
+
+    def draw(self, renderer) -> None:
+        self._before_draw()
+        super().draw(renderer)
+
+
+class ImageRenderer:
+    """Renders one image into an axes through a persistent AxesImage"""
+
+    _ax: Axes
+    _artist: Optional[AxesImage]
+
+    def __init__(self, ax: Axes) -> None:
+        self._ax = ax
+        self._artist = None
+        self._image = None
+        self._extent = None
+        self._stats = None
+        self._rendered = None  # rows, columns and block factor of the data in the artist
+
+    def show(self, image: np.ndarray, cmap: str = 'gist_gray', extent: Optional[Sequence[float]] = None,
+             aspect: Optional[str] = None, stats: Optional[ContrastStats] = None) -> None:
+        """Show an image; extent (left, right, bottom, top) in data coordinates, the pixel grid if None. The zoom
+        is kept while the extent stays the same. Without stats, the image is shown between its minimum and maximum."""
+        height, width = image.shape[:2]
+        extent = tuple(extent) if extent is not None else (-0.5, width - 0.5, height - 0.5, -0.5)
+        if self._artist is None or self._artist not in self._ax.images or extent != self._extent:
+            if self._artist is not None and self._artist in self._ax.images:
+                self._artist.remove()
+            self._artist = _ViewImage(self._ax, self._refresh, cmap=cmap, origin='upper', interpolation='nearest')
+            self._ax.add_image(self._artist)
+            self._ax.set_xlim(extent[0], extent[1])
+            self._ax.set_ylim(extent[2], extent[3])
+            self._ax.set_autoscale_on(False)
+        else:
+            self._artist.set_cmap(cmap)
+        if aspect is not None:
+            self._ax.set_aspect(aspect)
+        self._image, self._extent, self._stats = image, extent, stats
+        if stats is None:
+            vmin, vmax = float(np.min(image)), float(np.max(image))
+            if not (math.isfinite(vmin) and math.isfinite(vmax)):
+                finite = image[np.isfinite(image)]
+                vmin, vmax = (float(finite.min()), float(finite.max())) if finite.size > 0 else (0.0, 1.0)
+            self._artist.set_clim(vmin, vmax if vmax > vmin else vmin + 1)
+        else:
+            self._artist.set_clim(*get_clim(stats))
+        self._render()
+        self._ax.figure.canvas.draw_idle()
+
+    def is_zoomed(self) -> bool:
+        """Whether the view shows less than the whole image"""
+        if self._image is None or self._artist not in self._ax.images:
+            return False
+        left, right, bottom, top = self._extent
+        xlim, ylim = sorted(self._ax.get_xlim()), sorted(self._ax.get_ylim())
+        return xlim[0] > min(left, right) + 1 or xlim[1] < max(left, right) - 1 or \
+            ylim[0] > min(bottom, top) + 1 or ylim[1] < max(bottom, top) - 1
+
+    def locate(self, x: Optional[float], y: Optional[float]) -> Optional[Tuple[float, float]]:
+        """Position of a point in data coordinates on the image, as fractions of its height and width; None if the
+        point is outside of it"""
+        if self._image is None or x is None or y is None:
+            return None
+        left, right, bottom, top = self._extent
+        row, column = (y - top) / (bottom - top), (x - left) / (right - left)
+        if not (0 <= row < 1 and 0 <= column < 1):
+            return None
+        return row, column
+
+    def clear(self) -> None:
+        """Forget the image, e.g. after the axes were cleared"""
+        if self._artist is not None and self._artist in self._ax.images:
+            self._artist.remove()
+        self._artist = self._image = self._extent = self._stats = self._rendered = None
+
+    def _view_region(self) -> Tuple[int, int, int, int, int]:
+        """Rows and columns of the image inside the view and the block factor that fits the axes pixels"""
+        height, width = self._image.shape[:2]
+        left, right, bottom, top = self._extent
+        columns = sorted((x - left) / (right - left) * width for x in self._ax.get_xlim())
+        rows = sorted((y - top) / (bottom - top) * height for y in self._ax.get_ylim())
+        col0, col1 = max(0, math.floor(columns[0])), min(width, math.ceil(columns[1]))
+        row0, row1 = max(0, math.floor(rows[0])), min(height, math.ceil(rows[1]))
+        bbox = self._ax.get_window_extent()
+        factor = max(1, int(min((col1 - col0) / max(bbox.width, 1), (row1 - row0) / max(bbox.height, 1))))
+        # Align to the block grid, so the blocks of a region do not move while panning
+        row0, col0 = row0 // factor * factor, col0 // factor * factor
+        return row0, max(row0 + factor, row1), col0, max(col0 + factor, col1), factor
+
+    def _render(self) -> None:
+        row0, row1, col0, col1, factor = self._view_region()
+        region = block_mean(self._image[row0:row1, col0:col1], factor)
+        if self._stats is not None:
+            region = apply_lut(region, self._stats)
+        row1, col1 = row0 + region.shape[0] * factor, col0 + region.shape[1] * factor
+        height, width = self._image.shape[:2]
+        left, right, bottom, top = self._extent
+        self._artist.set_data(region)
+        self._artist.set_extent((left + (right - left) * col0 / width, left + (right - left) * col1 / width,
+                                 top + (bottom - top) * row1 / height, top + (bottom - top) * row0 / height))
+        self._rendered = (row0, row1, col0, col1, factor)
+
+    def _refresh(self) -> None:
+        """Render again when the view (zoomed or panned since) needs more detail or leaves the rendered region"""
+        if self._image is None:
+            return
+        row0, row1, col0, col1, factor = self._view_region()
+        done_row0, done_row1, done_col0, done_col1, done_factor = self._rendered
+        height, width = self._image.shape[:2]
+        covered = done_row0 <= row0 and min(done_row1 + done_factor, height) >= row1 and done_col0 <= col0 \
+            and min(done_col1 + done_factor, width) >= col1
+        if not covered or factor < done_factor or factor >= 2 * done_factor:
+            self._render()
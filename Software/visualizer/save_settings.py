@@ -22,6 +22,15 @@ def config_spinbox(window: Window, total_img: int, load_config_true: bool) -> No
         _ss.spinBox_range_to.setMaximum(total_img)
     window.spinBox_select_img.setEnabled(True)
 
+def grow_spinbox(window: Window, total_img: int) -> None:
+    """Raise the maxima of the QSpinboxes to the qty of images indexed yet, while a series is indexed"""
+    window.spinBox_select_img.setMaximum(total_img)
+    _ss = window.sp_dict["set_save_Spoiler"]
+    _ss.label_total_img.setText(f"out of {total_img}")
+    _ss.label_total_img_2.setText(f"out of {total_img}")
+    _ss.spinBox_range_from.setMaximum(total_img)
+    _ss.spinBox_range_to.setMaximum(total_img)
+
 def signal_range_from(window: Window) -> None:
     """Upon slot trigger (peek from Qbutton), do save GUI tasks"""
     _ss = window.sp_dict["set_save_Spoiler"]
@@ -49,6 +58,7 @@ def save_enable(window: Window) -> None:
             _ss.checkBox_height.setEnabled(True)
             _ss.checkBox_phase.setEnabled(True)
             _ss.checkBox_wrapped_phase.setEnabled(True)
+        _ss.checkBox_save_stack.setEnabled(True)
         _ss.pushButton_save_add.setEnabled(True)
         _ss.lineEdit_save_add.setEnabled(True)
     else:
@@ -61,6 +71,7 @@ def save_enable(window: Window) -> None:
             _pds.label_recon_total.setEnabled(False)
             _pds.spinBox_recon_pos.setEnabled(False)
             _pds.pushButton_recon_peek.setEnabled(False)
+        _ss.checkBox_save_stack.setEnabled(False)
         _ss.pushButton_save_add.setEnabled(False)
         _ss.lineEdit_save_add.setEnabled(False)
     return
@@ -76,6 +87,8 @@ def set_save_options(window: Window) -> None:
     else:
         window.get_dhm().set_save_flags(height_map= False, phase_map=False, wrapped_phase=False,
                             refocused_volume=_ss.checkBox_save_image.isChecked())
+    if window.get_dhm().get_output_format() in ("files", "stack"): # zarr and hdf5 are set by the receipt only
+        window.get_dhm().set_output_format("stack" if _ss.checkBox_save_stack.isChecked() else "files")
 
 def set_save_dir(window: Window) -> None:
     """Check Save Path validity, set save option based on imaging mode for configuration loading"""
@@ -95,6 +108,7 @@ def set_save_dir(window: Window) -> None:
     if window.get_name() == "Inline":
         if inl_sv == True:
             _ss.checkBox_save_image.setChecked(True) if inl_sv == True else _ss.checkBox_save_image.setChecked(False)
+    _ss.checkBox_save_stack.setChecked(window.get_dhm().get_output_format() == "stack")
 
     def set_dhm_save_path(cond : bool):
         if cond == True:
@@ -56,6 +56,7 @@ def sop_check_load_img(window: Window) -> None:
     else:
         window.sp_dict["set_roi_Spoiler"].toggleButton.setEnabled(True)
         window.sp_dict["load_img_Spoiler"].spoiler_next_step.emit()
+        window.actionLive_Imaging.setEnabled(True)
 
 def sop_check_set_roi(window: Window, list_empty: bool) -> None:
     """When comfirm button is clicked, check if ROI has been saved"""
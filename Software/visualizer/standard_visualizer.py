@@ -1,10 +1,16 @@
 from abc import abstractmethod
 from gui.main_window import start_ui
-from visualizer import activate, config_receipt, sop_control, save_settings, process_settings, threaded_task
+from visualizer import activate, config_receipt, sop_control, save_settings, process_settings, threaded_task, refocus
+from visualizer.orthogonal_view import OrthogonalView
+from visualizer.renderer import ImageRenderer
 from visualizer.abstract_visualizer import AbstractImageVisualizer
-import re, datetime
+from gui.dialog import popup_message
+from dhm import timing
+import datetime
+import time
+from PyQt5.QtCore import QTimer
+from matplotlib import patches
 from matplotlib.widgets import RectangleSelector
-import matplotlib.pyplot as plt
 
 def show() -> None:
     """Creates a standard visualizer for an experiment."""
@@ -25,6 +31,7 @@ class StandardImageVisualizer(AbstractImageVisualizer):
         self.load_canvas()
         self._window.text_info_show.setText("")
         self._window.action_dump_config.setEnabled(False)
+        self._window.actionLive_Imaging.setEnabled(False)
         self._draw_all_roi()
 
         self._window.sp_dict["set_param_Spoiler"].pushButton_Confirm.clicked.connect(self._sop_check_param_set)
@@ -48,6 +55,22 @@ class StandardImageVisualizer(AbstractImageVisualizer):
         self._window.sp_dict["process_dhm_Spoiler"].pushButton_ImgSave.clicked.connect(self._save_live_view)
         self._window.sp_dict["process_dhm_Spoiler"].comboBox_imgshow.currentIndexChanged.connect(self._select_img_type)
 
+        self._throughput = timing.Ewma() # seconds per image of the processing run
+        self._refocus_request = refocus.RefocusRequest()
+        self._refocusing = False
+        self._refocus_timer = QTimer()
+        self._refocus_timer.setSingleShot(True)
+        self._refocus_timer.setInterval(refocus.DEBOUNCE_MS)
+        self._refocus_timer.timeout.connect(self._start_refocus)
+        if self._window.get_name() == "Offaxis":
+            _slider = self._window.sp_dict["process_dhm_Spoiler"].horizontalSlider_focus
+            _slider.valueChanged.connect(self._refocus_moved)
+            _slider.sliderReleased.connect(self._refocus_released)
+            _sps = self._window.sp_dict["set_param_Spoiler"]
+            _sps.comboBox_FilterType.currentIndexChanged.connect(self._update_sideband)
+            _sps.SpinBox_rate.valueChanged.connect(self._update_sideband)
+            _sps.comboBox_quadrant.currentIndexChanged.connect(self._update_sideband)
+
     #################################################
     # Configuration File Operation Callbacks        #
     #################################################
@@ -69,6 +92,8 @@ class StandardImageVisualizer(AbstractImageVisualizer):
     def _sop_check_param_set(self) -> None:
         """When comfirm button is clicked, check for all parameters"""
         sop_control.sop_check_param_set(self._window)
+        if self._window.get_name() == "Offaxis":
+            self._center_refocus_slider()
 
     def _sop_check_load_img(self) -> None:
         """When comfirm button is clicked, check for read path"""
@@ -128,6 +153,7 @@ class StandardImageVisualizer(AbstractImageVisualizer):
             _srs.label_current_roi.setEnabled(False)
             return
 
+        import matplotlib.pyplot as plt  # Deferred, pyplot is only needed once ROI editing starts
         plt.connect('key_press_event', roi_rec_selector)
         self._window.text_info_show.setText(f"Click and Drag on the Image Canvas to select ROI...")
         self._window.sp_dict["set_roi_Spoiler"].label_current_roi.setEnabled(False)
@@ -222,7 +248,8 @@ class StandardImageVisualizer(AbstractImageVisualizer):
             pds.spinBox_recon_pos.textChanged.connect(self._signal_recon_to)
 
         def start_proc() -> None:
-            self._estimate_proc_time(10.0)
+            self._throughput.reset()
+            self._estimate_proc_time()
             proc_start = self._dhm().get_range_start(); proc_end = self._dhm().get_range_end()
             self._img_idx_on_display = proc_start
             self._process_dhm_thread(proc_start, proc_end)
@@ -232,6 +259,37 @@ class StandardImageVisualizer(AbstractImageVisualizer):
         self._window.pushButton_end_task.clicked.connect(self._end_processing_thread)
         process_settings.process_dhm(self._window, set_recon_signal, start_proc)
 
+    def _live_process(self) -> None:
+        """Upon slot trigger (Live Imaging QAction), watch the hologram directory and process
+        every new image as soon as it is completely written"""
+        if self._window.get_scheduler().has_active_tasks():
+            popup_message("Running a task", "Please wait until the current task has been finished.")
+            return
+        if not self._dhm().is_directory_source():
+            popup_message("Not a directory", "Live imaging watches a directory of holograms, not a stack file.")
+            return
+
+        def start_live() -> None:
+            self._live_skipped = 0
+            self._text_info_show_misc = ""
+            self._live_process_thread()
+
+        self._current_viewer_event = "live"
+        self._window.pushButton_end_task.clicked.connect(self._stop_live_thread)
+        process_settings.live_process(self._window, start_live)
+
+    def _stop_live_thread(self) -> None:
+        """Upon slot trigger (End task QButton), stop watching the hologram directory"""
+        if self._current_viewer_event == "live":
+            process_settings.stop_live_thread(self._window)
+
+    def _live_finished(self) -> None:
+        """GUI cleanups after live processing is stopped"""
+        self._window.pushButton_end_task.clicked.disconnect(self._stop_live_thread)
+        process_settings.live_finished(self._window)
+        self._current_viewer_event = "set_saving"
+        self._text_info_show_misc = ''
+
     def _stop_processing_thread(self) -> None:
         """Upon slot trigger (Stop QButton), stop or resume processing depending on program state"""
         ret = process_settings.stop_processing_thread(self._window, self._img_idx_on_display)
@@ -248,10 +306,19 @@ class StandardImageVisualizer(AbstractImageVisualizer):
         process_settings.process_finished(self._window)
         self._text_info_show_misc = ''
 
-    def _estimate_proc_time(self, loop_time) -> None:
-        """Processing Time Estimation for TextInfoShow"""
-        total_remain_time = round((self._dhm().get_range_end() - self._img_idx_on_display) * loop_time)
-        self._text_info_show_misc = f"Estimated remaining time: {datetime.timedelta(seconds=total_remain_time)}."
+    def _estimate_proc_time(self, holo_num=None, stages=None) -> None:
+        """Processing Time Estimation for TextInfoShow, from the moving average of the measured seconds per image,
+        with the moving average time of every processing stage"""
+        loop_time = self._throughput.get()
+        if loop_time is None:
+            self._text_info_show_misc = "Estimating remaining time..."
+            return
+        holo_num = self._img_idx_on_display if holo_num is None else holo_num
+        total_remain_time = round((self._dhm().get_range_end() - holo_num) * loop_time)
+        self._text_info_show_misc = f"Estimated remaining time: {datetime.timedelta(seconds=total_remain_time)} " \
+                                    f"({loop_time:.2f} s per image)."
+        if stages:
+            self._text_info_show_misc += f" Stages per image: {timing.format_stages(stages)}."
     
     def _signal_recon_to(self) -> None:
         """Upon slot trigger (QSpinbox Reconstuction), enable peek button to view slice"""
@@ -265,10 +332,213 @@ class StandardImageVisualizer(AbstractImageVisualizer):
         if self._window.progressBar.value() == 99:
             self._window.progressBar.setValue(0)
 
-    def _update_img_idx_on_display(self, value) -> None:
-        """Update Image Index for TextInfoShow During DHM Processing"""
-        self._img_idx_on_display = value
-        self._window.spinBox_select_img.setValue(value+1)
+    def _progress_signal_accept(self, value, holo_num, loop_time, stages) -> None:
+        """Update Progress Bar value and Processing Time Estimation, batched by the processing thread"""
+        self._progbar_signal_accept(value)
+        self._throughput.update(loop_time)
+        self._estimate_proc_time(holo_num, stages)
+
+    ##################################################
+    # Refocusing Callbacks                           #
+    ##################################################
+
+    _REFOCUSED_TYPES = ("height_map", "phase_map", "wrapped_phase", "intensity_map")
+
+    def _center_refocus_slider(self) -> None:
+        """Center the refocus slider on the diffraction distance, with SLIDER_RANGE either side"""
+        _pds = self._window.sp_dict["process_dhm_Spoiler"]
+        diffract_dist = self._dhm().get_diffraction_dist()
+        center = round(diffract_dist / refocus.SLIDER_STEP)
+        ticks = round(refocus.SLIDER_RANGE / refocus.SLIDER_STEP)
+        _pds.horizontalSlider_focus.blockSignals(True)
+        _pds.horizontalSlider_focus.setRange(center - ticks, center + ticks)
+        _pds.horizontalSlider_focus.setPageStep(round(10 / refocus.SLIDER_STEP))
+        _pds.horizontalSlider_focus.setValue(center)
+        _pds.horizontalSlider_focus.blockSignals(False)
+        _pds.label_focus_dist.setText(f"{diffract_dist:.1f} um")
+
+    def _refocus_moved(self, value) -> None:
+        """Upon slot trigger (refocus QSlider), ask for the hologram on display refocused at the slider distance;
+        a decimated preview while the slider is dragged"""
+        _pds = self._window.sp_dict["process_dhm_Spoiler"]
+        distance = value * refocus.SLIDER_STEP
+        _pds.label_focus_dist.setText(f"{distance:.1f} um")
+        if self._img_type_on_display not in self._REFOCUSED_TYPES:
+            _type = self._img_type_str_mapper[_pds.comboBox_imgshow.currentText()]
+            self._img_type_on_display = _type if _type in self._REFOCUSED_TYPES else "height_map"
+        self._refocus_request.put(self._img_idx_on_display, distance, not _pds.horizontalSlider_focus.isSliderDown())
+        self._refocus_timer.start()
+
+    def _refocus_released(self) -> None:
+        """Upon slot trigger (refocus QSlider released), ask for the full-resolution refocusing"""
+        value = self._window.sp_dict["process_dhm_Spoiler"].horizontalSlider_focus.value()
+        self._refocus_request.put(self._img_idx_on_display, value * refocus.SLIDER_STEP, True)
+        self._refocus_timer.start()
+
+    def _start_refocus(self) -> None:
+        """Upon slot trigger (debounce QTimer), spawn the refocusing thread unless it is running already; it takes
+        the newest request itself"""
+        if self._refocusing or not self._refocus_request.is_pending():
+            return
+        if self._window.get_scheduler().has_active_tasks():
+            self._refocus_request.clear()
+            self._window.text_info_show.setText("Please wait until the current task has been finished to refocus.")
+            return
+        self._refocusing = True
+
+        def connect_signal(signal) -> None:
+            """Connect SigHelper signals to Visualizer callbacks"""
+            signal.refocused.connect(self._show_refocused)
+            signal.finished.connect(self._refocus_finished)
+
+        threaded_task.refocus_thread(self._window, self._refocus_request, connect_signal)
+
+    def _show_refocused(self, distance, preview, full_shape) -> None:
+        """Show a refocused preview, stretched over the full-resolution extent, or the refocused maps, whose
+        distance then becomes the diffraction distance"""
+        if preview is not None:
+            wrapped_phase, intensity = preview
+            self._img_buf = intensity if self._img_type_on_display == "intensity_map" else wrapped_phase
+            self._img_extent = [-0.5, full_shape[1]-0.5, full_shape[0]-0.5, -0.5]
+            self._img_full_shape = tuple(full_shape)
+            self._contrast = self._compute_contrast(self._img_buf)
+            self.draw_view()
+            self._draw_all_roi()
+            self._window.text_info_show.setText(f"Refocusing image {self._img_idx_on_display+1} at "
+                                                f"{distance:.1f} um, preview at reduced resolution.")
+        else:
+            self._dhm().set_diffraction_dist(distance)
+            self._window.sp_dict["set_param_Spoiler"].SpinBox_diffract_dist.setValue(distance)
+            self.load_canvas()
+            self._window.text_info_show.setText(f"Image {self._img_idx_on_display+1} refocused at {distance:.1f} um, "
+                                                f"the new diffraction distance.")
+
+    def _refocus_finished(self, result) -> None:
+        """GUI cleanups after the refocusing thread has taken all requests"""
+        self._refocusing = False
+        if result == 1 and self._refocus_request.is_pending():
+            self._start_refocus()
+
+    ##################################################
+    # Sideband Preview Callbacks                     #
+    ##################################################
+
+    _sideband = None # geometry and preview of the filter settings on the spectrum view
+    _sideband_circle = None
+    _sideband_ax = None
+
+    def _select_img_type(self) -> None:
+        """Translate Image types strings on QcomboBox dropdown menus to program strings; the spectrum of the
+        hologram on display is computed first"""
+        _type = self._window.sp_dict["process_dhm_Spoiler"].comboBox_imgshow.currentText()
+        if self._img_type_str_mapper[_type] != "spectrum":
+            super()._select_img_type()
+            return
+        if self._window.get_scheduler().has_active_tasks():
+            self._window.text_info_show.setText("Please wait until the current task has been finished to show "
+                                                "the spectrum.")
+            return
+        self._img_type_on_display = "spectrum"
+
+        def connect_signal(signal) -> None:
+            """Connect SigHelper signals to Visualizer callbacks"""
+            signal.finished.connect(self._spectrum_loaded)
+
+        threaded_task.prepare_spectrum(self._window, self._img_idx_on_display, connect_signal)
+
+    def _spectrum_loaded(self) -> None:
+        """Show the log-magnitude spectrum, then the sideband of the filter settings"""
+        self._sideband = None
+        self.load_canvas()
+        self._update_sideband()
+
+    def _update_sideband(self) -> None:
+        """Upon slot trigger (filter type, rate or quadrant of the parameter step), outline the sideband the filter
+        settings select on the spectrum view and preview the field they give at reduced resolution"""
+        if self._img_type_on_display != "spectrum" or not self._dhm().has_spectrum():
+            return
+        _sps = self._window.sp_dict["set_param_Spoiler"]
+        start = time.perf_counter()
+        geometry, preview = self._dhm().sideband_preview(_sps.comboBox_FilterType.currentText(), _sps.SpinBox_rate.value(),
+                                                         _sps.comboBox_quadrant.currentText())
+        self._sideband = (geometry, preview)
+        self._draw_sideband()
+        center_x, center_y, radius = geometry
+        self._window.text_info_show.setText(f"Sideband of quadrant {_sps.comboBox_quadrant.currentText()} at "
+                                            f"x = {center_y}, y = {center_x}, filter radius {radius} pixels. Preview "
+                                            f"of the wrapped phase at {preview.shape[1]}x{preview.shape[0]} in "
+                                            f"{(time.perf_counter() - start) * 1000:.0f} ms.")
+
+    def _draw_sideband(self) -> None:
+        """Draw the filter circle and the inset preview of the sideband on the spectrum view"""
+        if self._sideband is None:
+            return
+        (center_x, center_y, radius), preview = self._sideband
+        if self._sideband_circle is not None and self._sideband_circle in self._ax.patches:
+            self._sideband_circle.remove()
+        self._sideband_circle = patches.Circle((center_y, center_x), radius, fc='none', ec='y', lw=1.5)
+        self._ax.add_patch(self._sideband_circle)
+        if self._sideband_ax is None:
+            self._sideband_ax = self._ax.inset_axes([0.68, 0.02, 0.3, 0.3])
+            self._sideband_ax.set_xticks([]); self._sideband_ax.set_yticks([])
+            self._sideband_renderer = ImageRenderer(self._sideband_ax)
+        self._sideband_renderer.show(preview, 'gist_gray', aspect='auto')
+        self._fig.canvas.draw_idle()
+
+    def _remove_sideband(self) -> None:
+        """Remove the inset preview of the spectrum view"""
+        if self._sideband_ax is not None:
+            self._sideband_ax.remove()
+            self._sideband_ax = None
+
+    def draw_view(self) -> None:
+        """Update the image in place, with the sideband overlays on the spectrum view"""
+        if self._img_type_on_display != "spectrum":
+            self._remove_sideband()
+        super().draw_view()
+        if self._img_type_on_display == "spectrum":
+            self._draw_sideband()
+
+    ##################################################
+    # Orthogonal View Callbacks                      #
+    ##################################################
+
+    _orthogonal_view = None
+
+    def _on_mouse_click(self, event) -> None:
+        """Upon a click on the canvas while viewing the reconstructed map of an inline series, show the XZ and YZ
+        sections of the volume through the clicked point"""
+        if self._window.get_name() != "Inline" or self._img_type_on_display != "refocused_volume" or \
+                event.button != 1 or event.inaxes is not self._ax or self._img_full_shape is None:
+            return
+        toolbar = self._fig.canvas.toolbar
+        if toolbar is not None and toolbar.mode:
+            return  # Zooming or panning
+        position = self._renderer.locate(event.xdata, event.ydata)
+        if position is None:
+            return
+        if self._window.get_scheduler().has_active_tasks():
+            self._window.text_info_show.setText("Please wait until the current task has been finished to show "
+                                                "the orthogonal view.")
+            return
+        row, column = int(position[0] * self._img_full_shape[0]), int(position[1] * self._img_full_shape[1])
+
+        def connect_signal(signal) -> None:
+            """Connect SigHelper signals to Visualizer callbacks"""
+            signal.sectioned.connect(self._show_sections)
+
+        threaded_task.load_inline_sections(self._window, self._img_idx_on_display, row, column, connect_signal)
+
+    def _show_sections(self, row, column) -> None:
+        """Show the sections loaded last in the orthogonal view window"""
+        if self._orthogonal_view is None:
+            self._orthogonal_view = OrthogonalView(self._window)
+        qty = self._dhm().get_zstack_qty()
+        distances = [self._dhm().get_live_recon_dist(z_step) for z_step in range(1, qty + 1)]
+        self._orthogonal_view.show_sections(self._dhm().XZ_SECTION, self._dhm().YZ_SECTION, row, column, distances,
+                                            self._cmap)
+        self._window.text_info_show.setText(f"Orthogonal view of image {self._img_idx_on_display+1} through "
+                                            f"x = {column}, y = {row}.")
 
     ##################################################
     # DHM Threaded Tasks Callback                    #
@@ -284,13 +554,38 @@ class StandardImageVisualizer(AbstractImageVisualizer):
 
         def connect_signal(signal) -> None:
             """Connect SigHelper signals to Visualizer callbacks"""
-            signal.idx.connect(self._progbar_signal_accept)
-            signal.num.connect(self._update_img_idx_on_display)
-            signal.show.connect(self.load_canvas)
-            signal.time.connect(self._estimate_proc_time)
+            signal.progress.connect(self._progress_signal_accept)
             signal.finished.connect(self._process_finished)
 
-        threaded_task.process_dhm_thread(self._window, proc_start, proc_end, connect_signal)
+        threaded_task.process_dhm_thread(self._window, proc_start, proc_end, connect_signal, self._preview_pipe())
+
+    def _live_process_thread(self) -> None:
+        """Spawn new thread for watching the hologram directory, processing new images and
+        saving the files. Signals series size, display indices and latency, update canvas image"""
+        if self._window.get_name() == "Inline":
+            self._img_type_on_display = "refocused_volume"
+        else:
+            self._img_type_on_display = "height_map"
+
+        def update_total(total: int) -> None:
+            self._total_img = total
+            self._window.spinBox_select_img.setMaximum(total)
+
+        def update_skipped(skipped: int) -> None:
+            self._live_skipped += skipped
+
+        def update_latency(latency: float) -> None:
+            self._text_info_show_misc = f"Capture to display latency: {latency:.2f} s, " + \
+                                        f"{self._live_skipped} frame(s) skipped."
+
+        def connect_signal(signal) -> None:
+            """Connect SigHelper signals to Visualizer callbacks"""
+            signal.total.connect(update_total)
+            signal.skipped.connect(update_skipped)
+            signal.latency.connect(update_latency)
+            signal.finished.connect(self._live_finished)
+
+        threaded_task.live_process_thread(self._window, connect_signal, self._preview_pipe())
 
     def _load_2d_image_series(self) -> None:
         """Spawn new thread for loading a 2d series from directory.
@@ -302,15 +597,39 @@ class StandardImageVisualizer(AbstractImageVisualizer):
         def connect_signal(signal) -> None:
             """Connect SigHelper signals to Visualizer callbacks"""
             signal.finished.connect(load_list)
-        
+            signal.progress.connect(show_progress)
+            signal.total.connect(update_total)
+
+        streamed = False
+
+        def show_progress(indexed: int, total: int) -> None:
+            if indexed < total:
+                self._window.text_info_show.setText(f"Indexing holograms... {indexed}/{total}")
+
+        def update_total(total: int) -> None:
+            """ HOLO_LIST grew by a batch of indexed holograms while the rest of the directory is indexed,
+                the first one is loaded already """
+            nonlocal streamed
+            self._total_img = total
+            if not streamed:
+                streamed = True
+                self._display_cache.clear()
+                self._locked_contrast.clear()
+                self._img_type_on_display = "hologram"
+                self._img_idx_on_display = 0
+                self.load_canvas()
+            save_settings.grow_spinbox(self._window, total)
+
         def load_list( _ ) -> None:
-            """ Perform Human Sort with the file names, i.e.
-                sort file list to [0.tiff, 1.tiff, 2.tiff, ..., 10.tiff, 11.tiff]
-            Note: For RegEx expression generation of FLIR outputed images, use
-            file = re.search("-\s*\K[^-]+$", file).group(0) """
-            self._dhm().HOLO_LIST.sort(key=lambda f: int(re.sub('\D', '', f) or -1))
+            """ HOLO_LIST is natural sorted by the series index, i.e.
+                [0.tiff, 1.tiff, 2.tiff, ..., 10.tiff, 11.tiff] """
             self._total_img = len(self._dhm().HOLO_LIST)
-            self._load_from_hololist(0)
+            if streamed:
+                self.load_canvas()
+            else:
+                self._display_cache.clear()
+                self._locked_contrast.clear()
+                self._load_from_hololist(0)
             save_settings.config_spinbox(self._window, self._total_img, self._current_viewer_event == "load_config")
             if (self._dhm().get_back_path() != "") and (self._current_viewer_event == "load_config"):
                 self._window.sp_dict["load_img_Spoiler"].lineEdit_local_read.setText(self._dhm().get_back_path())
@@ -328,6 +647,11 @@ class StandardImageVisualizer(AbstractImageVisualizer):
         def connect_signal(signal) -> None:
             """Connect SigHelper signals to Visualizer callbacks"""
             signal.finished.connect(done_load_back)
+            signal.progress.connect(show_progress)
+
+        def show_progress(done: int, total: int) -> None:
+            if done < total:
+                self._window.text_info_show.setText(f"Averaging background frames... {done}/{total}")
 
         def done_load_back(cond : bool) -> None:
             self._img_type_on_display = "background"
@@ -349,7 +673,8 @@ class StandardImageVisualizer(AbstractImageVisualizer):
             """Connect SigHelper signals to Visualizer callbacks"""
             signal.finished.connect(self.load_canvas)
 
-        threaded_task.load_from_hololist(self._window, holo_num, connect_signal)    
+        threaded_task.load_from_hololist(self._window, holo_num, connect_signal)
+        self._prefetch_display(holo_num)
 
     def _load_canvas_recon(self) -> None:
         """Load Reconstructed Images from Inline mode, then update the Canvas"""
@@ -361,4 +686,5 @@ class StandardImageVisualizer(AbstractImageVisualizer):
             """Connect SigHelper signals to Visualizer callbacks"""
             signal.finished.connect(self.load_canvas)
         
-        threaded_task.load_canvas_recon(self._window, self._img_idx_on_display, connect_signal)
\ No newline at end of file
+        threaded_task.load_canvas_recon(self._window, self._img_idx_on_display, connect_signal,
+                                        self._canvas_shape())
\ No newline at end of file
@@ -4,6 +4,8 @@ from typing import Optional, Any
 from PyQt5.QtCore import pyqtSignal, QObject
 from gui.gui_threading import Task
 from gui.main_window import Window
+from dhm.live import is_tiff_name
+from visualizer.preview import PROGRESS_INTERVAL, Throttle
 
 class SigHelper(QObject):
     finished = pyqtSignal(bool)
@@ -50,38 +52,45 @@ def isReadablePath(file_path) -> bool:
     except TypeError:
         return False
 
-def process_dhm_thread(window:Window, proc_start: int, proc_end: int, connect_signal) -> None:
+def process_dhm_thread(window:Window, proc_start: int, proc_end: int, connect_signal, preview=None) -> None:
     """Spawn new thread for processing DHM images and saving the files.
-        signals progressbar and display indeices, update canvas image"""
+        signals progressbar, display indeices, time per frame and stage timings at most every PROGRESS_INTERVAL
+        seconds, offers every processed frame to the preview (a PreviewPipe), which updates the canvas image.
+        The mean stage times of the run are appended to the timing log at the end."""
     holo_proc = window.get_dhm()
 
     class SigHelper(QObject):
         finished = pyqtSignal()
-        idx = pyqtSignal(int)
-        time = pyqtSignal(float)
-        num = pyqtSignal(int)
-        show = pyqtSignal()
+        # progress bar value, last processed image, seconds per image, moving average seconds of every stage
+        progress = pyqtSignal(int, int, float, dict)
 
     class ProcessDHMTask(ImageTask):
         def compute(self) -> Optional[Any]:
-            for holo_num in range(proc_start,proc_end+1):
-                if holo_proc.get_block() == True:
-                    return holo_num
-                t = time.time()
-                f"image {holo_num}"
-                if holo_proc.get_dhm_mode() == "Offaxis":
-                    holo_proc.hologram_process(holo_num, False)
-                else:
-                    holo_proc.hologram_inline_process(holo_num, False)
-                    diffract_dist = holo_proc.get_diffraction_dist()
-                idx = int((holo_num-proc_start)/(proc_end-proc_start)*100) if proc_end>proc_start else 1.0
-                if holo_proc.get_block() == False:
-                    self._sig.time.emit(time.time()-t)
-                self._sig.idx.emit(idx)
-                self._sig.num.emit(holo_num)
-                self._sig.show.emit()
-
-            return holo_proc.get_save_path() if holo_proc.get_block() == False else holo_num
+            throttle = Throttle(PROGRESS_INTERVAL)
+            t = time.time(); frames = 0
+            holo_proc.start_timing_run()
+            try:
+                for holo_num in range(proc_start,proc_end+1):
+                    if holo_proc.get_block() == True:
+                        return holo_num
+                    if holo_proc.get_dhm_mode() == "Offaxis":
+                        holo_proc.hologram_process(holo_num, False)
+                    else:
+                        holo_proc.hologram_inline_process(holo_num, False)
+                    frames += 1
+                    if preview is not None:
+                        preview.offer(holo_num, final=holo_num == proc_end)
+                    if throttle.ready(force=holo_num == proc_end) and holo_proc.get_block() == False:
+                        idx = int((holo_num-proc_start)/(proc_end-proc_start)*100) if proc_end>proc_start else 1
+                        self._sig.progress.emit(idx, holo_num, (time.time()-t)/frames, holo_proc.get_stage_timings())
+                        t = time.time(); frames = 0
+
+                return holo_proc.get_save_path() if holo_proc.get_block() == False else holo_num
+            finally:
+                holo_proc.log_timing_run()
+                holo_proc.close_outputs()
+                if preview is not None:
+                    preview.close()
 
         def on_finished(self, result: Any) -> None:
             if holo_proc.get_block() == True:
@@ -99,33 +108,110 @@ def process_dhm_thread(window:Window, proc_start: int, proc_end: int, connect_si
     window.get_scheduler().add_task(img_task) 
 
 
+def live_process_thread(window: Window, connect_signal, preview=None) -> None:
+    """Spawn new thread watching the hologram directory, processing new DHM images as they are
+    completely written. Runs until the blocking call is set, signals latency and offers every processed
+    frame to the preview (a PreviewPipe), which updates the canvas image"""
+    from dhm import live
+    holo_proc = window.get_dhm()
+    latency_target, skip_frames, poll_interval = holo_proc.get_live_param()
+    watcher = live.FolderWatcher(holo_proc.get_read_path(), known=holo_proc.HOLO_LIST)
+    frame_queue = live.LiveQueue(latency_target, skip_frames)
+
+    class SigHelper(QObject):
+        finished = pyqtSignal()
+        total = pyqtSignal(int)
+        skipped = pyqtSignal(int)
+        latency = pyqtSignal(float)
+
+    class LiveDHMTask(ImageTask):
+        def compute(self) -> Optional[Any]:
+            holo_idx = {name: idx for idx, name in enumerate(holo_proc.HOLO_LIST)}
+            processed = 0
+            holo_proc.start_timing_run()
+            try:
+                while holo_proc.get_block() == False:
+                    new_frames = watcher.poll()
+                    if len(new_frames) > 0:
+                        for name, _ in new_frames:
+                            holo_idx[name] = len(holo_proc.HOLO_LIST)
+                            holo_proc.HOLO_LIST.append(name)
+                        frame_queue.push(new_frames)
+                        self._sig.total.emit(len(holo_proc.HOLO_LIST))
+
+                    frame, skipped = frame_queue.pop()
+                    if skipped > 0:
+                        self._sig.skipped.emit(skipped)
+                    if frame is None:
+                        time.sleep(poll_interval)
+                        continue
+
+                    holo_num = holo_idx[frame[0]]
+                    if holo_proc.get_dhm_mode() == "Offaxis":
+                        holo_proc.hologram_process(holo_num, False)
+                    else:
+                        holo_proc.hologram_inline_process(holo_num, False)
+                    processed += 1
+                    self._sig.latency.emit(time.time() - frame[1])
+                    if preview is not None:
+                        preview.offer(holo_num, final=len(frame_queue) == 0)
+                return processed
+            finally:
+                holo_proc.log_timing_run()
+                holo_proc.close_outputs()
+                if preview is not None:
+                    preview.close()
+
+        def on_finished(self, result: Any) -> None:
+            self._sig.finished.emit()
+            popup_message("Live Imaging Stopped", f"Processed {result} new image(s) while watching the directory.")
+
+    signal = SigHelper()
+    connect_signal(signal)
+    live_task = LiveDHMTask(signal)
+    window.get_scheduler().add_task(live_task)
+
+
 def load_2d_image_series(window: Window, connect_signal) -> None:
-    """Spawn new thread for loading a 2d series from directory.
+    """Spawn new thread for loading a 2d series from a directory, a multi-page TIFF stack or a raw dump.
     check for IO correctness, sort the filename strings, update canvas image"""
 
     read_path = window.sp_dict["load_img_Spoiler"].lineEdit_read_add.text()
     holo_load = window.get_dhm()
-    filelist = []
-   
+
+    class SigHelper(QObject):
+        finished = pyqtSignal(bool)
+        progress = pyqtSignal(int, int)
+        total = pyqtSignal(int)
+
     class FileSeriesTask(ImageTask):
 
         def compute(self) -> Optional[bool]:
-            return isReadablePath(read_path)
+            """Index the directory, multi-page TIFF stack or raw dump into the HoloGram Class HOLO_LIST,
+            streaming the indexing progress and the grown series length of large directories. The first
+            hologram is loaded as soon as it is indexed, so it is on display while the rest is indexed"""
+            if not isReadablePath(read_path):
+                return False
+            holo_load.set_read_path(read_path)
+            first_loaded = False
+
+            def grown(total: int) -> None:
+                nonlocal first_loaded
+                if not first_loaded:
+                    first_loaded = holo_load.load_hologram_img(0) == 1
+                if first_loaded:
+                    self._sig.total.emit(total)
+
+            try:
+                holo_load.load_series(self._sig.progress.emit, grown)
+            except (OSError, ValueError):
+                holo_load.HOLO_LIST.clear()
+            return True
 
         def on_finished(self, result: Any) -> None:
-            """Load the filenames into the HoloGram Class HOLO_LIST"""
-            # if directory not readable, return
+            # if path not readable, return
             if not result:
                 return
-            window.text_info_show.setText(f"Loading DHM List...")
-            for (_, _, filenames) in os.walk(read_path):
-                filelist.extend(filenames)
-                break
-            holo_load.set_read_path(read_path)
-            holo_load.HOLO_LIST.clear()
-            for file in filelist:
-                holo_load.HOLO_LIST.append(file) if file.lower().endswith(".tif")\
-                or file.lower().endswith(".tiff") else file
             # if does not contain tiff files, return
             if len(holo_load.HOLO_LIST) == 0:
                 window.text_info_show.setText(f"Please Navigate to directory containing hologram images...")
@@ -139,21 +225,28 @@ def load_2d_image_series(window: Window, connect_signal) -> None:
 
 
 def load_background(window: Window, connect_signal) -> None:
-    """Spawn new thread for loading background image from the specified file path.
-    check for IO correctness, load into HoloGram class, and update canvas image"""
+    """Spawn new thread for loading background image from the specified file path, or averaging the frames of a
+    directory or multi-page stack. check for IO correctness, load into HoloGram class, and update canvas image"""
 
     back_path = window.sp_dict["load_img_Spoiler"].lineEdit_local_read.text()
     holo_load = window.get_dhm()
 
+    class SigHelper(QObject):
+        finished = pyqtSignal(bool)
+        progress = pyqtSignal(int, int)
+
     class FileIOTask(ImageTask):
 
         def compute(self) -> Optional[int]:
-            if not isReadableFile(back_path):
+            if os.path.isdir(back_path):
+                if not isReadablePath(back_path) or not any(is_tiff_name(name) for name in os.listdir(back_path)):
+                    return -4 # return at a directory without background frames
+            elif not isReadableFile(back_path):
                 return -4 # return at an incomplete path
-            if os.path.splitext(back_path)[1] != (".tiff" or ".tif"):
+            elif os.path.splitext(back_path)[1].lower() not in (".tiff", ".tif"):
                 return -3
             holo_load.set_back_path(back_path)
-            return holo_load.set_background_img()
+            return holo_load.set_background_img(self._sig.progress.emit)
 
         def on_finished(self, result: Any) -> None:
             if result == 1:
@@ -200,8 +293,9 @@ def load_from_hololist(window: Window, holo_num: int, connect_signal) -> None:
     window.get_scheduler().add_task(img_task)
 
 
-def load_canvas_recon(window : Window, holo_num: int, connect_signal) -> None:
-    """Load Reconstructed Images from Inline mode, then update the Canvas"""
+def load_canvas_recon(window : Window, holo_num: int, connect_signal, max_shape=None) -> None:
+    """Load Reconstructed Images from Inline mode, then update the Canvas. With max_shape (the canvas size in
+    pixels), saved pyramids are read at the level that fits it"""
     holo_load = window.get_dhm()
     if holo_num < holo_load.get_range_start() or holo_num > holo_load.get_range_end():
         window.text_info_show.setText(f"Reconstruction slice not computed at the distance specified.")
@@ -213,7 +307,7 @@ def load_canvas_recon(window : Window, holo_num: int, connect_signal) -> None:
     class LoadReconTask(ImageTask):
 
         def compute(self) -> Optional[bool]:
-            return holo_load.load_reconstruction_img(holo_num, recon_num)
+            return holo_load.load_reconstruction_img(holo_num, recon_num, max_shape)
 
         def on_finished(self, result: Any):
             if result == -1:
@@ -228,4 +322,108 @@ def load_canvas_recon(window : Window, holo_num: int, connect_signal) -> None:
     img_task = LoadReconTask(signal)
     connect_signal(signal)
     window.get_scheduler().add_task(img_task)
-    window.sp_dict["process_dhm_Spoiler"].pushButton_recon_peek.setEnabled(False)
\ No newline at end of file
+    window.sp_dict["process_dhm_Spoiler"].pushButton_recon_peek.setEnabled(False)
+
+def refocus_thread(window: Window, request, connect_signal) -> None:
+    """Spawn new thread refocusing the hologram at the distances of the request (a RefocusRequest), the newest one
+    first, until none is left. Signals the distance with the decimated wrapped phase and intensity of previews
+    and the full-resolution shape, or without images when the maps are set at full resolution."""
+    from visualizer import refocus
+    holo_proc = window.get_dhm()
+
+    class SigHelper(QObject):
+        finished = pyqtSignal(int)
+        refocused = pyqtSignal(float, object, object) # distance, preview wrapped phase and intensity or None, shape
+
+    class RefocusTask(ImageTask):
+        def compute(self) -> Optional[int]:
+            while True:
+                taken = request.take()
+                if taken is None:
+                    return 1
+                generation, (holo_num, distance, full) = taken
+                ret = holo_proc.prepare_refocus(holo_num)
+                if ret != 1:
+                    return ret
+                if request.is_superseded(generation):
+                    continue
+                field_shape = holo_proc.get_refocus_shape()
+                pad = holo_proc.get_params().apo_pad_size
+                full_shape = (field_shape[0] - 2 * pad, field_shape[1] - 2 * pad)
+                if full:
+                    holo_proc.refocus_img(distance)
+                    preview = None
+                else:
+                    preview = holo_proc.refocus_preview(distance, refocus.preview_factor(field_shape))
+                if not request.is_superseded(generation):
+                    self._sig.refocused.emit(distance, preview, full_shape)
+
+        def on_finished(self, result: Any) -> None:
+            if result == -1:
+                popup_message("File Reading Error", "The loaded file can not be identified as an image.")
+            elif result == -2:
+                popup_message("File Not Found", "The previously imported file is nolonger found in the directory.")
+            self._sig.finished.emit(result)
+
+        def on_error(self, e: BaseException) -> None:
+            self._sig.finished.emit(-3)
+            super().on_error(e)
+
+    signal = SigHelper()
+    connect_signal(signal)
+    refocus_task = RefocusTask(signal)
+    window.get_scheduler().add_task(refocus_task)
+
+def load_inline_sections(window: Window, holo_num: int, row: int, column: int, connect_signal) -> None:
+    """Spawn new thread computing the XZ and YZ sections of the inline volume of a hologram through the row and
+    the column, then signal them"""
+    holo_proc = window.get_dhm()
+    window.text_info_show.setText(f"Computing the orthogonal view of image {holo_num+1}...")
+
+    class SigHelper(QObject):
+        sectioned = pyqtSignal(int, int) # row, column
+
+    class SectionTask(ImageTask):
+        def compute(self) -> Optional[int]:
+            return holo_proc.load_inline_sections(holo_num, row, column)
+
+        def on_finished(self, result: Any) -> None:
+            if result == -1:
+                popup_message("File Reading Error", "The loaded file can not be identified as an image.")
+                return
+            elif result == -2:
+                popup_message("File Not Found", "The previously imported file is nolonger found in the directory.")
+                return
+            elif result == -3:
+                popup_message("No Reconstruction Distances", "Please set the reconstruction distances and slice "
+                              "quantity first.")
+                return
+            self._sig.sectioned.emit(row, column)
+
+    signal = SigHelper()
+    connect_signal(signal)
+    section_task = SectionTask(signal)
+    window.get_scheduler().add_task(section_task)
+
+def prepare_spectrum(window: Window, holo_num: int, connect_signal) -> None:
+    """Spawn new thread computing the spectrum of a hologram for the sideband preview"""
+    holo_proc = window.get_dhm()
+    window.text_info_show.setText(f"Computing the spectrum of image {holo_num+1}...")
+
+    class SpectrumTask(ImageTask):
+        def compute(self) -> Optional[int]:
+            return holo_proc.prepare_spectrum(holo_num)
+
+        def on_finished(self, result: Any) -> None:
+            if result == -1:
+                popup_message("File Reading Error", "The loaded file can not be identified as an image.")
+                return
+            elif result == -2:
+                popup_message("File Not Found", "The previously imported file is nolonger found in the directory.")
+                return
+            self._sig.finished.emit(result)
+
+    signal = SigHelper()
+    connect_signal(signal)
+    spectrum_task = SpectrumTask(signal)
+    window.get_scheduler().add_task(spectrum_task)